@@ -2,22 +2,50 @@ from layers import *
 from rnn_layers import *
 from models import Model
 
-def SentimentNet(word_to_idx):
+def SentimentNet(word_to_idx, sparse_embedding=False, embedding_size=200, units=50, hidden_size=32):
     """Construct a RNN model for sentiment analysis
 
     # Arguments:
         word_to_idx: A dictionary giving the vocabulary. It contains V entries,
             and maps each string to a unique integer in the range [0, V).
+        sparse_embedding: boolean, let the optimizer update only the embedding rows
+            of the words in each batch (lazy row-sparse updates)
+        embedding_size: int, the size of the word embeddings
+        units: int, the hidden units of each direction of the RNN
+        hidden_size: int, the outputs of the fully connected layer before the pooling
     # Returns
         model: the constructed model
     """
     vocab_size = len(word_to_idx)
 
     model = Model()
-    model.add(FCLayer(vocab_size, 200, name='embedding', initializer=Guassian(std=0.01)))
-    model.add(BidirectionalRNN(RNNCell(in_features=200, units=50, initializer=Guassian(std=0.01))))
-    model.add(FCLayer(100, 32, name='fclayer1', initializer=Guassian(std=0.01)))
+    model.add(FCLayer(vocab_size, embedding_size, name='embedding', initializer=Guassian(std=0.01), sparse_grad=sparse_embedding))
+    model.add(BidirectionalRNN(RNNCell(in_features=embedding_size, units=units, initializer=Guassian(std=0.01))))
+    model.add(FCLayer(2*units, hidden_size, name='fclayer1', initializer=Guassian(std=0.01)))
     model.add(TemporalPooling()) # defined in layers.py
-    model.add(FCLayer(32, 2, name='fclayer2', initializer=Guassian(std=0.01)))
+    model.add(FCLayer(hidden_size, 2, name='fclayer2', initializer=Guassian(std=0.01)))
     
-    return model
\ No newline at end of file
+    return model
+
+
+def PooledEmbeddingNet(word_to_idx, embedding_size=64, sparse_embedding=False):
+    """Construct a bag-of-words model: the mean of the word embeddings followed by a linear classifier
+
+    Every time step is independent, so it runs without the sequential recurrence of
+    SentimentNet. Meant as the student of a distilled SentimentNet (see distillation.py).
+
+    # Arguments:
+        word_to_idx: A dictionary giving the vocabulary, as SentimentNet.
+        embedding_size: int, the size of the word embeddings
+        sparse_embedding: boolean, as SentimentNet
+    # Returns
+        model: the constructed model
+    """
+    vocab_size = len(word_to_idx)
+
+    model = Model()
+    model.add(FCLayer(vocab_size, embedding_size, name='embedding', initializer=Guassian(std=0.01), sparse_grad=sparse_embedding))
+    model.add(TemporalPooling())
+    model.add(FCLayer(embedding_size, 2, name='fclayer', initializer=Guassian(std=0.01)))
+
+    return model
@@ -0,0 +1,241 @@
+"""
+This file defines the throughput autotuner of the training and evaluation batch sizes, the
+BLAS and layer threads and the loader prefetch depth, whose result `Model.train(tuned=...)` reuses.
+
+    python autotune.py --output autotune.json
+    python autotune.py --synthetic --vocab 4000 --memory-limit 2048 --output autotune.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import time
+import tracemalloc
+import warnings
+import numpy as np
+from parallel import Prefetcher, threadpool_limits
+
+TUNED_KEYS = ('train_batch', 'val_batch', 'test_batch', 'prefetch', 'num_threads', 'blas_threads')
+
+
+def host_info():
+    """The properties of the machine a tuning result is only valid for"""
+    return {
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'numpy': np.__version__,
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def _configure(model, input_shape, num_threads, blas_threads):
+    # set_num_threads rebuilds the plan for model.input_shape
+    model.input_shape = input_shape
+    model.set_num_threads(num_threads, blas_threads)
+
+
+def _train_step(model, loader, iteration):
+    x, y = next(loader)
+    model.forward(x, y)
+    model.backward(y)
+    model.update(model.optimizer, iteration)
+
+
+def optimizer_nbytes(optimizer):
+    """Bytes of the state arrays of an optimizer (moments, accumulators, buffers, ...)"""
+    nbytes = 0
+    for states in vars(optimizer).values():
+        if isinstance(states, dict):
+            nbytes += sum(v.nbytes for v in states.values() if isinstance(v, np.ndarray))
+    return nbytes
+
+
+def _traced_peak(fn):
+    """Peak bytes allocated by fn above the memory in use when it starts"""
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = tracemalloc.get_traced_memory()[0]
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] - start
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+
+
+def train_trial(model, dataset, batch, prefetch, trial_time, min_steps=3):
+    """Time training steps of model for about trial_time seconds
+
+    # Returns
+        trial: dictionary with 'samples_per_sec', 'steps' and 'memory', the bytes of the
+            parameters, gradients and optimizer state plus the peak allocated by the first two steps
+    """
+    loader = dataset.train_loader(batch)
+    if prefetch:
+        loader = Prefetcher(loader, prefetch)
+    try:
+        # the first step may allocate the optimizer state, its buffers and the replicas of the thread pool:
+        # they are traced, the state allocated before (e.g. by earlier trials) is counted explicitly
+        memory = model.flat_params.nbytes + model.flat_grads.nbytes + optimizer_nbytes(model.optimizer)
+        memory += _traced_peak(lambda: (_train_step(model, loader, 0), _train_step(model, loader, 1)))
+        steps = 0
+        start = time.perf_counter()
+        while steps < min_steps or time.perf_counter() - start < trial_time:
+            _train_step(model, loader, steps)
+            steps += 1
+        seconds = time.perf_counter() - start
+    finally:
+        if prefetch:
+            loader.close()
+    return {'samples_per_sec': steps * batch / seconds, 'steps': steps, 'memory': memory}
+
+
+def eval_trial(model, dataset, batch, trial_time, min_passes=2):
+    """Time Model.evaluate over the validation set with batches of batch samples, loading included
+
+    # Returns
+        trial: dictionary with 'samples_per_sec', 'passes' and 'memory'
+    """
+    evaluate = lambda: model.evaluate(dataset.val_loader(batch), batch, dataset.num_val)
+    evaluate()
+    memory = model.flat_params.nbytes + _traced_peak(evaluate)
+    passes = 0
+    start = time.perf_counter()
+    while passes < min_passes or time.perf_counter() - start < trial_time:
+        evaluate()
+        passes += 1
+    seconds = time.perf_counter() - start
+    return {'samples_per_sec': passes * dataset.num_val / seconds, 'passes': passes, 'memory': memory}
+
+
+def autotune(model, dataset, train_batches=(8, 16, 32, 64, 128), eval_batches=(50, 100, 200, 500),
+             num_threads=(1,), blas_threads=None, prefetch=(0, 1, 2), memory_limit=None, trial_time=1.0, path=None):
+    """Pick the configuration with the best training and evaluation samples/sec within a memory limit
+
+    Every combination of train batch, layer threads (Model.set_num_threads), BLAS threads
+    and prefetch depth runs training steps for trial_time seconds, then the evaluation
+    batch sizes are timed with the threads of the fastest training configuration.
+    Trials train the model, so tune a fresh or a throwaway model. The memory of a trial
+    is the traced peak of its first steps plus the parameters, gradients and optimizer
+    state; trials above
+    memory_limit are not selected. BLAS threads are only tuned when threadpoolctl
+    is installed: without it they cannot be changed, and blas_threads is ignored.
+
+    # Arguments
+        model: compiled Model
+        dataset: dataset with train_loader and val_loader
+        train_batches, eval_batches: candidate batch sizes
+        num_threads: candidate numbers of threads of Model.set_num_threads
+        blas_threads: candidate numbers of BLAS threads, None for 1 and cpu_count
+        prefetch: candidate depths of the loader prefetching (0 loads in the training thread)
+        memory_limit: int, bytes, None for no limit
+        trial_time: float, seconds of every trial
+        path: string, write the result there as JSON (see load_tuning), None to skip
+
+    # Returns
+        result: dictionary with 'config' (the keys of TUNED_KEYS), 'host', 'vocab_size',
+            'input_shape' and the 'train_trials'/'eval_trials' that were run
+    """
+    if model.input_shape is None:
+        raise ValueError('compile the model with input_shape before tuning it')
+    if threadpool_limits is None:
+        warnings.warn('threadpoolctl is not installed, the BLAS threads are not tuned')
+        blas_threads = [None]
+    elif blas_threads is None:
+        blas_threads = sorted({1, os.cpu_count() or 1})
+    sample_shape = tuple(model.input_shape[1:])
+    saved_shape, saved_executors = model.input_shape, model.executors
+
+    fits = lambda trial: memory_limit is None or trial['memory'] <= memory_limit
+    train_trials = []
+    for batch, threads, blas, depth in itertools.product(train_batches, num_threads, blas_threads, prefetch):
+        _configure(model, (batch,) + sample_shape, threads, blas)
+        trial = train_trial(model, dataset, batch, depth, trial_time)
+        trial.update(train_batch=batch, num_threads=threads, blas_threads=blas, prefetch=depth)
+        train_trials.append(trial)
+        print('train batch=%-5d threads=%-3d blas=%-4s prefetch=%-3d %10.1f samples/sec %10.1f MB%s'%(
+            batch, threads, blas, depth, trial['samples_per_sec'], trial['memory']/2**20, '' if fits(trial) else '  over limit'))
+    candidates = [t for t in train_trials if fits(t)]
+    if not candidates:
+        raise ValueError('no training configuration fits in {} bytes'.format(memory_limit))
+    best = max(candidates, key=lambda t: t['samples_per_sec'])
+
+    eval_trials = []
+    for batch in eval_batches:
+        _configure(model, (batch,) + sample_shape, best['num_threads'], best['blas_threads'])
+        trial = eval_trial(model, dataset, batch, trial_time)
+        trial.update(eval_batch=batch)
+        eval_trials.append(trial)
+        print('eval  batch=%-5d %10.1f samples/sec %10.1f MB%s'%(
+            batch, trial['samples_per_sec'], trial['memory']/2**20, '' if fits(trial) else '  over limit'))
+    eval_candidates = [t for t in eval_trials if fits(t)]
+    eval_batch = max(eval_candidates, key=lambda t: t['samples_per_sec'])['eval_batch'] if eval_candidates else min(eval_batches)
+
+    model.executors = saved_executors
+    model.build_plan(saved_shape)
+    config = {k: best[k] for k in ('train_batch', 'prefetch', 'num_threads', 'blas_threads')}
+    config.update(val_batch=eval_batch, test_batch=eval_batch)
+    result = {'config': config, 'host': host_info(), 'vocab_size': sample_shape[-1], 'input_shape': sample_shape,
+              'memory_limit': memory_limit, 'train_trials': train_trials, 'eval_trials': eval_trials}
+    if path:
+        with open(path, 'w') as f:
+            json.dump(result, f, indent=2)
+    return result
+
+
+def load_tuning(tuned, input_shape=None):
+    """Configuration of an autotune result, None if it was tuned for another host or input shape
+
+    # Arguments
+        tuned: dictionary returned by autotune or path of its JSON file
+        input_shape: tuple, shape of a batch of inputs of the model to train, None to skip the check
+
+    # Returns
+        config: dictionary with the keys of TUNED_KEYS, or None
+    """
+    if isinstance(tuned, str):
+        with open(tuned) as f:
+            tuned = json.load(f)
+    if tuned['host'] != host_info():
+        print('Ignore the tuning of another host: {}'.format(tuned['host']))
+        return None
+    if input_shape is not None and tuple(tuned['input_shape']) != tuple(input_shape[1:]):
+        print('Ignore the tuning of inputs with shape {}'.format(tuple(tuned['input_shape'])))
+        return None
+    return tuned['config']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--train-batch', type=int, nargs='+', default=[8, 16, 32, 64, 128])
+    parser.add_argument('--eval-batch', type=int, nargs='+', default=[50, 100, 200, 500])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1], help='threads of Model.set_num_threads')
+    parser.add_argument('--blas-threads', type=int, nargs='+', default=None)
+    parser.add_argument('--prefetch', type=int, nargs='+', default=[0, 1, 2])
+    parser.add_argument('--memory-limit', type=float, default=None, help='MB')
+    parser.add_argument('--trial-time', type=float, default=1.0, help='seconds of every trial')
+    parser.add_argument('--synthetic', action='store_true', help='tune on random sentences instead of data/corpus.csv')
+    parser.add_argument('--vocab', type=int, default=800, help='vocabulary size of --synthetic')
+    parser.add_argument('--output', default='autotune.json')
+    args = parser.parse_args()
+
+    from applications import SentimentNet
+    from loss import SoftmaxCrossEntropy, L2
+    from optimizers import Adam
+    np.random.seed(5242)
+    if args.synthetic:
+        from benchmarks.common import SyntheticSentiment
+        dataset = SyntheticSentiment(num_train=2000, num_val=500, num_test=500, vocab_size=args.vocab)
+    else:
+        from utils import datasets
+        dataset = datasets.Sentiment()
+    model = SentimentNet(dataset.dictionary)
+    model.compile(optimizer=Adam(lr=0.001), loss=SoftmaxCrossEntropy(num_class=2), regularization=L2(w=0.001),
+                  input_shape=(args.train_batch[0], 30, len(dataset.dictionary)))
+    memory_limit = int(args.memory_limit * 2**20) if args.memory_limit else None
+    result = autotune(model, dataset, args.train_batch, args.eval_batch, args.threads, args.blas_threads,
+                      args.prefetch, memory_limit, args.trial_time, args.output)
+    print('best: {}'.format(result['config']))
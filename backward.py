@@ -13,4 +13,17 @@ in_grads = np.random.uniform(size=(N, T, H*2))
 
 rnn_cell = RNNCell(in_features=D, units=H)
 brnn = BidirectionalRNN(rnn_cell)
-check_grads_layer(brnn, x, in_grads)
\ No newline at end of file
+check_grads_layer(brnn, x, in_grads)
+
+# realistic sizes: random coordinates and random directions instead of every coordinate
+from utils.check_grads import check_grads_layer_sampled
+
+N, T, D, H = 16, 30, 200, 50
+x = np.random.uniform(size=(N, T, D))
+x[0, -10:, :] = np.nan
+x[1, -20:, :] = np.nan
+in_grads = np.random.uniform(size=(N, T, H*2))
+
+rnn_cell = RNNCell(in_features=D, units=H)
+brnn = BidirectionalRNN(rnn_cell)
+check_grads_layer_sampled(brnn, x, in_grads, num_samples=50, num_directions=5, processes=4)
@@ -0,0 +1,129 @@
+"""
+Shared helpers for the benchmark scripts. Run the benchmarks from the repository root, e.g.
+    python -m benchmarks.data_parallel
+"""
+import os
+import platform
+import time
+import numpy as np
+
+
+class SyntheticSentiment():
+
+    def __init__(self, num_train=2000, num_val=200, num_test=200, vocab_size=800, max_length=30, seed=5242):
+        """Random token sequences with the same loader interface as utils.datasets.Sentiment
+
+        Needs no corpus, pandas or nltk, so the benchmarks run offline.
+
+        # Arguments
+            num_train, num_val, num_test: int, the number of samples of each split
+            vocab_size: int, the number of words (V)
+            max_length: int, time steps (T) of every encoded sentence
+        """
+        rng = np.random.RandomState(seed)
+        self.vocab_size = vocab_size
+        self.max_length = max_length
+        self.dictionary = {'w%d'%i: i+1 for i in range(vocab_size)}
+        self.num_train = num_train
+        self.num_val = num_val
+        self.num_test = num_test
+        self.x_train, self.y_train = self._sample(rng, num_train)
+        self.x_val, self.y_val = self._sample(rng, num_val)
+        self.x_test, self.y_test = self._sample(rng, num_test)
+
+    def _sample(self, rng, num):
+        lengths = rng.randint(3, self.max_length+1, size=num)
+        ids = rng.randint(1, self.vocab_size+1, size=(num, self.max_length))
+        ids[np.arange(self.max_length)[None, :] >= lengths[:, None]] = 0
+        # make the label learnable: positive sentences are dominated by the lower half of the vocabulary
+        labels = (np.sum((ids > 0) & (ids <= self.vocab_size//2), axis=1) * 2 > lengths).astype(np.int32)
+        return ids, labels
+
+    def encode_ids(self, ids, max_length=None):
+        """The samples are stored as word indices already, see utils.datasets.Sentiment.encode_ids"""
+        return ids
+
+    def _one_hot_encoding(self, ids):
+        batch = ids.shape[0]
+        one_hot = np.zeros((batch, self.max_length, self.vocab_size), dtype=np.float32)
+        n, t = np.nonzero(ids)
+        one_hot[n, t, ids[n, t]-1] = 1
+        one_hot[ids == 0, :] = np.nan
+        return one_hot
+
+    def train_loader(self, batch, shuffle=True, shard=None):
+        pointer = 0
+        while True:
+            if shuffle:
+                idx = np.random.choice(self.num_train, batch, replace=False)
+            else:
+                if pointer+batch > self.num_train:
+                    pointer = 0
+                idx = np.arange(pointer, pointer+batch)
+                pointer = pointer + batch
+            if shard is not None:
+                rank, num_shards = shard
+                idx = idx[rank::num_shards]
+            yield self._one_hot_encoding(self.x_train[idx]), self.y_train[idx]
+
+    def _eval_loader(self, x, y, batch):
+        for pointer in range(0, len(x), batch):
+            yield self._one_hot_encoding(x[pointer:pointer+batch]), y[pointer:pointer+batch]
+
+    def val_loader(self, batch):
+        return self._eval_loader(self.x_val, self.y_val, batch)
+
+    def test_loader(self, batch):
+        return self._eval_loader(self.x_test, self.y_test, batch)
+
+
+def build_model(dataset, lr=0.001, sparse_embedding=False):
+    """A compiled SentimentNet with the optimizer, loss and regularization of process.py
+
+    sparse_embedding: boolean, see applications.SentimentNet
+    """
+    from applications import SentimentNet
+    from loss import SoftmaxCrossEntropy, L2
+    from optimizers import Adam
+
+    model = SentimentNet(dataset.dictionary, sparse_embedding=sparse_embedding)
+    model.compile(optimizer=Adam(lr=lr), loss=SoftmaxCrossEntropy(num_class=2), regularization=L2(w=0.001))
+    return model
+
+
+def machine_info():
+    """Metadata recorded next to every benchmark result"""
+    return {
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def time_call(fn, min_time=0.05, repeat=5):
+    """Seconds per call of fn, timeit style
+
+    fn is called in loops long enough to last min_time, repeat times.
+
+    # Returns
+        timing: dictionary with 'min' and 'median' seconds per call, 'number' calls per loop and 'repeat'
+    """
+    fn()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 10**6:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    times = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+    return {'min': min(times), 'median': float(np.median(times)), 'number': number, 'repeat': repeat}
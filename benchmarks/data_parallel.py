@@ -0,0 +1,49 @@
+"""
+Scaling curve of parallel.DataParallel: training samples/sec against the number of worker processes.
+
+    python -m benchmarks.data_parallel --workers 1 2 4 8 --batch 64
+"""
+import argparse
+import json
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.common import SyntheticSentiment, build_model, machine_info
+from parallel import DataParallel
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--batch', type=int, default=64)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--vocab', type=int, default=800)
+    parser.add_argument('--output', default=None, help='write the results as JSON')
+    args = parser.parse_args()
+
+    dataset = SyntheticSentiment(num_train=args.batch*args.iterations, num_val=args.batch, num_test=args.batch, vocab_size=args.vocab)
+    results = []
+    for workers in args.workers:
+        np.random.seed(5242)
+        model = build_model(dataset)
+        trainer = DataParallel(model, num_workers=workers)
+        trainer.train(dataset, train_batch=args.batch, val_batch=args.batch, test_batch=args.batch, epochs=1,
+                      val_intervals=10**9, test_intervals=10**9, print_intervals=10**9)
+        results.append({'workers': workers, 'samples_per_sec': trainer.samples_per_sec})
+
+    base = results[0]['samples_per_sec'] / args.workers[0]
+    print('workers\tsamples/sec\tspeedup\tefficiency')
+    for r in results:
+        r['speedup'] = r['samples_per_sec'] / base
+        r['efficiency'] = r['speedup'] / r['workers']
+        print('%d\t%.1f\t\t%.2f\t%.2f'%(r['workers'], r['samples_per_sec'], r['speedup'], r['efficiency']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'machine': machine_info(), 'batch': args.batch, 'vocab': args.vocab, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
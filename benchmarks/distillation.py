@@ -0,0 +1,85 @@
+"""
+Accuracy gap and speedup of a pooled-embedding student distilled from a trained SentimentNet.
+
+The speedup is measured twice: with Model.evaluate on one-hot batches, and with both models
+exported to the standalone runtime, where the embedding is a row gather and the student
+skips the recurrence entirely.
+
+    python -m benchmarks.distillation --epochs 2 --student-epochs 3 --output distillation.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.common import SyntheticSentiment, build_model, machine_info
+from applications import PooledEmbeddingNet
+from loss import SoftTargetCrossEntropy
+from optimizers import Adam
+from distillation import distill, distillation_report
+from export import export_model
+import runtime
+
+
+def runtime_seconds(model, dataset, batch, repeat=3):
+    """Best time of one pass of the exported model over the test set in the standalone runtime"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'model.npz')
+        export_model(model, dataset.dictionary, path)
+        scorer = runtime.load(path)
+    ids = dataset.x_test
+    lengths = np.sum(ids > 0, axis=1)
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for pointer in range(0, len(ids), batch):
+            scorer.forward(ids[pointer:pointer+batch], lengths[pointer:pointer+batch])
+        seconds = min(seconds, time.perf_counter() - start)
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--epochs', type=int, default=2, help='epochs of the teacher')
+    parser.add_argument('--student-epochs', type=int, default=3)
+    parser.add_argument('--embedding', type=int, default=64, help='embedding size of the student')
+    parser.add_argument('--temperature', type=float, default=2.0)
+    parser.add_argument('--hard-weight', type=float, default=0.0)
+    parser.add_argument('--batch', type=int, default=100)
+    parser.add_argument('--vocab', type=int, default=800)
+    parser.add_argument('--output', default=None, help='write the results as JSON')
+    args = parser.parse_args()
+
+    np.random.seed(5242)
+    dataset = SyntheticSentiment(num_train=3200, num_val=400, num_test=400, vocab_size=args.vocab)
+    teacher = build_model(dataset, lr=0.003)
+    teacher.train(dataset, train_batch=32, val_batch=args.batch, test_batch=args.batch, epochs=args.epochs,
+                  val_intervals=10**9, test_intervals=10**9, print_intervals=10**9)
+    student = PooledEmbeddingNet(dataset.dictionary, embedding_size=args.embedding)
+    student.compile(optimizer=Adam(lr=0.01), loss=SoftTargetCrossEntropy(num_class=2, temperature=args.temperature))
+    distill(teacher, student, dataset, train_batch=32, epochs=args.student_epochs, hard_weight=args.hard_weight,
+            val_batch=args.batch, val_intervals=10**9, print_intervals=10**9)
+    report = distillation_report(teacher, student, dataset, batch=args.batch)
+    report['runtime'] = {name: runtime_seconds(m, dataset, args.batch) for name, m in (('teacher', teacher), ('student', student))}
+    report['runtime']['speedup'] = report['runtime']['teacher'] / report['runtime']['student']
+
+    print('model\t\taccuracy\tloss\t\tseconds')
+    for name in ('teacher', 'student'):
+        r = report[name]
+        print('%s\t\t%.4f\t\t%.6f\t%.4f'%(name, r['accuracy'], r['loss'], r['seconds']))
+    print('speedup %.1fx, accuracy gap %.4f, agreement %.4f'%(report['speedup'], report['accuracy_gap'], report['agreement']))
+    print('runtime: teacher %.5fs, student %.5fs, speedup %.1fx'%(
+        report['runtime']['teacher'], report['runtime']['student'], report['runtime']['speedup']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'machine': machine_info(), 'vocab': args.vocab, 'batch': args.batch, 'temperature': args.temperature,
+                       'report': report}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
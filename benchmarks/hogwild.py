@@ -0,0 +1,58 @@
+"""
+Time-to-accuracy of parallel.Hogwild against single-process training.
+
+The single-process baseline is Hogwild with one worker, so both runs share the
+same evaluator and clock. The embedding is sparse (lazy row-sparse updates), so
+every step writes only the embedding rows of the words of its batch.
+
+    python -m benchmarks.hogwild --workers 4 --target 0.8
+"""
+import argparse
+import json
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.common import SyntheticSentiment, build_model, machine_info
+from parallel import Hogwild, time_to_accuracy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--batch', type=int, default=20)
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--vocab', type=int, default=800)
+    parser.add_argument('--target', type=float, default=0.8)
+    parser.add_argument('--eval-interval', type=float, default=2.0)
+    parser.add_argument('--output', default=None, help='write the results as JSON')
+    args = parser.parse_args()
+
+    dataset = SyntheticSentiment(vocab_size=args.vocab)
+    results = []
+    for workers in sorted({1, args.workers}):
+        np.random.seed(5242)
+        model = build_model(dataset, sparse_embedding=True)
+        val_results = Hogwild(model, num_workers=workers).train(
+            dataset, train_batch=args.batch, val_batch=dataset.num_val, epochs=args.epochs, eval_interval=args.eval_interval)
+        results.append({
+            'workers': workers,
+            'time_to_accuracy': time_to_accuracy(val_results, args.target),
+            'final_accuracy': float(val_results[-1, 3]),
+            'total_seconds': float(val_results[-1, 0]),
+            'curve': val_results.tolist(),
+        })
+
+    print('workers\ttime to %.2f accuracy\tfinal accuracy\ttotal seconds'%args.target)
+    for r in results:
+        tta = 'not reached' if r['time_to_accuracy'] is None else '%.1fs'%r['time_to_accuracy']
+        print('%d\t%s\t\t\t%.5f\t\t%.1f'%(r['workers'], tta, r['final_accuracy'], r['total_seconds']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'machine': machine_info(), 'target': args.target, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Peak memory of a SentimentNet training step over a grid of batch size and vocabulary size (V).
+
+    python -m benchmarks.memory --batch 8 16 32 64 --vocab 800 4000 --budget 512 --output memory.json
+
+Memory is traced with tracemalloc (Model.profile(memory=True)), so it counts the numpy
+arrays and Python objects of the process: parameters, optimizer state, activations kept
+for backward and the temporaries of every layer. The peak grows linearly with the batch,
+the largest batch fitting --budget MB is extrapolated from a least-squares line per V.
+"""
+import argparse
+import json
+import os
+import sys
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.common import SyntheticSentiment, machine_info
+from applications import SentimentNet
+from loss import SoftmaxCrossEntropy, L2
+from optimizers import Adam
+
+
+def measure(batch, vocab, steps=2):
+    """Peak traced bytes of a training step, overall, per phase and per layer call
+
+    The first step allocates the optimizer state, the peak is taken over all steps.
+    Tracing starts before the model is built so that its parameters are counted.
+    """
+    tracemalloc.start()
+    dataset = SyntheticSentiment(num_train=max(batch, 64), num_val=1, num_test=1, vocab_size=vocab)
+    model = SentimentNet(dataset.dictionary)
+    model.compile(optimizer=Adam(), loss=SoftmaxCrossEntropy(num_class=2), regularization=L2(w=0.001),
+                  input_shape=(batch, dataset.max_length, vocab))
+    loader = dataset.train_loader(batch)
+    profiler = model.profile(memory=True)
+    try:
+        for iteration in range(steps):
+            with profiler.section('data'):
+                x, y = next(loader)
+            model.forward(x, y)
+            model.backward(y)
+            model.update(model.optimizer, iteration)
+        phases = profiler.phases()
+        calls = {row['name']: {k: row[k] for k in ('peak_bytes', 'alloc_bytes', 'retained_bytes')}
+                 for row in profiler.summary()}
+    finally:
+        model.profile(False)
+        tracemalloc.stop()
+    return {'batch': batch, 'vocab': vocab, 'peak_bytes': max(phases.values()), 'phases': phases,
+            'params_bytes': model.flat_params.nbytes, 'calls': calls}
+
+
+def max_batch(results, budget):
+    """Fit peak = a + b*batch and return the largest batch within budget bytes, None if even batch 1 does not fit"""
+    batches = np.array([r['batch'] for r in results], dtype=np.float64)
+    peaks = np.array([r['peak_bytes'] for r in results], dtype=np.float64)
+    if len(results) < 2:
+        b = peaks[0] / batches[0]
+        a = 0.0
+    else:
+        b, a = np.polyfit(batches, peaks, 1)
+    if b <= 0:
+        return None, a, b
+    batch = int((budget - a) // b)
+    return (batch if batch >= 1 else None), a, b
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch', type=int, nargs='+', default=[8, 16, 32, 64])
+    parser.add_argument('--vocab', type=int, nargs='+', default=[800, 4000])
+    parser.add_argument('--steps', type=int, default=2)
+    parser.add_argument('--budget', type=float, default=512, help='memory budget in MB')
+    parser.add_argument('--verbose', action='store_true', help='print the per-layer table of every run')
+    parser.add_argument('--output', default=None, help='write the results as JSON')
+    args = parser.parse_args()
+
+    budget = args.budget * 2**20
+    results, fits = [], []
+    print('%8s %8s %12s %12s %12s %12s'%('vocab', 'batch', 'peak MB', 'forward MB', 'backward MB', 'update MB'))
+    for vocab in args.vocab:
+        runs = []
+        for batch in args.batch:
+            r = measure(batch, vocab, args.steps)
+            runs.append(r)
+            print('%8d %8d %12.3f %12.3f %12.3f %12.3f'%(vocab, batch, r['peak_bytes']/2**20,
+                  r['phases'].get('forward', 0)/2**20, r['phases'].get('backward', 0)/2**20,
+                  r['phases'].get('update', 0)/2**20))
+            if args.verbose:
+                for name, c in sorted(r['calls'].items(), key=lambda item: -item[1]['alloc_bytes']):
+                    print('    %-36s alloc %10.3f MB  retained %10.3f MB'%(name, c['alloc_bytes']/2**20, c['retained_bytes']/2**20))
+        fitted, a, b = max_batch(runs, budget)
+        measured = [r['batch'] for r in runs if r['peak_bytes'] <= budget]
+        fits.append({'vocab': vocab, 'fixed_bytes': a, 'bytes_per_sample': b, 'max_batch': fitted,
+                     'max_measured_batch': max(measured) if measured else None})
+        results.extend(runs)
+
+    print('\nbudget %.0f MB'%args.budget)
+    print('%8s %14s %16s %12s %20s'%('vocab', 'fixed MB', 'MB per sample', 'max batch', 'max measured batch'))
+    for f in fits:
+        print('%8d %14.3f %16.4f %12s %20s'%(f['vocab'], f['fixed_bytes']/2**20, f['bytes_per_sample']/2**20,
+              f['max_batch'], f['max_measured_batch']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'machine': machine_info(), 'budget_mb': args.budget, 'steps': args.steps,
+                       'results': results, 'fits': fits}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
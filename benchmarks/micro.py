@@ -0,0 +1,185 @@
+"""
+Microbenchmarks of the layers, the optimizers, the data encoding and a full SentimentNet training step
+over a grid of batch size, time steps (T), vocabulary size (V) and hidden units (H).
+
+    python -m benchmarks.micro --output baseline.json
+    python -m benchmarks.micro --output current.json --compare baseline.json --threshold 0.1
+    python -m benchmarks.micro --results current.json --compare baseline.json
+
+With --compare, the exit status is 1 when a benchmark is slower than the baseline by more
+than the threshold, so that it can gate a change.
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.common import SyntheticSentiment, machine_info, time_call
+from layers import FCLayer, TemporalPooling
+from rnn_layers import RNNCell, RNN, BidirectionalRNN
+from loss import SoftmaxCrossEntropy, L2
+from optimizers import SGD, Adam, Adagrad, RMSprop
+from models import Model
+
+EMBEDDING = 200
+
+
+def _sequences(rng, batch, T, features):
+    """Random inputs with the NaN padding of the encoded sentences"""
+    x = rng.uniform(-1, 1, size=(batch, T, features))
+    lengths = rng.randint(1, T+1, size=batch)
+    x[np.arange(T)[None, :] >= lengths[:, None]] = np.nan
+    return x
+
+
+def _sentiment_net(V, H):
+    """SentimentNet (applications.py) with H hidden units"""
+    model = Model()
+    model.add(FCLayer(V, EMBEDDING, name='embedding'))
+    model.add(BidirectionalRNN(RNNCell(in_features=EMBEDDING, units=H)))
+    model.add(FCLayer(2*H, 32, name='fclayer1'))
+    model.add(TemporalPooling())
+    model.add(FCLayer(32, 2, name='fclayer2'))
+    return model
+
+
+def _layer_pair(name, layer, inputs, in_grads):
+    return [(name+'.forward', lambda: layer.forward(inputs)),
+            (name+'.backward', lambda: layer.backward(in_grads, inputs))]
+
+
+def cases(batch, T, V, H, rng):
+    """Yield (name, params, fn) for one point of the grid, params being the grid values fn depends on"""
+    dataset = SyntheticSentiment(num_train=batch, num_val=1, num_test=1, vocab_size=V, max_length=T)
+    one_hot = dataset._one_hot_encoding(dataset.x_train)
+    y = dataset.y_train
+
+    for name, fn in _layer_pair('FCLayer', FCLayer(V, EMBEDDING), one_hot, rng.uniform(size=(batch, T, EMBEDDING))):
+        yield name, {'batch': batch, 'T': T, 'V': V}, fn
+    for name, fn in _layer_pair('TemporalPooling', TemporalPooling(), _sequences(rng, batch, T, 2*H), rng.uniform(size=(batch, 2*H))):
+        yield name, {'batch': batch, 'T': T, 'H': H}, fn
+    cell = RNNCell(EMBEDDING, H)
+    cell_inputs = [rng.uniform(size=(batch, EMBEDDING)), rng.uniform(size=(batch, H))]
+    for name, fn in _layer_pair('RNNCell', cell, cell_inputs, rng.uniform(size=(batch, H))):
+        yield name, {'batch': batch, 'H': H}, fn
+    sequences = _sequences(rng, batch, T, EMBEDDING)
+    for name, fn in _layer_pair('RNN', RNN(RNNCell(EMBEDDING, H)), sequences, rng.uniform(size=(batch, T, H))):
+        yield name, {'batch': batch, 'T': T, 'H': H}, fn
+    for name, fn in _layer_pair('BidirectionalRNN', BidirectionalRNN(RNNCell(EMBEDDING, H)), sequences, rng.uniform(size=(batch, T, 2*H))):
+        yield name, {'batch': batch, 'T': T, 'H': H}, fn
+    loss = SoftmaxCrossEntropy(num_class=2)
+    logits = rng.uniform(size=(batch, 2))
+    yield 'SoftmaxCrossEntropy.forward', {'batch': batch}, lambda: loss.forward(logits, y)
+    yield 'SoftmaxCrossEntropy.backward', {'batch': batch}, lambda: loss.backward(logits, y)
+
+    model = _sentiment_net(V, H)
+    model.compile(Adam(), SoftmaxCrossEntropy(num_class=2), L2(w=0.001), input_shape=one_hot.shape)
+    size = model.flat_params.size
+    for optimizer in (SGD(momentum=0.9), Adam(), Adagrad(), RMSprop()):
+        params = {'flat': rng.uniform(-0.1, 0.1, size=size)}
+        grads = {'flat': rng.uniform(-0.1, 0.1, size=size)}
+        yield type(optimizer).__name__+'.update', {'V': V, 'H': H}, lambda o=optimizer, p=params, g=grads: o.update(p, g, 0)
+
+    yield 'SyntheticSentiment._one_hot_encoding', {'batch': batch, 'T': T, 'V': V}, lambda: dataset._one_hot_encoding(dataset.x_train)
+    sentiment_encoding = _sentiment_encoding(dataset)
+    if sentiment_encoding is not None:
+        yield 'Sentiment._one_hot_encoding', {'batch': batch, 'V': V}, sentiment_encoding
+
+    def train_step():
+        model.forward(one_hot, y)
+        model.backward(y)
+        model.update(model.optimizer, 0)
+    yield 'SentimentNet.train_step', {'batch': batch, 'T': T, 'V': V, 'H': H}, train_step
+
+
+def _sentiment_encoding(dataset):
+    """utils.datasets.Sentiment._one_hot_encoding on the synthetic sentences, None if nltk cannot tokenize offline"""
+    try:
+        from utils import datasets
+        datasets.nltk.word_tokenize('offline check')
+    except Exception:
+        return None
+    sentiment = datasets.Sentiment.__new__(datasets.Sentiment)
+    sentiment.dictionary = dataset.dictionary
+    sentences = [' '.join('w%d'%(i-1) for i in row if i > 0) for row in dataset.x_train]
+    return lambda: sentiment._one_hot_encoding(sentences)
+
+
+def run(grid, min_time, repeat, name_filter=None):
+    rng = np.random.RandomState(5242)
+    results = {}
+    for batch, T, V, H in itertools.product(grid['batch'], grid['T'], grid['V'], grid['H']):
+        for name, params, fn in cases(batch, T, V, H, rng):
+            key = name + json.dumps(params, sort_keys=True)
+            if key in results or (name_filter and name_filter not in name):
+                continue
+            timing = time_call(fn, min_time, repeat)
+            results[key] = dict(name=name, params=params, key=key, **timing)
+            print('%-40s %-45s %12.6f ms'%(name, json.dumps(params, sort_keys=True), timing['min']*1e3))
+    return list(results.values())
+
+
+def compare(results, baseline, threshold):
+    """Print the ratio of every benchmark to the baseline, return the keys slower by more than threshold"""
+    base = {r['key']: r for r in baseline['results']}
+    regressions = []
+    print('%-80s %12s %12s %8s'%('benchmark', 'baseline ms', 'current ms', 'ratio'))
+    for r in results:
+        b = base.get(r['key'])
+        if b is None:
+            continue
+        ratio = r['min'] / b['min']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append(r['key'])
+        elif ratio < 1 - threshold:
+            flag = '  faster'
+        print('%-80s %12.6f %12.6f %8.2f%s'%(r['key'], b['min']*1e3, r['min']*1e3, ratio, flag))
+    missing = set(base) - {r['key'] for r in results}
+    if missing:
+        print('%d baseline benchmarks were not run'%len(missing))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch', type=int, nargs='+', default=[8, 32])
+    parser.add_argument('--time-steps', type=int, nargs='+', default=[30])
+    parser.add_argument('--vocab', type=int, nargs='+', default=[800, 4000])
+    parser.add_argument('--units', type=int, nargs='+', default=[50])
+    parser.add_argument('--filter', default=None, help='only run benchmarks whose name contains this string')
+    parser.add_argument('--min-time', type=float, default=0.05, help='seconds of every timing loop')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default=None, help='write the results as JSON')
+    parser.add_argument('--results', default=None, help='load results from this JSON file instead of running')
+    parser.add_argument('--compare', default=None, help='baseline JSON file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative slowdown reported as a regression')
+    args = parser.parse_args()
+
+    if args.results:
+        with open(args.results) as f:
+            results = json.load(f)['results']
+    else:
+        grid = {'batch': args.batch, 'T': args.time_steps, 'V': args.vocab, 'H': args.units}
+        results = run(grid, args.min_time, args.repeat, args.filter)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({'machine': machine_info(), 'grid': grid, 'results': results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('machine') != machine_info():
+            print('warning: the baseline was recorded on another machine or environment')
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('%d regressions above %.0f%%'%(len(regressions), args.threshold*100))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Scaling of paramserver.ParameterServer over loopback: training samples/sec against the number of
+local worker processes, in synchronous and bounded-staleness mode, with the bytes pushed per step
+at the start and at the end of the run.
+
+    python -m benchmarks.paramserver --workers 1 2 4 --staleness 2 --dtype float16
+"""
+import argparse
+import json
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.common import SyntheticSentiment, build_model, machine_info
+from paramserver import ParameterServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--staleness', type=int, nargs='+', default=[2], help='bounds to run besides synchronous mode')
+    parser.add_argument('--dtype', default='float16', help='dtype of the pushed gradients')
+    parser.add_argument('--dense', action='store_true', help='push dense gradients, without the row-sparse encoding')
+    parser.add_argument('--batch', type=int, default=64)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--vocab', type=int, default=8000, help='large enough for row-sparse embedding gradients')
+    parser.add_argument('--output', default=None, help='write the results as JSON')
+    args = parser.parse_args()
+
+    dataset = SyntheticSentiment(num_train=args.batch*args.iterations, num_val=args.batch, num_test=args.batch, vocab_size=args.vocab)
+    results = []
+    for staleness in [None] + args.staleness:
+        for workers in args.workers:
+            np.random.seed(5242)
+            model = build_model(dataset)
+            server = ParameterServer(model, num_workers=workers, staleness=staleness, dtype=np.dtype(args.dtype), row_sparse=not args.dense)
+            server.train(dataset, train_batch=args.batch, val_batch=args.batch, test_batch=args.batch, epochs=1,
+                         val_intervals=10**9, test_intervals=10**9, print_intervals=10**9)
+            results.append(dict(server.stats, mode='sync' if staleness is None else 'staleness=%d'%staleness, workers=workers,
+                                val_accuracy=float(model.val(dataset, args.batch)[1])))
+
+    print('mode\t\tworkers\tsamples/sec\tspeedup\tefficiency\tKB/push first/last\tstaleness\tval acc')
+    for r in results:
+        base = [b for b in results if b['mode'] == r['mode']][0]
+        r['speedup'] = r['samples_per_sec'] / (base['samples_per_sec'] / base['workers'])
+        r['efficiency'] = r['speedup'] / r['workers']
+        print('%-12s\t%d\t%.1f\t\t%.2f\t%.2f\t\t%.1f/%.1f\t\t%.2f\t\t%.4f'%(r['mode'], r['workers'], r['samples_per_sec'], r['speedup'],
+              r['efficiency'], r['first_bytes_per_push'] / 1024, r['last_bytes_per_push'] / 1024, r['mean_staleness'], r['val_accuracy']))
+    print('raw gradient: %.1f KB'%(results[0]['raw_bytes_per_push'] / 1024))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'machine': machine_info(), 'batch': args.batch, 'vocab': args.vocab, 'dtype': args.dtype,
+                       'row_sparse': not args.dense, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+Accuracy, latency and weight memory of an int8 quantized SentimentNet against the float model.
+
+    python -m benchmarks.quantization --epochs 2 --output quantization.json
+"""
+import argparse
+import json
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.common import SyntheticSentiment, build_model, machine_info
+from quantization import quantize_model, quantization_report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--epochs', type=int, default=2)
+    parser.add_argument('--batch', type=int, default=100)
+    parser.add_argument('--vocab', type=int, default=800)
+    parser.add_argument('--output', default=None, help='write the results as JSON')
+    args = parser.parse_args()
+
+    np.random.seed(5242)
+    dataset = SyntheticSentiment(num_train=3200, num_val=400, num_test=400, vocab_size=args.vocab)
+    model = build_model(dataset, lr=0.003)
+    model.train(dataset, train_batch=32, val_batch=args.batch, test_batch=args.batch, epochs=args.epochs,
+                val_intervals=10**9, test_intervals=10**9, print_intervals=10**9)
+    quantized = quantize_model(model, dataset, batch=args.batch)
+    report = quantization_report(model, quantized, dataset, batch=args.batch)
+
+    print('model\taccuracy\tloss\t\tseconds\t\tMB in memory')
+    for name in ('float', 'int8'):
+        r = report[name]
+        print('%s\t%.4f\t\t%.6f\t%.4f\t\t%.3f'%(name, r['accuracy'], r['loss'], r['seconds'], r['nbytes']/2**20))
+    print('speedup %.2fx, compression %.2fx in memory'%(report['speedup'], report['compression']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'machine': machine_info(), 'vocab': args.vocab, 'batch': args.batch, 'report': report}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
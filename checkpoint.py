@@ -0,0 +1,220 @@
+"""
+This file defines the checkpoint format of `Model`:
+
+    <path>/manifest.json     small JSON file: layout of the blobs, optimizer scalars, numpy RNG state, progress
+    <path>/<group>.bin       one flat binary blob per group of arrays, every array aligned to ALIGNMENT bytes
+
+Groups are 'params', one per optimizer state dictionary ('optimizer.moments',
+'optimizer.accumulators', 'optimizer.last_steps'), 'masks' for the pruning masks
+of Model.set_masks and 'results' for the training curves. Loading maps the blobs with np.memmap in copy-on-write mode,
+so no array is copied until it is written.
+"""
+import json
+import os
+import shutil
+import threading
+import numpy as np
+
+VERSION = 1
+ALIGNMENT = 64
+OPTIMIZER_STATES = ('moments', 'accumulators', 'last_steps')
+
+
+def _write_group(path, group, arrays):
+    """Write a dictionary of arrays into one blob and return its manifest entry"""
+    entries = []
+    offset = 0
+    with open(os.path.join(path, group + '.bin'), 'wb') as f:
+        for k, v in arrays.items():
+            v = np.ascontiguousarray(v)
+            padding = -offset % ALIGNMENT
+            f.write(b'\0' * padding)
+            offset += padding
+            entries.append({'key': k, 'dtype': v.dtype.str, 'shape': list(v.shape), 'offset': offset})
+            f.write(v.tobytes())
+            offset += v.nbytes
+    return {'file': group + '.bin', 'nbytes': offset, 'entries': entries}
+
+
+def _read_group(path, manifest_group):
+    """Map a blob and return a dictionary of arrays viewing it"""
+    arrays = {}
+    if manifest_group['nbytes'] == 0:
+        return arrays
+    blob = np.memmap(os.path.join(path, manifest_group['file']), dtype=np.uint8, mode='c')
+    for entry in manifest_group['entries']:
+        dtype = np.dtype(entry['dtype'])
+        nbytes = int(np.prod(entry['shape'])) * dtype.itemsize
+        arrays[entry['key']] = blob[entry['offset']:entry['offset']+nbytes].view(dtype).reshape(entry['shape'])
+    return arrays
+
+
+def optimizer_state(optimizer):
+    """Copy the state of an optimizer
+
+    # Returns
+        scalars: dictionary, the class name and the scalar attributes (iterations, schedule values)
+        states: dictionary, name in OPTIMIZER_STATES mapping to a dictionary of copied arrays, empty ones left out
+    """
+    scalars = {'class': type(optimizer).__name__}
+    states = {}
+    for k, v in vars(optimizer).items():
+        if k in OPTIMIZER_STATES:
+            if v:
+                states[k] = {name: np.array(a) for name, a in v.items()}
+        elif isinstance(v, (bool, int, float, np.number)):
+            scalars[k] = v.item() if isinstance(v, np.number) else v
+    return scalars, states
+
+
+def set_optimizer_state(optimizer, scalars, states):
+    """Restore the state returned by optimizer_state into an optimizer of the same class"""
+    if scalars['class'] != type(optimizer).__name__:
+        raise ValueError('saved optimizer is {}, model optimizer is {}'.format(scalars['class'], type(optimizer).__name__))
+    for k, v in scalars.items():
+        if k != 'class':
+            setattr(optimizer, k, v)
+    for k, v in states.items():
+        setattr(optimizer, k, v)
+
+
+def snapshot(model, iteration=0, results=None):
+    """Copy everything a checkpoint needs, so that training can go on while it is written
+
+    # Arguments
+        model: compiled Model
+        iteration: int, the next iteration to run in the whole training process
+        results: dictionary, e.g. {'train': train_results, 'val': val_results, 'test': test_results}
+
+    # Returns
+        state: dictionary, to be passed to write_checkpoint
+    """
+    params, _ = model.get_params(with_grads=False)
+    groups = {'params': {k: np.array(v) for k, v in params.items()}}
+    if model.masks:
+        groups['masks'] = {k: np.array(v) for k, v in model.masks.items()}
+    optimizer, states = optimizer_state(model.optimizer)
+    for k, v in states.items():
+        groups['optimizer.' + k] = v
+    if results:
+        groups['results'] = {k: np.array(v, dtype=np.float64).reshape(-1, 3) for k, v in results.items()}
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    rng = {'name': name, 'keys': keys.tolist(), 'pos': int(pos),
+           'has_gauss': int(has_gauss), 'cached_gaussian': float(cached_gaussian)}
+    return {'iteration': iteration, 'optimizer': optimizer, 'rng': rng, 'groups': groups}
+
+
+def write_checkpoint(path, state):
+    """Write a snapshot into the directory path, replacing an existing checkpoint atomically"""
+    tmp_path = path.rstrip(os.sep) + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    manifest = {
+        'version': VERSION,
+        'iteration': state['iteration'],
+        'optimizer': state['optimizer'],
+        'rng': state['rng'],
+        'groups': {group: _write_group(tmp_path, group, arrays) for group, arrays in state['groups'].items()},
+    }
+    with open(os.path.join(tmp_path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+
+    old_path = path.rstrip(os.sep) + '.old'
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+
+
+def save_checkpoint(path, model, iteration=0, results=None):
+    """Synchronously save model, optimizer state and numpy RNG state into the directory path"""
+    write_checkpoint(path, snapshot(model, iteration, results))
+
+
+def load_checkpoint(path, model, restore_rng=True):
+    """Restore a checkpoint into a model built with the same architecture
+
+    # Arguments
+        path: string, the checkpoint directory
+        model: compiled Model, with the same layers and optimizer type as when it was saved
+        restore_rng: boolean, whether to restore the global numpy RNG (which the loaders draw from)
+
+    # Returns
+        iteration: int, the next iteration to run
+        results: dictionary of numpy arrays, the training curves stored with the checkpoint
+    """
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if manifest['version'] != VERSION:
+        raise ValueError('unsupported checkpoint version {}'.format(manifest['version']))
+
+    params, _ = model.get_params(with_grads=False)
+    saved = _read_group(path, manifest['groups']['params'])
+    if set(saved) != set(params):
+        raise ValueError('checkpoint parameters {} do not match model parameters {}'.format(sorted(saved), sorted(params)))
+    for k, v in params.items():
+        if saved[k].shape != v.shape:
+            raise ValueError('{} has shape {} in checkpoint but {} in model'.format(k, saved[k].shape, v.shape))
+    model.set_params(saved)
+    masks = {}
+    if 'masks' in manifest['groups']:
+        masks = {k: np.array(v) for k, v in _read_group(path, manifest['groups']['masks']).items()}
+        if not set(masks) <= set(params):
+            raise ValueError('checkpoint masks {} are not model parameters'.format(sorted(set(masks) - set(params))))
+    # pruned weights stay at zero when fine-tuning resumes
+    model.set_masks(masks)
+
+    states = {k: _read_group(path, manifest['groups']['optimizer.' + k])
+              for k in OPTIMIZER_STATES if 'optimizer.' + k in manifest['groups']}
+    set_optimizer_state(model.optimizer, manifest['optimizer'], states)
+
+    if restore_rng:
+        rng = manifest['rng']
+        np.random.set_state((rng['name'], np.array(rng['keys'], dtype=np.uint32), rng['pos'], rng['has_gauss'], rng['cached_gaussian']))
+
+    results = {}
+    if 'results' in manifest['groups']:
+        results = {k: np.array(v) for k, v in _read_group(path, manifest['groups']['results']).items()}
+    return manifest['iteration'], results
+
+
+class AsyncCheckpointer():
+
+    def __init__(self, path):
+        """Write checkpoints in a background thread
+
+        The training loop only pays for the in-memory snapshot. At most one write
+        is in flight; a new save waits for the previous one to finish.
+
+        # Arguments
+            path: string, the checkpoint directory
+        """
+        self.path = path
+        self.thread = None
+        self.error = None
+
+    def _write(self, state):
+        try:
+            write_checkpoint(self.path, state)
+        except BaseException as e:
+            self.error = e
+
+    def wait(self):
+        """Block until the pending write is finished, re-raising its error"""
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def save(self, model, iteration=0, results=None):
+        state = snapshot(model, iteration, results)
+        self.wait()
+        self.thread = threading.Thread(target=self._write, args=(state,), daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.wait()
@@ -0,0 +1,108 @@
+"""
+This file defines the distillation of a trained SentimentNet (teacher) into a cheaper student model,
+e.g. `applications.PooledEmbeddingNet`, trained on the soft probabilities of the teacher.
+"""
+import time
+import numpy as np
+from loss import SoftTargetCrossEntropy
+
+
+def soft_targets(teacher, x, y, temperature=1.0):
+    """Probabilities of the teacher on a batch, softened by temperature
+
+    The teacher runs in testing mode; its logits are the inputs of its
+    SoftmaxCrossEntropy, kept by Model.forward.
+    """
+    for layer in teacher.layers:
+        layer.set_mode(training=False)
+    _, probs = teacher.forward(x, y)
+    for layer in teacher.layers:
+        layer.set_mode(training=True)
+    if temperature == 1:
+        return probs
+    logits = teacher.inputs[-1] / temperature
+    probs = np.exp(logits - np.max(logits, axis=1, keepdims=True))
+    return probs / np.sum(probs, axis=1, keepdims=True)
+
+
+def distill(teacher, student, dataset, train_batch=32, epochs=5, hard_weight=0.0, val_batch=100,
+            val_intervals=100, print_intervals=100):
+    """Train student to reproduce the probabilities of teacher on the training sentences
+
+    The targets of every batch are (1-hard_weight)*teacher probabilities + hard_weight*one-hot
+    labels, at the temperature of the student loss.
+
+    # Arguments
+        teacher: trained Model
+        student: Model compiled with a SoftTargetCrossEntropy loss
+        dataset: dataset with train_loader and val_loader
+        train_batch, epochs, val_batch, val_intervals, print_intervals: as in Model.train
+        hard_weight: float, weight of the true labels in the targets
+
+    # Returns
+        train_results: numpy array of [iteration, loss, accuracy on the labels, agreement with the teacher]
+        val_results: numpy array of [iteration, loss, accuracy] of the student on the labels
+    """
+    loss = student.layers[-1]
+    if not isinstance(loss, SoftTargetCrossEntropy):
+        raise ValueError('the student must be compiled with a SoftTargetCrossEntropy loss')
+    iterations_per_epoch = dataset.num_train // train_batch
+    train_loader = dataset.train_loader(train_batch)
+    train_results = []
+    val_results = []
+    for epoch in range(epochs):
+        print('Epoch %d: '%epoch, end='\n')
+        for iteration in range(iterations_per_epoch):
+            total_iteration = epoch*iterations_per_epoch + iteration
+            if iteration % val_intervals == 0:
+                val_loss, val_acc = student.val(dataset, val_batch)
+                val_results.append([total_iteration, val_loss, val_acc])
+
+            x, y = next(train_loader)
+            targets = soft_targets(teacher, x, y, loss.temperature)
+            if hard_weight:
+                targets = (1 - hard_weight) * targets
+                targets[np.arange(len(y)), y] += hard_weight
+            batch_loss, probs = student.forward(x, targets)
+            student.backward(targets)
+            student.update(student.optimizer, total_iteration)
+
+            predictions = np.argmax(probs, axis=-1)
+            acc = np.mean(predictions == y)
+            agreement = np.mean(predictions == np.argmax(targets, axis=-1))
+            train_results.append([total_iteration, batch_loss, acc, agreement])
+            if iteration % print_intervals == 0:
+                print('Iteration %d:\taccuracy=%.5f, agreement=%.5f, loss=%.5f'%(iteration, acc, agreement, batch_loss))
+    return np.array(train_results), np.array(val_results)
+
+
+def distillation_report(teacher, student, dataset, batch=100, repeat=3):
+    """Compare accuracy and latency of a teacher and its student on the test set
+
+    # Arguments
+        teacher, student: Model
+        dataset: dataset with test_loader
+        batch: int, evaluation batch size
+        repeat: int, the best of repeat timings is reported
+
+    # Returns
+        report: dictionary {'teacher': {...}, 'student': {...}, 'speedup', 'accuracy_gap', 'agreement'},
+            each model with 'accuracy', 'loss' and 'seconds' (one pass over the pre-encoded test set);
+            accuracy_gap is teacher minus student accuracy, agreement the fraction of equal predictions
+    """
+    batches = list(dataset.test_loader(batch))
+    report = {}
+    for name, m in (('teacher', teacher), ('student', student)):
+        seconds = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            loss, acc = m.evaluate(batches, batch, dataset.num_test)
+            seconds = min(seconds, time.perf_counter() - start)
+        report[name] = {'accuracy': float(acc), 'loss': float(loss), 'seconds': seconds}
+    same = 0
+    for x, y in batches:
+        same += np.sum(np.argmax(soft_targets(teacher, x, y), axis=-1) == np.argmax(soft_targets(student, x, y), axis=-1))
+    report['speedup'] = report['teacher']['seconds'] / report['student']['seconds']
+    report['accuracy_gap'] = report['teacher']['accuracy'] - report['student']['accuracy']
+    report['agreement'] = float(same / dataset.num_test)
+    return report
@@ -0,0 +1,103 @@
+"""
+This file defines the background evaluator used by `Model.train(async_eval=...)`.
+"""
+import copy
+import multiprocessing as mp
+import queue
+import threading
+
+
+def _evaluate_loop(model, dataset, batch_sizes, tasks, results):
+    """Evaluate parameter snapshots from tasks until a None task arrives"""
+    cache = {}
+    loaders = {'val': dataset.val_loader, 'test': dataset.test_loader}
+    nums = {'val': dataset.num_val, 'test': dataset.num_test}
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        iteration, kinds, params = task
+        try:
+            model.set_params(params)
+            for kind in kinds:
+                # the evaluation sets never change, encode them only once
+                if kind not in cache:
+                    cache[kind] = list(loaders[kind](batch_sizes[kind]))
+                loss, acc = model.evaluate(cache[kind], batch_sizes[kind], nums[kind])
+                results.put((kind, iteration, loss, acc))
+        except Exception as e:
+            results.put(('error', iteration, repr(e), None))
+    results.put(None)
+
+
+class AsyncEvaluator():
+
+    def __init__(self, model, dataset, val_batch, test_batch, mode='thread', max_pending=2):
+        """Run Model.evaluate on parameter snapshots in a background thread or process
+
+        The evaluator owns a replica of the model, so training never waits for
+        evaluation except when more than max_pending snapshots are queued.
+
+        # Arguments
+            model: compiled Model
+            dataset: dataset with val_loader and test_loader
+            val_batch, test_batch: int, evaluation batch sizes
+            mode: 'thread' or 'process' (a forked process, avoids the GIL)
+            max_pending: int, the number of snapshots that may wait for evaluation
+        """
+        if mode not in ('thread', 'process'):
+            raise ValueError("mode must be 'thread' or 'process', got {}".format(mode))
+        self.model = model
+        self.pending = 0
+        batch_sizes = {'val': val_batch, 'test': test_batch}
+        if mode == 'thread':
+            self.tasks = queue.Queue(max_pending)
+            self.results = queue.Queue()
+            replica = copy.deepcopy(model)
+            # deepcopy does not keep the layer arrays as views into the flat vectors
+            replica.flatten_params()
+            self.worker = threading.Thread(target=_evaluate_loop, args=(replica, dataset, batch_sizes, self.tasks, self.results), daemon=True)
+        else:
+            ctx = mp.get_context('fork')
+            self.tasks = ctx.Queue(max_pending)
+            self.results = ctx.Queue()
+            self.worker = ctx.Process(target=_evaluate_loop, args=(model, dataset, batch_sizes, self.tasks, self.results), daemon=True)
+        self.worker.start()
+
+    def submit(self, iteration, kinds):
+        """Queue an evaluation of the current parameters
+
+        # Arguments
+            iteration: int, the iteration the snapshot is taken at
+            kinds: list of 'val' and/or 'test'
+        """
+        params, _ = self.model.get_params(with_grads=False)
+        snapshot = {k: v.copy() for k, v in params.items()}
+        self.tasks.put((iteration, kinds, snapshot))
+        self.pending += len(kinds)
+
+    def _get(self, block):
+        result = self.results.get(block=block)
+        if result[0] == 'error':
+            raise RuntimeError('evaluation at iteration {} failed: {}'.format(result[1], result[2]))
+        self.pending -= 1
+        return result
+
+    def poll(self, block=False):
+        """Return the finished evaluations as (kind, iteration, loss, accuracy), waiting for all of them if block"""
+        finished = []
+        while self.pending > 0:
+            try:
+                finished.append(self._get(block))
+            except queue.Empty:
+                break
+        return finished
+
+    def close(self):
+        """Wait for every pending evaluation, stop the worker and return the remaining results"""
+        finished = self.poll(block=True)
+        self.tasks.put(None)
+        while self.results.get() is not None:
+            pass
+        self.worker.join()
+        return finished
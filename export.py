@@ -0,0 +1,96 @@
+"""
+This file exports a trained SentimentNet into a single file for the standalone runtime (runtime.py).
+
+The file is an uncompressed .npz archive holding the weights of every layer, the
+vocabulary in index order (or the settings of a hashing vocabulary) and a JSON spec
+of the architecture. The weights of pruned layers (pruning.py) are stored in the smallest
+of three forms: dense, the non-zero rows of the embedding behind a row index, or CSR.
+"""
+import json
+import numpy as np
+from layers import FCLayer, TemporalPooling
+from rnn_layers import RNN, BidirectionalRNN
+from loss import SoftmaxCrossEntropy
+from utils.tools import HashingVocabulary
+from runtime import FORMAT_VERSION
+
+
+def _rnn_arrays(rnn, prefix=''):
+    return {prefix+'kernel': rnn.kernel, prefix+'recurrent_kernel': rnn.recurrent_kernel, prefix+'bias': rnn.bias,
+            prefix+'h0': np.asarray(rnn.h0).reshape(-1, rnn.bias.size)[0]}
+
+
+def _compact_weights(weights, dtype, embedding=False):
+    """Smallest storage of pruned weights: dense, the non-zero rows behind a row index (embedding only) or CSR
+
+    # Returns
+        params: {'weights'} dense,
+            {'weights': the non-zero rows after a zero row 0, 'row_index': int32 array mapping every input to its row},
+            or {'indptr', 'indices', 'values'}: input row r holds the columns indices[indptr[r]:indptr[r+1]]
+    """
+    itemsize = np.dtype(dtype).itemsize
+    options = [(weights.size * itemsize, {'weights': weights})]
+    if embedding:
+        nonzero = np.flatnonzero(np.any(weights[1:] != 0, axis=1)) + 1
+        row_index = np.zeros(len(weights), dtype=np.int32)
+        row_index[nonzero] = np.arange(1, len(nonzero)+1)
+        options.append(((len(nonzero) + 1) * weights.shape[1] * itemsize + row_index.nbytes,
+                        {'weights': np.vstack([weights[:1], weights[nonzero]]), 'row_index': row_index}))
+    rows, columns = np.nonzero(weights)
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=len(weights)))]).astype(np.int32)
+    options.append((len(rows) * (4 + itemsize) + indptr.nbytes,
+                    {'indptr': indptr, 'indices': columns.astype(np.int32), 'values': weights[rows, columns]}))
+    return min(options, key=lambda option: option[0])[1]
+
+
+def export_model(model, word_to_idx, path, max_length=30, dtype=np.float32, labels=None):
+    """Write a trained model and its vocabulary into one file that runtime.load reads
+
+    # Arguments
+        model: trained Model made of FCLayer, RNN, BidirectionalRNN, TemporalPooling and
+            SoftmaxCrossEntropy, whose first layer is the embedding of one-hot words
+        word_to_idx: dictionary or HashingVocabulary, the vocabulary the model was trained with, e.g. dataset.dictionary
+        path: string, the .npz file to write
+        max_length: int, the number of words kept of every text, as in the dataset encoding
+        dtype: numpy dtype of the exported weights
+        labels: list of string, optional names of the classes
+    """
+    hashing = None
+    words = []
+    if isinstance(word_to_idx, HashingVocabulary):
+        hashing = {'num_buckets': word_to_idx.num_buckets, 'signed': word_to_idx.signed}
+    else:
+        words = sorted(word_to_idx, key=word_to_idx.get)
+        if [word_to_idx[w] for w in words] != list(range(1, len(words)+1)):
+            raise ValueError('word_to_idx must map the words to 1, ..., V')
+
+    layers = []
+    arrays = {}
+    for l, layer in enumerate(model.layers):
+        name = 'layer-%d/'%l
+        if isinstance(layer, FCLayer) and l == 0:
+            if layer.weights.shape[0] != len(word_to_idx):
+                raise ValueError('the embedding has {} inputs but the vocabulary has {} words'.format(layer.weights.shape[0], len(word_to_idx)))
+            # row 0 is for unknown words and padding, like index 0 of the encoding
+            weights = np.vstack([np.zeros((1, layer.weights.shape[1])), layer.weights])
+            kind, params = 'embedding', dict(_compact_weights(weights, dtype, embedding=True), bias=layer.bias)
+        elif isinstance(layer, FCLayer):
+            kind, params = 'dense', dict(_compact_weights(layer.weights, dtype), bias=layer.bias)
+        elif isinstance(layer, BidirectionalRNN):
+            kind, params = 'brnn', dict(_rnn_arrays(layer.forward_rnn, 'forward_'), **_rnn_arrays(layer.backward_rnn, 'backward_'))
+        elif isinstance(layer, RNN):
+            kind, params = 'rnn', _rnn_arrays(layer)
+        elif isinstance(layer, TemporalPooling):
+            kind, params = 'temporal_pooling', {}
+        elif isinstance(layer, SoftmaxCrossEntropy):
+            kind, params = 'softmax', {}
+        else:
+            raise ValueError('layer {} of type {} cannot be exported'.format(l, type(layer).__name__))
+        layers.append({'type': kind, 'name': getattr(layer, 'name', kind)})
+        arrays.update({name+k: v if k in ('row_index', 'indptr', 'indices') else np.asarray(v, dtype=dtype) for k, v in params.items()})
+
+    spec = {'version': FORMAT_VERSION, 'max_length': max_length, 'layers': layers, 'labels': labels, 'hashing': hashing}
+    arrays['spec'] = np.array(json.dumps(spec))
+    arrays['vocabulary'] = np.frombuffer('\n'.join(words).encode('utf-8'), dtype=np.uint8)
+    with open(path, 'wb') as f:
+        np.savez(f, **arrays)
@@ -24,10 +24,18 @@ class Layer(object):
         """Backward pass, return gradients to inputs"""
         raise NotImplementedError
 
+    def build(self, input_shape):
+        """Check the shape of the inputs, prepare for it and return the shape of the outputs"""
+        return input_shape
+
     def update(self, optimizer):
         """Update parameters in this layer"""
         pass
 
+    def set_grads(self, grads):
+        """Rebind the gradient arrays of this layer, e.g. to views into a flat buffer"""
+        pass
+
     def set_mode(self, training):
         """Set the phrase/mode into training (True) or tesing (False)"""
         self.training = training
@@ -40,15 +48,22 @@ class Layer(object):
         """Reture parameters and gradients of this layer"""
         return None
 
+    def get_sparse_grads(self, prefix):
+        """Return the row-sparse gradients (RowSparse) of this layer, keyed like get_params"""
+        return {}
+
 
 class FCLayer(Layer):
-    def __init__(self, in_features, out_features, name='fclayer', initializer=Guassian()):
+    def __init__(self, in_features, out_features, name='fclayer', initializer=Guassian(), sparse_grad=False):
         """Initialization
 
         # Arguments
             in_features: int, the number of inputs features
             out_features: int, the numbet of required outputs features
             initializer: Initializer class, to initialize weights
+            sparse_grad: boolean, compute the gradients to self.weights only for the input features
+                that are non-zero in the batch (e.g. the words of a one-hot embedding) and expose them
+                through get_sparse_grads, so that optimizers only update those rows
         """
         super(FCLayer, self).__init__(name=name)
         self.trainable = True
@@ -59,20 +74,33 @@ class FCLayer(Layer):
         self.w_grad = np.zeros(self.weights.shape)
         self.b_grad = np.zeros(self.bias.shape)
 
-    def forward(self, inputs):
+        self.sparse_grad = sparse_grad
+        self.w_grad_rows = np.zeros(0, dtype=np.int64)
+        self.w_grad_values = np.zeros((0, out_features))
+
+    def build(self, input_shape):
+        if input_shape[-1] != self.weights.shape[0]:
+            raise ValueError('{} expects {} input features, got inputs with shape {}'.format(self.name, self.weights.shape[0], input_shape))
+        return tuple(input_shape[:-1]) + (self.weights.shape[1],)
+
+    def forward(self, inputs, out=None):
         """Forward pass
 
         # Arguments
             inputs: numpy array with shape (batch, ..., in_features), 
             typically (batch, in_features), or (batch, T, in_features) for sequencical data
+            out: numpy array with shape (batch, ..., out_features) to write the outputs into, None to allocate
 
         # Returns
             outputs: numpy array with shape (batch, ..., out_features)
         """
-        batch = inputs.shape[0]
-        b_reshaped = self.bias.reshape((1,)*(inputs.ndim-1)+self.bias.shape)
-        outputs = np.dot(inputs, self.weights)+b_reshaped
-        return outputs
+        if out is None:
+            out = np.empty(inputs.shape[:-1]+self.bias.shape, dtype=np.result_type(inputs, self.weights))
+        # np.dot only calls BLAS for 2-D operands
+        flat_out = out.reshape(-1, self.bias.size)
+        np.dot(inputs.reshape(-1, inputs.shape[-1]), self.weights, out=flat_out)
+        flat_out += self.bias
+        return out
 
     def backward(self, in_grads, inputs):
         """Backward pass, store gradients to self.weights into self.w_grad and store gradients to self.bias into self.b_grad
@@ -85,9 +113,18 @@ class FCLayer(Layer):
             out_grads: numpy array with shape (batch, ..., in_features), gradients to inputs
         """
         dot_axes = np.arange(inputs.ndim-1)
-        self.w_grad = np.tensordot(np.nan_to_num(inputs), in_grads, axes=(dot_axes, dot_axes))
-        self.b_grad = np.sum(in_grads, axis=tuple(dot_axes))
-        out_grads = np.dot(in_grads, self.weights.T)
+        if self.sparse_grad:
+            flat_inputs = np.nan_to_num(inputs).reshape(-1, inputs.shape[-1])
+            rows = np.flatnonzero(np.any(flat_inputs, axis=0))
+            # self.w_grad stays the dense equivalent: only the rows written last time need clearing
+            self.w_grad[self.w_grad_rows] = 0
+            self.w_grad_rows = rows
+            self.w_grad_values = np.dot(flat_inputs[:, rows].T, in_grads.reshape(-1, in_grads.shape[-1]))
+            self.w_grad[rows] = self.w_grad_values
+        else:
+            self.w_grad[...] = np.tensordot(np.nan_to_num(inputs), in_grads, axes=(dot_axes, dot_axes))
+        np.sum(in_grads, axis=tuple(dot_axes), out=self.b_grad)
+        out_grads = np.dot(in_grads.reshape(-1, in_grads.shape[-1]), self.weights.T).reshape(inputs.shape)
         return out_grads
 
     def update(self, params):
@@ -104,6 +141,18 @@ class FCLayer(Layer):
                 self.weights = v
             else:
                 self.bias = v
+
+    def set_grads(self, grads):
+        """Rebind gradients (self.w_grad and self.b_grad), backward writes into them in place
+
+        # Arguments
+            grads: dictionary, one key contains 'weights' and the other contains 'bias'
+        """
+        for k,v in grads.items():
+            if 'weights' in k:
+                self.w_grad = v
+            else:
+                self.b_grad = v
         
     def get_params(self, prefix):
         """Return parameters (self.weights and self.bias) as well as gradients (self.w_grad and self.b_grad)
@@ -130,6 +179,19 @@ class FCLayer(Layer):
         else:
             return None
 
+    def get_sparse_grads(self, prefix):
+        """Return the row-sparse gradients to self.weights if sparse_grad is enabled
+
+        # Arguments
+            prefix: string, to contruct prefix of keys in the dictionary (usually is the layer-ith)
+
+        # Returns
+            grads: dictionary, key of the weights in get_params mapping to a RowSparse, empty if not sparse_grad
+        """
+        if self.trainable and self.sparse_grad:
+            return {prefix+':'+self.name+'/weights': RowSparse(self.w_grad_rows, self.w_grad_values)}
+        return {}
+
 
 class TemporalPooling(Layer):
     """
@@ -148,6 +210,11 @@ class TemporalPooling(Layer):
         """
         super(TemporalPooling, self).__init__(name=name)
 
+    def build(self, input_shape):
+        if len(input_shape) != 3:
+            raise ValueError('{} expects inputs with shape (batch, time_steps, units), got {}'.format(self.name, input_shape))
+        return (input_shape[0], input_shape[2])
+
     def forward(self, inputs):
         """Forward pass
 
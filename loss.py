@@ -18,6 +18,10 @@ class Loss(object):
         """Set the phrase/mode into training (True) or tesing (False)"""
         self.training = training
 
+    def build(self, input_shape):
+        """Check the shape of the inputs and return the shape of the outputs (a scalar loss)"""
+        return ()
+
 
 class SoftmaxCrossEntropy(Loss):
     def __init__(self, num_class):
@@ -29,6 +33,11 @@ class SoftmaxCrossEntropy(Loss):
         super(SoftmaxCrossEntropy, self).__init__()
         self.num_class = num_class
 
+    def build(self, input_shape):
+        if len(input_shape) != 2 or input_shape[1] != self.num_class:
+            raise ValueError('SoftmaxCrossEntropy expects inputs with shape (batch, {}), got {}'.format(self.num_class, input_shape))
+        return ()
+
     def forward(self, inputs, targets):
         """Forward pass
 
@@ -70,6 +79,64 @@ class SoftmaxCrossEntropy(Loss):
         out_grads /= batch
         return out_grads
 
+class SoftTargetCrossEntropy(SoftmaxCrossEntropy):
+    def __init__(self, num_class, temperature=1.0):
+        """Cross entropy against soft targets, e.g. the probabilities of a teacher model (distillation)
+
+        The loss is T**2 * cross_entropy(targets, softmax(inputs/T)) with T the
+        temperature, scaled so that the gradients keep their magnitude whatever T.
+        Integer targets (labels, e.g. in Model.evaluate) get the plain cross entropy
+        at T=1, comparable with the loss of a SoftmaxCrossEntropy model.
+
+        # Arguments
+            num_class: int, the number of category
+            temperature: float, T
+        """
+        super(SoftTargetCrossEntropy, self).__init__(num_class)
+        self.temperature = temperature
+
+    def _targets(self, targets):
+        """Soft targets and the temperature they are compared at"""
+        if targets.ndim == 1:
+            one_hot = np.zeros((len(targets), self.num_class))
+            one_hot[np.arange(len(targets)), targets] = 1
+            return one_hot, 1.0
+        return targets, self.temperature
+
+    def _log_probs(self, inputs, temperature):
+        scaled = inputs / temperature
+        scaled_shift = scaled - np.max(scaled, axis=1, keepdims=True)
+        return scaled_shift - np.log(np.sum(np.exp(scaled_shift), axis=1, keepdims=True))
+
+    def forward(self, inputs, targets):
+        """Forward pass
+
+        # Arguments
+            inputs: numpy array with shape (batch, num_class)
+            targets: numpy array with shape (batch, num_class) of probabilities, or (batch,) of labels
+
+        # Returns
+            outputs: float, batch loss
+            probs: numpy array with shape (batch, num_class), probabilities at temperature 1
+        """
+        targets, temperature = self._targets(targets)
+        outputs = -temperature**2 * np.sum(targets * self._log_probs(inputs, temperature)) / len(targets)
+        inputs_shift = inputs - np.max(inputs, axis=1, keepdims=True)
+        probs = np.exp(inputs_shift)
+        probs /= np.sum(probs, axis=1, keepdims=True)
+        return outputs, probs
+
+    def backward(self, inputs, targets):
+        """Backward pass, same arguments with forward
+
+        # Returns
+            out_grads: numpy array with shape (batch, num_class), gradients to inputs
+        """
+        targets, temperature = self._targets(targets)
+        out_grads = np.exp(self._log_probs(inputs, temperature)) - targets
+        out_grads *= temperature / len(targets)
+        return out_grads
+
 class L2(Loss):
     def __init__(self, w=0.01):
         """Initialization
@@ -0,0 +1,176 @@
+"""
+This file defines the metrics sink used by `Model.train(metrics=...)`.
+"""
+import csv
+import json
+import os
+import threading
+import time
+import numpy as np
+
+FIELDS = ('time', 'iteration', 'epoch', 'iterations', 'samples', 'tokens', 'samples_per_sec', 'tokens_per_sec',
+          'data_time', 'compute_time', 'data_fraction', 'loss', 'accuracy')
+
+
+def count_tokens(x):
+    """The number of non-padding time steps of a batch
+
+    Padded steps of the encoded sentences are NaN (see utils.datasets.Sentiment),
+    inputs without a time axis count one token per sample.
+    """
+    if x.ndim == 3 and np.issubdtype(x.dtype, np.floating):
+        return int(np.count_nonzero(~np.isnan(x[:, :, 0])))
+    if x.ndim >= 2:
+        return x.shape[0] * x.shape[1]
+    return x.shape[0]
+
+
+class MetricsSink():
+
+    def __init__(self, path=None, format='jsonl', interval=100, flush_records=10, max_bytes=10*2**20, backup_count=3, callback=None):
+        """Stream training throughput, loss and accuracy while Model.train runs
+
+        Every training iteration only adds to a few counters. Every interval
+        iterations they are turned into one record (see FIELDS), which is handed
+        to callback and buffered; every flush_records records and when training
+        ends the buffer is handed to a background thread that appends it to path,
+        so that file I/O does not add to the step times being recorded. When path
+        grows beyond max_bytes it is rotated to path.1, path.2, ... like
+        logging.RotatingFileHandler.
+
+        # Arguments
+            path: string, the file to write, None to only call callback
+            format: 'jsonl' or 'csv'
+            interval: int, the number of iterations aggregated into one record
+            flush_records: int, the number of records buffered before writing
+            max_bytes: int, the size that triggers a rotation, 0 to never rotate
+            backup_count: int, the number of rotated files kept
+            callback: function taking a record dictionary, called in the training process
+        """
+        if format not in ('jsonl', 'csv'):
+            raise ValueError("format must be 'jsonl' or 'csv', got {}".format(format))
+        self.path = path
+        self.format = format
+        self.interval = interval
+        self.flush_records = flush_records
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.callback = callback
+        self.buffer = []
+        self.thread = None
+        self.error = None
+        self._reset()
+        self.step_start = None
+        self.last_step = None
+
+    def _reset(self):
+        self.iterations = 0
+        self.samples = 0
+        self.tokens = 0
+        self.data_time = 0.0
+        self.step_time = 0.0
+        self.sum_loss = 0.0
+        self.sum_acc = 0.0
+
+    def wrap_loader(self, loader):
+        """Wrap a batch generator to count its samples, tokens and the time spent waiting for it"""
+        while True:
+            start = time.perf_counter()
+            try:
+                x, y = next(loader)
+            except StopIteration:
+                return
+            self.data_time += time.perf_counter() - start
+            self.samples += len(y)
+            self.tokens += count_tokens(x)
+            yield x, y
+
+    def begin(self):
+        """Mark the start of a training step, so that evaluation and checkpointing are not counted"""
+        self.step_start = time.perf_counter()
+
+    def end(self, iteration, epoch, loss, acc):
+        """Mark the end of a training step, emitting a record every interval steps"""
+        self.step_time += time.perf_counter() - self.step_start
+        self.last_step = (iteration, epoch)
+        self.iterations += 1
+        self.sum_loss += loss
+        self.sum_acc += acc
+        if self.iterations >= self.interval:
+            self._emit(iteration, epoch)
+
+    def _emit(self, iteration, epoch):
+        step_time = max(self.step_time, 1e-12)
+        record = {
+            'time': time.time(),
+            'iteration': iteration,
+            'epoch': epoch,
+            'iterations': self.iterations,
+            'samples': self.samples,
+            'tokens': self.tokens,
+            'samples_per_sec': self.samples / step_time,
+            'tokens_per_sec': self.tokens / step_time,
+            'data_time': self.data_time,
+            'compute_time': self.step_time - self.data_time,
+            'data_fraction': self.data_time / step_time,
+            'loss': float(self.sum_loss / self.iterations),
+            'accuracy': float(self.sum_acc / self.iterations),
+        }
+        self._reset()
+        if self.callback is not None:
+            self.callback(record)
+        if self.path is not None:
+            self.buffer.append(record)
+            if len(self.buffer) >= self.flush_records:
+                self.flush()
+
+    def _rotate(self):
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists('%s.%d'%(self.path, i)):
+                os.replace('%s.%d'%(self.path, i), '%s.%d'%(self.path, i+1))
+        if self.backup_count > 0:
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+
+    def _write(self, records):
+        try:
+            if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                self._rotate()
+            new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            with open(self.path, 'a', newline='') as f:
+                if self.format == 'jsonl':
+                    for record in records:
+                        f.write(json.dumps(record) + '\n')
+                else:
+                    writer = csv.DictWriter(f, fieldnames=FIELDS)
+                    if new_file:
+                        writer.writeheader()
+                    writer.writerows(records)
+        except BaseException as e:
+            self.error = e
+
+    def wait(self):
+        """Block until the pending write is finished, re-raising its error"""
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def flush(self):
+        """Hand the buffered records to the background writer; at most one write is in flight"""
+        if self.path is None or not self.buffer:
+            return
+        records, self.buffer = self.buffer, []
+        self.wait()
+        self.thread = threading.Thread(target=self._write, args=(records,), daemon=True)
+        self.thread.start()
+
+    def close(self):
+        """Emit the last, possibly partial, interval, flush and wait for the writes, called at the end of Model.train"""
+        if self.iterations > 0:
+            self._emit(*self.last_step)
+        self.flush()
+        self.wait()
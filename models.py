@@ -1,6 +1,17 @@
 import numpy as np 
-import copy, pickle, sys
-from utils.tools import clip_gradients
+import copy, os, pickle, sys, time
+from contextlib import nullcontext
+from functools import partial
+from utils.tools import clip_gradients, RowSparse
+from layers import FCLayer
+from rnn_layers import RNN, BidirectionalRNN
+from checkpoint import AsyncCheckpointer, save_checkpoint, load_checkpoint
+from evaluation import AsyncEvaluator
+from profiler import Profiler, MemoryProfiler
+from parallel import BatchSplit, ThreadPool, Prefetcher, limit_blas_threads
+from autotune import load_tuning
+
+_NOT_PROFILED = nullcontext()
 
 class Model():
     
@@ -9,36 +20,336 @@ class Model():
         self.inputs = None
         self.optimizer = None 
         self.regularization = None
+        self.flat_params = None
+        self.flat_grads = None
+        self.param_views = None
+        self.grad_views = None
+        self.dense_size = None
+        self.sparse_layers = None
+        self.accumulated_grads = None
+        self.profiler = None
+        self.input_shape = None
+        self.layer_shapes = None
+        self.plan = None
+        self.executors = {}
+        self.masks = {}
 
     def add(self, layer):
         self.layers.append(layer)
 
-    def compile(self, optimizer, loss, regularization=None):
+    def compile(self, optimizer, loss, regularization=None, input_shape=None):
+        """Attach optimizer, loss and regularization, and build the execution plan
+
+        # Arguments
+            input_shape: tuple, shape of a sample batch of inputs, e.g. (batch, T, V). If given, the
+                shapes of all layers are checked now (raising ValueError) and the outputs of batches
+                with this shape are written into preallocated arrays
+        """
         self.optimizer = optimizer
         self.layers.append(loss)
         self.regularization = regularization
+        self.flatten_params()
+        self.build_plan(input_shape)
+
+    def build_plan(self, input_shape=None):
+        """Infer the shape of every layer and build the static plan that forward and backward execute
+
+        The plan holds the bound forward/backward methods in execution order and,
+        for batches of input_shape, the preallocated output arrays of the layers
+        that can write into one (FCLayer). Outputs are overwritten by the next
+        forward with the same input shape. Called by compile.
+
+        # Arguments
+            input_shape: tuple, shape of a sample batch of inputs, None to skip shape inference and preallocation
+        """
+        self.input_shape = tuple(input_shape) if input_shape is not None else None
+        self.layer_shapes = None
+        layers, loss = self.layers[:-1], self.layers[-1]
+        # layers split among threads by set_num_threads run through their BatchSplit
+        runners = [self.executors.get(l, layer) for l, layer in enumerate(layers)]
+        forward_steps = [runner.forward for runner in runners]
+        sized_steps = forward_steps
+        if input_shape is not None:
+            shape = self.input_shape
+            self.layer_shapes = []
+            sized_steps = []
+            for layer, runner in zip(layers, runners):
+                shape = layer.build(shape)
+                self.layer_shapes.append(shape)
+                if runner is not layer:
+                    sized_steps.append(runner.forward)
+                elif isinstance(layer, FCLayer):
+                    sized_steps.append(partial(layer.forward, out=np.empty(shape, dtype=layer.weights.dtype)))
+                else:
+                    sized_steps.append(layer.forward)
+            self.layer_shapes.append(loss.build(shape))
+        self.plan = {
+            'forward': forward_steps,
+            'sized_forward': sized_steps,
+            'loss_forward': loss.forward,
+            'loss_backward': loss.backward,
+            'backward': [runner.backward for runner in runners[::-1]],
+        }
+
+    def set_num_threads(self, num_threads, blas_threads=None, min_slice=4):
+        """Split the batches of FCLayer, RNN and BidirectionalRNN among threads
+
+        Each thread runs forward/backward on a slice of the batch with a replica
+        of the layer and the weight gradients are summed (see parallel.BatchSplit).
+        Layers with row-sparse gradients keep running on the whole batch. The BLAS
+        library is limited to blas_threads threads so that the two levels of
+        parallelism do not oversubscribe the cores.
+
+        # Arguments
+            num_threads: int, the number of threads, 1 to turn the splitting off
+            blas_threads: int, threads of every BLAS call, None for cpu_count//num_threads
+            min_slice: int, the smallest number of samples given to a thread
+        """
+        self.executors = {}
+        if num_threads > 1:
+            pool = ThreadPool(num_threads)
+            for l, layer in enumerate(self.layers[:-1]):
+                if isinstance(layer, (FCLayer, RNN, BidirectionalRNN)) and not getattr(layer, 'sparse_grad', False):
+                    self.executors[l] = BatchSplit(layer, pool, min_slice)
+        if blas_threads is None:
+            blas_threads = max(1, (os.cpu_count() or 1) // num_threads)
+        limit_blas_threads(blas_threads)
+        self.build_plan(self.input_shape)
+
+    def flatten_params(self, flat_params=None):
+        """Move the parameters and gradients of all layers into two contiguous vectors
+
+        Every layer keeps views into self.flat_params and self.flat_grads, so the
+        optimizer and the regularization update the whole model with a few
+        vectorized operations. Called by compile; call it again to move the
+        parameters into another buffer (e.g. shared memory) or after copying a model.
+        Parameters with row-sparse gradients are placed after all the dense ones,
+        so self.flat_params[:self.dense_size] covers exactly the dense parameters.
+
+        # Arguments
+            flat_params: numpy array with shape (num_params,), buffer to move the parameters into,
+                None to allocate a new one
+        """
+        layer_keys = []
+        params = {}
+        grads = {}
+        sparse_params = {}
+        self.sparse_layers = {}
+        for l, layer in enumerate(self.layers):
+            if layer.trainable:
+                prefix = 'layer-%dth'%l
+                layer_params, layer_grads = layer.get_params(prefix)
+                layer_keys.append((layer, list(layer_params.keys())))
+                grads.update(layer_grads)
+                sparse_keys = layer.get_sparse_grads(prefix).keys()
+                for k, v in layer_params.items():
+                    if k in sparse_keys:
+                        sparse_params[k] = v
+                        self.sparse_layers[k] = (layer, prefix)
+                    else:
+                        params[k] = v
+        self.dense_size = sum(v.size for v in params.values())
+        params.update(sparse_params)
+
+        size = sum(v.size for v in params.values())
+        if flat_params is None:
+            flat_params = np.empty(size)
+        assert flat_params.shape == (size,), 'flat_params must have shape ({},)'.format(size)
+        flat_grads = np.zeros(size)
+        self.param_views = {}
+        self.grad_views = {}
+        offset = 0
+        for k, v in params.items():
+            flat_params[offset:offset+v.size] = v.ravel()
+            flat_grads[offset:offset+v.size] = grads[k].ravel()
+            self.param_views[k] = flat_params[offset:offset+v.size].reshape(v.shape)
+            self.grad_views[k] = flat_grads[offset:offset+v.size].reshape(v.shape)
+            offset += v.size
+        self.flat_params = flat_params
+        self.flat_grads = flat_grads
+
+        for layer, keys in layer_keys:
+            layer.update({k: self.param_views[k] for k in keys})
+            layer.set_grads({k: self.grad_views[k] for k in keys})
+
+    def _flat_offset(self, k):
+        """Index of the first element of parameter k in self.flat_params"""
+        return (self.param_views[k].__array_interface__['data'][0] - self.flat_params.__array_interface__['data'][0]) // self.flat_params.itemsize
+
+    def set_masks(self, masks):
+        """Keep parameters at zero where their mask is False, through every optimizer update (pruning)
+
+        # Arguments
+            masks: dictionary, key of get_params mapping to a boolean numpy array broadcastable to the
+                parameter (e.g. (rows, 1) for whole rows), None to remove all the masks
+        """
+        self.masks = dict(masks) if masks else {}
+
+    def grow_embedding(self, num_rows, layer=0, initializer=None):
+        """Append input rows to the weights of an FCLayer, e.g. the embedding of new words
+
+        The existing rows, their optimizer state and their position in the one-hot
+        inputs are unchanged: the new rows take the ids after the last one. The
+        flat vectors and the execution plan are rebuilt for the new input width.
+
+        # Arguments
+            num_rows: int, the number of rows to append
+            layer: int, index of the FCLayer in self.layers
+            initializer: Initializer of the new rows, None for zeros
+        """
+        fc = self.layers[layer]
+        key = 'layer-%dth:%s/weights'%(layer, fc.name)
+        old_rows, features = fc.weights.shape
+        rows = initializer.initialize((num_rows, features)) if initializer else np.zeros((num_rows, features))
+        if self.optimizer is not None:
+            if key in self.sparse_layers:
+                self.optimizer.grow_state(key, old_rows, num_rows)
+            else:
+                # the rows are stored row-major from the start of the weights in the dense flat vector
+                self.optimizer.grow_state('flat', self._flat_offset(key) + old_rows*features, num_rows*features)
+        weights = np.vstack([fc.weights, rows])
+        if key in self.masks:
+            mask = self.masks[key]
+            self.masks[key] = np.vstack([mask, np.ones((num_rows, mask.shape[1]), dtype=bool)])
+        fc.update({key: weights})
+        fc.set_grads({key: np.zeros(weights.shape)})
+        self.accumulated_grads = None
+        for executor in self.executors.values():
+            executor.replicas = []
+        self.flatten_params()
+        if self.input_shape is not None and layer == 0:
+            self.input_shape = self.input_shape[:-1] + (old_rows + num_rows,)
+        self.build_plan(self.input_shape)
+
+    def profile(self, enabled=True, max_events=100000, memory=False):
+        """Turn per-layer profiling on or off
+
+        While enabled, every layer forward/backward, the regularization, the
+        optimizer update, get_params, data loading and evaluation in train are
+        recorded into self.profiler. Disabled, the cost is one None check per call.
+
+        # Arguments
+            enabled: boolean
+            max_events: int, the number of events kept for the Chrome trace
+            memory: boolean, also record peak, allocated and retained bytes of every
+                call with tracemalloc (see MemoryProfiler), much slower
+
+        # Returns
+            profiler: Profiler or MemoryProfiler, None if disabled
+        """
+        if isinstance(self.profiler, MemoryProfiler):
+            self.profiler.close()
+        if not enabled:
+            self.profiler = None
+        elif memory:
+            self.profiler = MemoryProfiler(max_events)
+        else:
+            self.profiler = Profiler(max_events)
+        return self.profiler
+
+    def _section(self, name):
+        return self.profiler.section(name) if self.profiler is not None else _NOT_PROFILED
+
+    def _layer_name(self, l):
+        return '%d:%s'%(l, getattr(self.layers[l], 'name', type(self.layers[l]).__name__))
 
     def forward(self, inputs, targets):
+        plan = self.plan
+        if plan is not None:
+            steps = plan['sized_forward'] if inputs.shape == self.input_shape else plan['forward']
+            self.inputs = layer_inputs = [inputs]
+            profiler = self.profiler
+            if profiler is None:
+                for step in steps:
+                    inputs = step(inputs)
+                    layer_inputs.append(inputs)
+                return plan['loss_forward'](inputs, targets)
+            # profiled, the plan runs step by step with the same preallocated outputs
+            for l, step in enumerate(steps):
+                start = profiler.begin()
+                inputs = step(inputs)
+                profiler.record('forward/'+self._layer_name(l), start, time.perf_counter(), inputs)
+                layer_inputs.append(inputs)
+            start = profiler.begin()
+            outputs, probs = plan['loss_forward'](inputs, targets)
+            profiler.record('forward/'+self._layer_name(len(steps)), start, time.perf_counter(), outputs)
+            return outputs, probs
+
         self.inputs = []
         layer_inputs = inputs
+        profiler = self.profiler
         for l, layer in enumerate(self.layers):
             # print(layer.name, layer_inputs)
             self.inputs.append(layer_inputs)
+            if profiler is not None:
+                start = profiler.begin()
             if l==len(self.layers)-1:
                 layer_inputs, probs = layer.forward(layer_inputs, targets)
             else:
-                layer_inputs = layer.forward(layer_inputs)
+                layer_inputs = self.executors.get(l, layer).forward(layer_inputs)
+            if profiler is not None:
+                profiler.record('forward/'+self._layer_name(l), start, time.perf_counter(), layer_inputs)
         outputs = layer_inputs
         return outputs, probs
 
     def backward(self, targets):
+        plan = self.plan
+        if plan is not None:
+            inputs = self.inputs
+            profiler = self.profiler
+            l = len(inputs) - 1
+            if profiler is None:
+                grads = plan['loss_backward'](inputs[-1], targets)
+                for step in plan['backward']:
+                    l -= 1
+                    grads = step(grads, inputs[l])
+                return
+            start = profiler.begin()
+            grads = plan['loss_backward'](inputs[-1], targets)
+            profiler.record('backward/'+self._layer_name(l), start, time.perf_counter(), grads)
+            for step in plan['backward']:
+                l -= 1
+                start = profiler.begin()
+                grads = step(grads, inputs[l])
+                profiler.record('backward/'+self._layer_name(l), start, time.perf_counter(), grads)
+            return
+
+        profiler = self.profiler
         for l, layer in enumerate(self.layers[::-1]):
+            if profiler is not None:
+                start = profiler.begin()
             if l==0:
                 grads = layer.backward(self.inputs[-1-l], targets)
             else:
-                grads = layer.backward(grads, self.inputs[-1-l])
+                grads = self.executors.get(len(self.layers)-1-l, layer).backward(grads, self.inputs[-1-l])
+            if profiler is not None:
+                profiler.record('backward/'+self._layer_name(len(self.layers)-1-l), start, time.perf_counter(), grads)
+
+    def get_params(self, with_grads=True):
+        """Parameters and gradients (regularization included) of all layers
+
+        # Arguments
+            with_grads: boolean, False to skip the gradients and the regularization, e.g. for checkpoints
+
+        # Returns
+            params: dictionary, the parameters themselves (views into self.flat_params once compiled)
+            grads: dictionary with the same keys, None without with_grads
+        """
+        with self._section('get_params'):
+            return self._get_params(with_grads)
+
+    def _get_params(self, with_grads=True):
+        if self.flat_params is not None:
+            params = dict(self.param_views)
+            if not with_grads:
+                return params, None
+            grads = dict(self.grad_views)
+            if self.regularization:
+                reg_grads = self.regularization.backward(params)
+                for k, v in grads.items():
+                    grads[k] = v + reg_grads[k]
+            return params, grads
 
-    def get_params(self):
         params = {}
         grads = {}
         for l, layer in enumerate(self.layers):
@@ -46,6 +357,8 @@ class Model():
                 layer_params, layer_grads = layer.get_params('layer-%dth'%l)
                 params.update(layer_params)
                 grads.update(layer_grads)
+        if not with_grads:
+            return params, None
 
         if self.regularization:
             reg_grads = self.regularization.backward(params)
@@ -53,15 +366,69 @@ class Model():
                 grads[k] += reg_grads[k]
         return params, grads
 
-    def update(self, optimizer, iteration):
-        params, grads = self.get_params()
+    def update(self, optimizer, iteration, flat_grads=None):
+        """Run one optimizer step on the flat parameter vector
+
+        Parameters of layers with row-sparse gradients are passed to the optimizer
+        separately as RowSparse, so only the rows touched by the batch are updated.
+        Their weight decay is lazy as well: rows that are absent from the batch
+        are not decayed in that step.
+
+        # Arguments
+            optimizer: Optimizer
+            iteration: int, current iteration number in the whole training process
+            flat_grads: numpy array with shape (num_params,), gradients to use instead of self.flat_grads
+                (e.g. accumulated over batches or averaged over workers). The row-sparse parameters
+                then get their non-zero rows of it. The regularization gradients are added into it in place.
+        """
+        if flat_grads is None:
+            flat_grads = self.flat_grads
+            sparse_grads = {k: layer.get_sparse_grads(prefix)[k] for k, (layer, prefix) in self.sparse_layers.items()}
+        else:
+            sparse_grads = {}
+            for k in self.sparse_layers:
+                offset = self._flat_offset(k)
+                grad = flat_grads[offset:offset+self.param_views[k].size].reshape(self.param_views[k].shape)
+                rows = np.flatnonzero(np.any(grad != 0, axis=1))
+                sparse_grads[k] = RowSparse(rows, grad[rows])
+
+        # the 'flat' optimizer state always covers the dense parameters only
+        params = {'flat': self.flat_params[:self.dense_size]}
+        grads = {'flat': flat_grads[:self.dense_size]}
+        with self._section('update/regularization'):
+            if self.regularization:
+                grads['flat'] += self.regularization.backward(params)['flat']
+            for k, grad in sparse_grads.items():
+                params[k] = self.param_views[k]
+                if self.regularization:
+                    reg_grads = self.regularization.backward({k: params[k][grad.rows]})
+                    grad = RowSparse(grad.rows, grad.values + reg_grads[k])
+                grads[k] = grad
 
         # clip gradients
-        # for k, v in grads.items():
-        #     grads[k] = clip_gradients(v)
-        #     print(k, np.mean(np.abs(v)))
+        # grads['flat'] = clip_gradients(grads['flat'])
 
-        new_params = optimizer.update(params, grads, iteration)
+        with self._section('update/optimizer'):
+            new_params = optimizer.update(params, grads, iteration)
+        for k, v in params.items():
+            # the optimizers of optimizers.py update in place, copy only for other ones
+            if new_params[k] is not v:
+                assert ~np.any(np.isnan(new_params[k])), '{} contains NaN'.format(k)
+                v[...] = new_params[k]
+        for k, mask in self.masks.items():
+            np.multiply(self.param_views[k], mask, out=self.param_views[k])
+
+    def set_params(self, new_params):
+        """Copy new parameters into the layers
+
+        # Arguments
+            new_params: dictionary, same keys with the params returned by get_params
+        """
+        if self.flat_params is not None:
+            for k, v in self.param_views.items():
+                v[...] = new_params[k]
+                assert ~np.any(np.isnan(v)), '{} contains NaN'.format(k)
+            return
 
         for l, layer in enumerate(self.layers):
             if layer.trainable:
@@ -71,37 +438,119 @@ class Model():
                     assert ~np.any(np.isnan(layer_params[k])), '{} contains NaN'.format(k)
                 layer.update(layer_params)
 
-    def train(self, dataset, train_batch=32, val_batch=1000, test_batch=1000, epochs=5, val_intervals=100, test_intervals=500, print_intervals=100):
-        train_loader = dataset.train_loader(train_batch)
+    def save(self, path, iteration=0):
+        """Save parameters, optimizer state and numpy RNG state into the checkpoint directory path"""
+        save_checkpoint(path, self, iteration)
+
+    def load(self, path):
+        """Load a checkpoint saved from a model with the same architecture, return the saved iteration"""
+        iteration, _ = load_checkpoint(path, self)
+        return iteration
+
+    def train(self, dataset, train_batch=32, val_batch=1000, test_batch=1000, epochs=5, val_intervals=100, test_intervals=500, print_intervals=100,
+              checkpoint_path=None, checkpoint_intervals=1000, resume=False, async_eval=None, accumulation_steps=1, metrics=None,
+              prefetch=0, tuned=None, early_stop=None):
+        """Train the model
+
+        # Arguments
+            accumulation_steps: int, sum the gradients of this many batches of train_batch samples before
+                each optimizer update, i.e. an effective batch of train_batch*accumulation_steps that only
+                needs the activation memory of train_batch. An iteration is one optimizer update.
+            checkpoint_path: string, directory to checkpoint into every checkpoint_intervals iterations
+                (written in the background), None to disable checkpointing
+            resume: boolean, restart from the checkpoint in checkpoint_path, possibly in the middle of an epoch,
+                following the same trajectory as the interrupted run
+            async_eval: None, 'thread' or 'process', run validation and testing on parameter snapshots
+                in the background instead of stopping training; results keep the iteration of their snapshot
+            metrics: MetricsSink, streams samples/sec, tokens/sec, data-wait and compute time, loss and accuracy
+                while training, None to disable
+            prefetch: int, encode this many training batches ahead in a background thread (parallel.Prefetcher),
+                0 to load them in the training thread. Checkpoints then hold the numpy RNG a few batches
+                ahead, so a resumed run draws different batches
+            tuned: dictionary or JSON path of an autotune.autotune result; unless it was tuned on another
+                host or input shape, its train_batch, val_batch, test_batch and prefetch replace the
+                arguments and its threads are applied with set_num_threads
+            early_stop: callable receiving val_results whenever a validation result is added, training
+                stops when it returns True, None to always train for all the epochs
+        """
+        if tuned is not None:
+            config = load_tuning(tuned, self.input_shape)
+            if config is not None:
+                train_batch, val_batch, test_batch, prefetch = (config[k] for k in ('train_batch', 'val_batch', 'test_batch', 'prefetch'))
+                if self.input_shape is not None:
+                    self.input_shape = (train_batch,) + self.input_shape[1:]
+                self.set_num_threads(config['num_threads'], config['blas_threads'])
         num_train = dataset.num_train
+        iterations_per_epoch = num_train//(train_batch*accumulation_steps)
 
         train_results = []
         test_results = []
         val_results = []
+        start_iteration = 0
+        if resume:
+            start_iteration, results = load_checkpoint(checkpoint_path, self)
+            train_results = results.get('train', np.zeros((0, 3))).tolist()
+            val_results = results.get('val', np.zeros((0, 3))).tolist()
+            test_results = results.get('test', np.zeros((0, 3))).tolist()
+            print('Resume from iteration %d'%start_iteration)
+        checkpointer = AsyncCheckpointer(checkpoint_path) if checkpoint_path else None
+        evaluator = AsyncEvaluator(self, dataset, val_batch, test_batch, mode=async_eval) if async_eval else None
+        eval_results = {'val': val_results, 'test': test_results}
 
-        for epoch in range(epochs):
+        # create the loader after restoring the numpy RNG so that it draws the same batches
+        train_loader = dataset.train_loader(train_batch)
+        prefetcher = Prefetcher(train_loader, prefetch) if prefetch else None
+        if prefetcher:
+            train_loader = prefetcher
+        if metrics:
+            train_loader = metrics.wrap_loader(train_loader)
+        num_checked = len(val_results)
+        stopped = False
+        for epoch in range(start_iteration//iterations_per_epoch, epochs):
+            if stopped:
+                break
             print('Epoch %d: '%epoch, end='\n')
-            for iteration in range(num_train//train_batch):
+            first_iteration = start_iteration - epoch*iterations_per_epoch if epoch == start_iteration//iterations_per_epoch else 0
+            for iteration in range(first_iteration, iterations_per_epoch):
                 
-                total_iteration = epoch*(num_train//train_batch)+iteration
+                total_iteration = epoch*iterations_per_epoch+iteration
                 # output test loss and accuracy
-                if iteration % test_intervals == 0:
-                    test_loss, test_acc = self.test(dataset, test_batch)
-                    test_results.append([total_iteration, test_loss, test_acc])
+                if evaluator:
+                    kinds = [kind for kind, intervals in (('test', test_intervals), ('val', val_intervals)) if iteration % intervals == 0]
+                    if kinds:
+                        evaluator.submit(total_iteration, kinds)
+                    self._merge_eval_results(evaluator.poll(), eval_results)
+                else:
+                    if iteration % test_intervals == 0:
+                        test_loss, test_acc = self.test(dataset, test_batch)
+                        test_results.append([total_iteration, test_loss, test_acc])
 
 
-                if iteration % val_intervals == 0:
-                    val_loss, val_acc = self.val(dataset, val_batch)
-                    val_results.append([total_iteration, val_loss, val_acc])
+                    if iteration % val_intervals == 0:
+                        val_loss, val_acc = self.val(dataset, val_batch)
+                        val_results.append([total_iteration, val_loss, val_acc])
 
-                x, y = next(train_loader)
-                loss, probs = self.forward(x, y)
-                acc = np.sum(np.argmax(probs, axis=-1)==y) / train_batch
+                if early_stop is not None and len(val_results) != num_checked:
+                    num_checked = len(val_results)
+                    if early_stop(val_results):
+                        print('Early stop at iteration %d'%total_iteration)
+                        stopped = True
+                        break
+
+                if metrics:
+                    metrics.begin()
+                if accumulation_steps == 1:
+                    with self._section('data'):
+                        x, y = next(train_loader)
+                    loss, probs = self.forward(x, y)
+                    acc = np.sum(np.argmax(probs, axis=-1)==y) / train_batch
+                    flat_grads = None
+                else:
+                    loss, acc, flat_grads = self._accumulate_grads(train_loader, accumulation_steps)
                 train_results.append([total_iteration, loss, acc])
 
                 if self.regularization:
-                    params, _ = self.get_params()
-                    reg_loss = self.regularization.forward(params)
+                    reg_loss = self.regularization.forward({'flat': self.flat_params})
 
                 if iteration % print_intervals == 0:
                     print('Iteration %d:\t'%iteration, end='')
@@ -115,59 +564,110 @@ class Model():
                     #     if layer.trainable:
                     #         print(layer.name, np.mean(np.abs(layer.weights)))
                 
-                self.backward(y)
-                self.update(self.optimizer, total_iteration)
+                if accumulation_steps == 1:
+                    self.backward(y)
+                self.update(self.optimizer, total_iteration, flat_grads=flat_grads)
+                if metrics:
+                    metrics.end(total_iteration, epoch, loss, acc)
+
+                if checkpointer and (total_iteration+1) % checkpoint_intervals == 0:
+                    if evaluator:
+                        # a resumed run must not miss evaluations that were still running
+                        self._merge_eval_results(evaluator.poll(block=True), eval_results)
+                    checkpointer.save(self, total_iteration+1,
+                                      {'train': train_results, 'val': val_results, 'test': test_results})
+        if prefetcher:
+            prefetcher.close()
+        if checkpointer:
+            checkpointer.close()
+        if metrics:
+            metrics.close()
+        if evaluator:
+            self._merge_eval_results(evaluator.close(), eval_results)
         return np.array(train_results), np.array(val_results), np.array(test_results)
 
 
-    def test(self, dataset, test_batch):
-        # set the mode into testing mode
-        for layer in self.layers:
-            layer.set_mode(training=False)
-        test_loader = dataset.test_loader(test_batch)
-        num_test = dataset.num_test
-        num_accurate = 0
+    def _accumulate_grads(self, train_loader, steps):
+        """Run forward and backward on several batches and average their gradients
+
+        # Arguments
+            train_loader: generator of training batches
+            steps: int, the number of batches
+
+        # Returns
+            loss: float, mean loss over all the samples
+            acc: float, accuracy over all the samples
+            flat_grads: numpy array with shape (num_params,), mean gradients over all the samples
+        """
+        if self.accumulated_grads is None or self.accumulated_grads.shape != self.flat_grads.shape:
+            self.accumulated_grads = np.zeros(self.flat_grads.shape)
+        accumulated_grads = self.accumulated_grads
+        accumulated_grads[...] = 0
         sum_loss = 0
-        try:
-            while True:
-                x, y = next(test_loader)
-                loss, probs = self.forward(x, y)
-                num_accurate += np.sum(np.argmax(probs, axis=-1)==y)
-                sum_loss += loss
-        except StopIteration:
-            avg_loss = sum_loss*test_batch/num_test
-            accuracy = num_accurate/num_test
-            print('Test accuracy=%.5f, loss=%.5f'%(accuracy, avg_loss))
+        num_accurate = 0
+        num = 0
+        for _ in range(steps):
+            with self._section('data'):
+                x, y = next(train_loader)
+            loss, probs = self.forward(x, y)
+            self.backward(y)
+            # loss and gradients are batch means, weight them by the batch size
+            self.flat_grads *= len(y)
+            accumulated_grads += self.flat_grads
+            sum_loss += loss * len(y)
+            num_accurate += np.sum(np.argmax(probs, axis=-1)==y)
+            num += len(y)
+        accumulated_grads /= num
+        return sum_loss / num, num_accurate / num, accumulated_grads
 
-        # reset the mode into training for continous training
-        for layer in self.layers:
-            layer.set_mode(training=True)
+    def _merge_eval_results(self, finished, eval_results):
+        """Append background evaluations to val_results/test_results, ordered by iteration"""
+        for kind, iteration, loss, acc in finished:
+            print('%s at iteration %d: accuracy=%.5f, loss=%.5f'%('Test' if kind == 'test' else 'Validation', iteration, acc, loss))
+            eval_results[kind].append([iteration, loss, acc])
+            eval_results[kind].sort(key=lambda r: r[0])
 
-        return avg_loss, accuracy
-        
+    def evaluate(self, batches, batch, num):
+        """Average loss and accuracy over batches
 
-    
-    def val(self, dataset, val_batch):
+        # Arguments
+            batches: iterable of (x, y), e.g. dataset.test_loader(batch) or a list of pre-encoded batches
+            batch: int, the batch size of batches
+            num: int, the number of samples in batches
+
+        # Returns
+            avg_loss: float
+            accuracy: float
+        """
         # set the mode into testing mode
         for layer in self.layers:
             layer.set_mode(training=False)
-        val_loader = dataset.val_loader(val_batch)
-        num_val = dataset.num_val
+        # the per-layer statistics only cover training steps
+        profiler, self.profiler = self.profiler, None
         num_accurate = 0
         sum_loss = 0
-        try:
-            while True:
-                x, y = next(val_loader)
-                loss, probs = self.forward(x, y)
-                num_accurate += np.sum(np.argmax(probs, axis=-1)==y)
-                sum_loss += loss
-        except StopIteration:
-            avg_loss = sum_loss*val_batch/num_val
-            accuracy = num_accurate/num_val
-            print('Validation accuracy: %.5f, loss: %.5f'%(accuracy, avg_loss))
+        for x, y in batches:
+            loss, probs = self.forward(x, y)
+            num_accurate += np.sum(np.argmax(probs, axis=-1)==y)
+            sum_loss += loss
+        avg_loss = sum_loss*batch/num
+        accuracy = num_accurate/num
 
         # reset the mode into training for continous training
         for layer in self.layers:
             layer.set_mode(training=True)
+        self.profiler = profiler
+
+        return avg_loss, accuracy
 
+    def test(self, dataset, test_batch):
+        with self._section('evaluate/test'):
+            avg_loss, accuracy = self.evaluate(dataset.test_loader(test_batch), test_batch, dataset.num_test)
+        print('Test accuracy=%.5f, loss=%.5f'%(accuracy, avg_loss))
+        return avg_loss, accuracy
+
+    def val(self, dataset, val_batch):
+        with self._section('evaluate/val'):
+            avg_loss, accuracy = self.evaluate(dataset.val_loader(val_batch), val_batch, dataset.num_val)
+        print('Validation accuracy: %.5f, loss: %.5f'%(accuracy, avg_loss))
         return avg_loss, accuracy
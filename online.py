@@ -0,0 +1,145 @@
+"""
+This file defines online training of a compiled SentimentNet on a stream of new labeled sentences,
+growing the vocabulary and the embedding as new words arrive.
+"""
+import os
+import numpy as np
+from utils.tools import HashingVocabulary, one_hot
+
+
+class OnlineLearner():
+
+    def __init__(self, model, dictionary, tokenizer=None, max_length=30, batch=20, max_words=None):
+        """Incremental training of a trained model on new data only
+
+        The vocabulary is extended append-only: a new word gets the id after the
+        last one, so the trained embedding rows keep their ids, and the embedding
+        (Model.grow_embedding) and its optimizer state grow in place. A
+        HashingVocabulary never grows. The iteration count continues across calls,
+        for the optimizer schedules.
+
+        # Arguments
+            model: compiled Model whose first layer is the embedding of one-hot words
+            dictionary: dictionary word -> id in 1, ..., V (e.g. dataset.dictionary, extended in place)
+                or HashingVocabulary
+            tokenizer: function string -> list of words, None for nltk.word_tokenize of the lower-cased string
+                as utils.datasets.Sentiment
+            max_length: int, the number of words kept of every sentence
+            batch: int, training batch size
+            max_words: int, stop adding words once the vocabulary has that many, None for no limit;
+                the words left out are dropped from their sentences
+        """
+        if tokenizer is None:
+            import nltk
+            tokenizer = lambda s: nltk.word_tokenize(s.lower())
+        self.model = model
+        self.dictionary = dictionary
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.batch = batch
+        self.max_words = max_words
+        self.iteration = 0
+        self.num_new_words = 0
+
+    def add_words(self, sentences):
+        """Give ids to the unseen words of sentences and grow the embedding, return the number of new words"""
+        if isinstance(self.dictionary, HashingVocabulary):
+            return 0
+        new_words = []
+        for s in sentences:
+            for w in self.tokenizer(s)[:self.max_length]:
+                if w not in self.dictionary:
+                    if self.max_words is not None and len(self.dictionary) >= self.max_words:
+                        break
+                    self.dictionary[w] = len(self.dictionary) + 1
+                    new_words.append(w)
+        if new_words:
+            self.model.grow_embedding(len(new_words))
+            self.num_new_words += len(new_words)
+        return len(new_words)
+
+    def encode_ids(self, sentences):
+        """Word ids of sentences with shape (N, max_length), 0 for padding
+
+        Words without id (max_words) are dropped and the remaining ids packed to the
+        left: the layers expect padding at the tail only, a NaN step in the middle of
+        a sentence would give NaN outputs.
+        """
+        ids = np.zeros((len(sentences), self.max_length), dtype=np.int64)
+        for n, s in enumerate(sentences):
+            words = self.tokenizer(s)[:self.max_length]
+            if isinstance(self.dictionary, HashingVocabulary):
+                known = [self.dictionary.signed_index(w) for w in words]
+            else:
+                known = [self.dictionary[w] for w in words if w in self.dictionary]
+            ids[n, :len(known)] = known
+        return ids
+
+    def encode(self, sentences):
+        """One-hot encoding of sentences with shape (N, max_length, V), words without id are dropped"""
+        return one_hot(self.encode_ids(sentences), len(self.dictionary))
+
+    def partial_fit(self, sentences, labels, epochs=1, shuffle=True):
+        """Train on a chunk of new labeled sentences only
+
+        # Arguments
+            sentences: list of string
+            labels: numpy array of int with shape (N,)
+            epochs: int, passes over the chunk
+            shuffle: boolean, visit the chunk in a random order (numpy RNG)
+
+        # Returns
+            loss: float, mean training loss over the passes
+            acc: float, training accuracy over the passes
+        """
+        labels = np.asarray(labels)
+        self.add_words(sentences)
+        # the chunk stays as ids, only a mini-batch at a time is one-hot encoded
+        ids = self.encode_ids(sentences)
+        # sentences whose words are all unknown (max_words) carry no signal
+        keep = np.any(ids != 0, axis=1)
+        ids, labels = ids[keep], labels[keep]
+        sum_loss = 0.0
+        num_accurate = 0
+        num = 0
+        for _ in range(epochs):
+            order = np.random.permutation(len(labels)) if shuffle else np.arange(len(labels))
+            for start in range(0, len(order), self.batch):
+                idx = order[start:start+self.batch]
+                x = one_hot(ids[idx], len(self.dictionary))
+                loss, probs = self.model.forward(x, labels[idx])
+                self.model.backward(labels[idx])
+                self.model.update(self.model.optimizer, self.iteration)
+                self.iteration += 1
+                sum_loss += loss * len(idx)
+                num_accurate += np.sum(np.argmax(probs, axis=-1) == labels[idx])
+                num += len(idx)
+        return sum_loss / max(num, 1), num_accurate / max(num, 1)
+
+    def consume(self, stream, chunk=1000, epochs=1):
+        """Train on a stream of (sentence, label) pairs, chunk pairs at a time
+
+        # Returns
+            results: numpy array of [iteration, loss, accuracy, vocabulary size], one row per chunk
+        """
+        results = []
+        sentences, labels = [], []
+        for sentence, label in stream:
+            sentences.append(sentence)
+            labels.append(label)
+            if len(sentences) == chunk:
+                loss, acc = self.partial_fit(sentences, labels, epochs)
+                results.append([self.iteration, loss, acc, len(self.dictionary)])
+                sentences, labels = [], []
+        if sentences:
+            loss, acc = self.partial_fit(sentences, labels, epochs)
+            results.append([self.iteration, loss, acc, len(self.dictionary)])
+        return np.array(results)
+
+    def save_dictionary(self, path):
+        """Write the vocabulary in id order in the format of data/dictionary.csv, see Sentiment(rebuild_dictionary=False)"""
+        import pandas as pd
+        words = sorted(self.dictionary, key=self.dictionary.get)
+        tmp_path = path + '.tmp'
+        pd.DataFrame(data={'word': words}).to_csv(tmp_path, sep='\t', header=None, index=False)
+        os.replace(tmp_path, path)
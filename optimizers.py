@@ -2,9 +2,11 @@
 changelog:
 - version 2: remove bias_correction in the comments of Adam (no need to implement it);
                      correct the implementation of RMSprop (self.accumulators[k] = self.rho * self.accumulators[k] + (1 - self.rho) * xs_grads[k]**2)
+- version 3: update parameters and states in place with preallocated temporaries, `update` returns the same arrays;
+                     Adam keeps its moments and accumulators across updates; add the `nesterov` option of SGD; fix the state initialization of RMSprop
 """
 import numpy as np
-import copy
+from utils.tools import RowSparse
 
 class Optimizer():
     
@@ -15,11 +17,57 @@ class Optimizer():
             lr: float, learnig rate 
         """
         self.lr = lr
+        self.num_updates = 0 # the number of update calls, the clock of lazy row-sparse updates
+        self.last_steps = {} # the update call at which every row of a row-sparse parameter was last updated
+        self.buffers = {} # preallocated temporaries, one per parameter
 
     def update(self, x, x_grad, iteration):
-        """Update parameters with gradients"""
+        """Update parameters with gradients, in place
+
+        A gradient may be a RowSparse: then only its rows of the parameter and of
+        the optimizer state are updated. State that would have decayed while a row
+        was skipped is caught up when the row is touched again.
+        """
         raise NotImplementedError
 
+    def _state(self, name, k, x):
+        """Return the state array self.<name>[k], allocating zeros like x the first time"""
+        states = getattr(self, name)
+        if states is None:
+            states = {}
+            setattr(self, name, states)
+        if k not in states:
+            states[k] = np.zeros(x.shape)
+        return states[k]
+
+    def _buffer(self, k, x):
+        """Return a temporary array like x, allocated only once"""
+        if k not in self.buffers or self.buffers[k].shape != x.shape:
+            self.buffers[k] = np.empty(x.shape)
+        return self.buffers[k]
+
+    def grow_state(self, k, index, size):
+        """Insert size zeros at index (axis 0) into every state array of parameter k
+
+        Called when a parameter grows, e.g. new embedding rows (Model.grow_embedding),
+        so that the state of the existing entries stays aligned with them.
+        """
+        for name, states in vars(self).items():
+            if name == 'buffers' or not isinstance(states, dict) or not isinstance(states.get(k), np.ndarray):
+                continue
+            state = states[k]
+            zeros = np.zeros((size,)+state.shape[1:], dtype=state.dtype)
+            states[k] = np.concatenate([state[:index], zeros, state[index:]])
+        self.buffers.pop(k, None)
+
+    def _skipped_steps(self, k, rows, num_rows):
+        """Return the number of updates that skipped each row (shape (R, 1)) and mark the rows as updated now"""
+        if k not in self.last_steps:
+            self.last_steps[k] = np.zeros(num_rows, dtype=np.int64)
+        skipped = self.num_updates - self.last_steps[k][rows] - 1
+        self.last_steps[k][rows] = self.num_updates
+        return np.maximum(skipped, 0)[:, None]
+
     def scheduler(self, func, iteration):
         """learning rate scheduler, to change learning rate with respect to iteration
         
@@ -33,18 +81,56 @@ class Optimizer():
         lr = func(self.lr, iteration)
         return lr
 
+def linear_scaling_warmup(base_lr, batch, base_batch, warmup_iterations=500, scheduler_func=None):
+    """Learning rate rule for large (e.g. accumulated) batches, to be used as scheduler_func
+
+    The learning rate is scaled linearly with the batch size, and ramped up from
+    base_lr to the scaled value over the first warmup_iterations iterations.
+
+    # Arguments
+        base_lr: float, the learning rate tuned for base_batch
+        batch: int, the effective batch size (train_batch*accumulation_steps)
+        base_batch: int, the batch size base_lr was tuned for
+        warmup_iterations: int, the length of the ramp
+        scheduler_func: function, schedule applied after the warmup, arguments are lr and iteration
+
+    # Returns
+        func: function, arguments are lr and iteration
+    """
+    target_lr = base_lr * batch / base_batch
+
+    def func(lr, iteration):
+        if iteration < warmup_iterations:
+            return base_lr + (target_lr - base_lr) * iteration / warmup_iterations
+        if iteration == warmup_iterations:
+            lr = target_lr
+        if scheduler_func:
+            lr = scheduler_func(lr, iteration)
+        return lr
+    return func
+
+def _apply_scaled_step(x, grad, accumulators, lr, epsilon, tmp):
+    """x -= lr * grad / (sqrt(accumulators) + epsilon), in place, using tmp as the only temporary"""
+    np.sqrt(accumulators, out=tmp)
+    tmp += epsilon
+    np.divide(grad, tmp, out=tmp)
+    tmp *= lr
+    x -= tmp
+
 class SGD(Optimizer):
     
-    def __init__(self, lr=0.01, momentum=0, decay=0, scheduler_func = None):
+    def __init__(self, lr=0.01, momentum=0, decay=0, nesterov=False, scheduler_func = None):
         """Initialization
         
         # Arguments
             lr: float, learnig rate 
             momentum: float, the ratio of moments
             decay: float, the learning rate decay ratio
+            nesterov: boolean, whether to apply Nesterov momentum
         """
         super(SGD, self).__init__(lr)
         self.momentum = momentum
+        self.nesterov = nesterov
         self.moments = None
         self.decay = decay
         self.scheduler_func = scheduler_func
@@ -58,29 +144,56 @@ class SGD(Optimizer):
             iteration: int, current iteration number in the whole training process (not in that epoch)
 
         # Returns
-            new_xs: dictionary, new weights of model
+            xs: dictionary, the same weights, updated in place
         """
-        new_xs = {}
+        self.num_updates += 1
         if self.decay > 0:
             self.lr *= (1/(1+self.decay*iteration))
         if self.scheduler_func:
             self.lr = self.scheduler(self.scheduler_func, iteration)
 
-        # initialize self.moments
-        if not self.moments:
-            self.moments = {}
-            for k, v in xs_grads.items():
-                self.moments[k] = np.zeros(v.shape)
-
-        prev_moments = copy.deepcopy(self.moments)
-
         for k in list(xs.keys()):
-            self.moments[k] = self.momentum * self.moments[k] - self.lr * xs_grads[k]
+            x = xs[k]
+            moments = self._state('moments', k, x)
+            if isinstance(xs_grads[k], RowSparse):
+                self._sparse_update(k, x, xs_grads[k])
+                continue
+            tmp = self._buffer(k, x)
+            # x - momentum * prev_moments + (1+momentum) * moments
             if self.nesterov:
-                new_xs[k] = xs[k] - self.momentum * prev_moments[k] + (1+self.momentum) * self.moments[k]  
+                np.multiply(moments, self.momentum, out=tmp)
+                x -= tmp
+            moments *= self.momentum
+            np.multiply(xs_grads[k], self.lr, out=tmp)
+            moments -= tmp
+            if self.nesterov:
+                np.multiply(moments, 1+self.momentum, out=tmp)
+                x += tmp
             else:
-                new_xs[k] = xs[k] + self.moments[k]
-        return new_xs
+                x += moments
+        return xs
+
+    def _sparse_update(self, k, x, grad):
+        """Lazy momentum update of the rows in grad, exact: with zero gradients
+        the moment of a skipped row decays by momentum every step while still
+        moving the row, which is a geometric series caught up in closed form"""
+        rows = grad.rows
+        skipped = self._skipped_steps(k, rows, x.shape[0])
+        moments = self.moments[k][rows]
+        if 0 < self.momentum < 1:
+            series = (1 - self.momentum**skipped) / (1 - self.momentum)
+            if self.nesterov:
+                x[rows] += moments * self.momentum**2 * series
+            else:
+                x[rows] += moments * self.momentum * series
+            moments *= self.momentum**skipped
+        new_moments = self.momentum * moments - self.lr * grad.values
+        if self.nesterov:
+            x[rows] += - self.momentum * moments + (1+self.momentum) * new_moments
+        else:
+            x[rows] += new_moments
+        self.moments[k][rows] = new_moments
+        return x
 
 class Adam(Optimizer):
     
@@ -116,31 +229,63 @@ class Adam(Optimizer):
             iteration: int, current iteration number in the whole training process (not in that epoch)
 
         # Returns
-            new_xs: dictionary, new weights of model
+            xs: dictionary, the same weights, updated in place
         """
-        new_xs = {}
+        self.num_updates += 1
         if self.decay > 0:
             self.lr *= (1/(1+self.decay*iteration))
         if self.scheduler_func:
             self.lr = self.scheduler(self.scheduler_func, iteration)
-        # initialization of moments and accumulators
-        if not self.accumulators or self.moments:
-            self.moments = {}
-            self.accumulators = {}
-            for k,v in xs.items():
-                self.moments[k] = np.zeros(v.shape)
-                self.accumulators[k] = np.zeros(v.shape)
 
         for k in list(xs.keys()):
-            self.moments[k] = self.beta_1 * self.moments[k] + (1-self.beta_1) * xs_grads[k]
-            self.accumulators[k] = self.beta_2 * self.accumulators[k] + (1 - self.beta_2) * xs_grads[k]**2
+            x = xs[k]
+            grad = xs_grads[k]
+            moments = self._state('moments', k, x)
+            accumulators = self._state('accumulators', k, x)
+            if isinstance(grad, RowSparse):
+                self._sparse_update(k, x, grad, iteration)
+                continue
+            tmp = self._buffer(k, x)
+            moments *= self.beta_1
+            np.multiply(grad, 1-self.beta_1, out=tmp)
+            moments += tmp
+            accumulators *= self.beta_2
+            np.square(grad, out=tmp)
+            tmp *= 1 - self.beta_2
+            accumulators += tmp
+            # lr * moments / (sqrt(accumulators) + epsilon), with the bias corrected moments and accumulators if needed
             if self.bias_correction:
-                moments_t = self.moments[k] / (1 - self.beta_1**(iteration+1))
-                accumulators_t = self.accumulators[k] / (1 - self.beta_2**(iteration+1))
-                new_xs[k] = xs[k] - self.lr * moments_t / (np.sqrt(accumulators_t)+self.epsilon)
+                np.divide(accumulators, 1 - self.beta_2**(iteration+1), out=tmp)
+                np.sqrt(tmp, out=tmp)
             else:
-                new_xs[k] = xs[k] - self.lr * self.moments[k] / (np.sqrt(self.accumulators[k]) + self.epsilon)
-        return new_xs
+                np.sqrt(accumulators, out=tmp)
+            tmp += self.epsilon
+            np.divide(moments, tmp, out=tmp)
+            if self.bias_correction:
+                tmp /= 1 - self.beta_1**(iteration+1)
+            tmp *= self.lr
+            x -= tmp
+        return xs
+
+    def _sparse_update(self, k, x, grad, iteration):
+        """Lazy Adam update of the rows in grad
+
+        The moments and accumulators of skipped rows are decayed exactly
+        (beta_1**skipped, beta_2**skipped) before the update. Approximation: the
+        steps a skipped row would have taken on its decaying moment alone are
+        not applied.
+        """
+        rows = grad.rows
+        skipped = self._skipped_steps(k, rows, x.shape[0])
+        moments = self.beta_1**(skipped+1) * self.moments[k][rows] + (1-self.beta_1) * grad.values
+        accumulators = self.beta_2**(skipped+1) * self.accumulators[k][rows] + (1 - self.beta_2) * grad.values**2
+        self.moments[k][rows] = moments
+        self.accumulators[k][rows] = accumulators
+        if self.bias_correction:
+            moments = moments / (1 - self.beta_1**(iteration+1))
+            accumulators = accumulators / (1 - self.beta_2**(iteration+1))
+        x[rows] -= self.lr * moments / (np.sqrt(accumulators) + self.epsilon)
+        return x
 
 class Adagrad(Optimizer):
     def __init__(self, lr=0.01, epsilon=None, decay=0, scheduler_func=None):
@@ -168,21 +313,33 @@ class Adagrad(Optimizer):
             iteration: int, current iteration number in the whole training process (not in that epoch)
 
         # Returns
-            new_xs: dictionary, new weights of model
+            xs: dictionary, the same weights, updated in place
         """
-        new_xs = {}
+        self.num_updates += 1
         if self.decay > 0:
             self.lr *= (1/(1+self.decay*iteration))
         if self.scheduler_func:
             self.lr = self.scheduler(self.scheduler_func, iteration)
-        if not self.accumulators:
-            self.accumulators = {}
-            for k,v in xs.items():
-                self.accumulators[k] = np.zeros(v.shape)
         for k in list(xs.keys()):
-            self.accumulators[k] += xs_grads[k]**2
-            new_xs[k] = xs[k] - self.lr * xs_grads[k] / (np.sqrt(self.accumulators[k]) + self.epsilon)
-        return new_xs
+            x = xs[k]
+            grad = xs_grads[k]
+            accumulators = self._state('accumulators', k, x)
+            if isinstance(grad, RowSparse):
+                self._sparse_update(k, x, grad)
+                continue
+            tmp = self._buffer(k, x)
+            np.square(grad, out=tmp)
+            accumulators += tmp
+            _apply_scaled_step(x, grad, accumulators, self.lr, self.epsilon, tmp)
+        return xs
+
+    def _sparse_update(self, k, x, grad):
+        """Lazy Adagrad update of the rows in grad, exact since skipped rows neither move nor change state"""
+        rows = grad.rows
+        accumulators = self.accumulators[k][rows] + grad.values**2
+        self.accumulators[k][rows] = accumulators
+        x[rows] -= self.lr * grad.values / (np.sqrt(accumulators) + self.epsilon)
+        return x
 
 class RMSprop(Optimizer):
     def __init__(self, lr=0.001, rho=0.9, epsilon=None, decay=0, scheduler_func=None):
@@ -212,18 +369,87 @@ class RMSprop(Optimizer):
             iteration: int, current iteration number in the whole training process (not in that epoch)
 
         # Returns
-            new_xs: dictionary, new weights of model
+            xs: dictionary, the same weights, updated in place
         """
-        new_xs = {}
+        self.num_updates += 1
         if self.decay > 0:
             self.lr *= (1/(1+self.decay*iteration))
         if self.scheduler_func:
             self.lr = self.scheduler(self.scheduler_func, iteration)
-        if not self.accumulators:
-            self.accumulators = {}
-            for k,v in xs.ietms():
-                self.accumulators[k] = np.zeros(v.shape)
         for k in list(xs.keys()):
-            self.accumulators[k] = self.rho * self.accumulators[k] + (1 - self.rho) * xs_grads[k]**2
-            new_xs[k] = xs[k] - self.lr * xs_grads[k] / (np.sqrt(self.accumulators[k]) + self.epsilon)
-        return new_xs
\ No newline at end of file
+            x = xs[k]
+            grad = xs_grads[k]
+            accumulators = self._state('accumulators', k, x)
+            if isinstance(grad, RowSparse):
+                self._sparse_update(k, x, grad)
+                continue
+            tmp = self._buffer(k, x)
+            accumulators *= self.rho
+            np.square(grad, out=tmp)
+            tmp *= 1 - self.rho
+            accumulators += tmp
+            _apply_scaled_step(x, grad, accumulators, self.lr, self.epsilon, tmp)
+        return xs
+
+    def _sparse_update(self, k, x, grad):
+        """Lazy RMSprop update of the rows in grad, exact: skipped rows do not
+        move and their accumulators are decayed by rho**skipped"""
+        rows = grad.rows
+        skipped = self._skipped_steps(k, rows, x.shape[0])
+        accumulators = self.rho**(skipped+1) * self.accumulators[k][rows] + (1 - self.rho) * grad.values**2
+        self.accumulators[k][rows] = accumulators
+        x[rows] -= self.lr * grad.values / (np.sqrt(accumulators) + self.epsilon)
+        return x
+
+
+if __name__ == '__main__':
+    from utils.tools import rel_error
+
+    def reference_update(name, opt, xs, grads, state, iteration):
+        """The out-of-place formulas of version 2, with the state kept across updates"""
+        lr = opt.lr
+        new_xs = {}
+        for k in xs:
+            g = grads[k]
+            if name == 'SGD':
+                prev = state.setdefault('m', {}).get(k, np.zeros(g.shape))
+                state['m'][k] = opt.momentum * prev - lr * g
+                if opt.nesterov:
+                    new_xs[k] = xs[k] - opt.momentum * prev + (1+opt.momentum) * state['m'][k]
+                else:
+                    new_xs[k] = xs[k] + state['m'][k]
+            elif name == 'Adam':
+                m = state.setdefault('m', {}).get(k, np.zeros(g.shape))
+                a = state.setdefault('a', {}).get(k, np.zeros(g.shape))
+                state['m'][k] = m = opt.beta_1 * m + (1-opt.beta_1) * g
+                state['a'][k] = a = opt.beta_2 * a + (1 - opt.beta_2) * g**2
+                if opt.bias_correction:
+                    m = m / (1 - opt.beta_1**(iteration+1))
+                    a = a / (1 - opt.beta_2**(iteration+1))
+                new_xs[k] = xs[k] - lr * m / (np.sqrt(a) + opt.epsilon)
+            elif name == 'Adagrad':
+                a = state.setdefault('a', {}).get(k, np.zeros(g.shape))
+                state['a'][k] = a = a + g**2
+                new_xs[k] = xs[k] - lr * g / (np.sqrt(a) + opt.epsilon)
+            elif name == 'RMSprop':
+                a = state.setdefault('a', {}).get(k, np.zeros(g.shape))
+                state['a'][k] = a = opt.rho * a + (1 - opt.rho) * g**2
+                new_xs[k] = xs[k] - lr * g / (np.sqrt(a) + opt.epsilon)
+        return new_xs
+
+    np.random.seed(5242)
+    cases = [('SGD', SGD(lr=0.01, momentum=0.9)), ('SGD', SGD(lr=0.01, momentum=0.9, nesterov=True)),
+             ('Adam', Adam(lr=0.001)), ('Adam', Adam(lr=0.001, bias_correction=True)),
+             ('Adagrad', Adagrad(lr=0.01)), ('RMSprop', RMSprop(lr=0.001))]
+    for name, opt in cases:
+        print('Testing {}...'.format(name))
+        xs = {'w': np.random.normal(size=(50, 20)), 'b': np.random.normal(size=20)}
+        expected = {k: v.copy() for k, v in xs.items()}
+        state = {}
+        for iteration in range(20):
+            grads = {k: np.random.normal(size=v.shape) for k, v in xs.items()}
+            new_xs = opt.update(xs, grads, iteration)
+            assert all(new_xs[k] is xs[k] for k in xs), 'parameters must be updated in place'
+            expected = reference_update(name, opt, expected, grads, state, iteration)
+        for k in xs:
+            print('Relative error of {} (<1e-12 will be fine): {}'.format(k, rel_error(xs[k], expected[k])))
@@ -0,0 +1,427 @@
+"""
+This file defines multi-process trainers that run replicas of a `Model` on the cores of one machine,
+the thread pool that splits the batches of single layers (`Model.set_num_threads`) and the
+background batch loader of `Model.train(prefetch=...)`.
+"""
+import copy
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from concurrent.futures import ThreadPoolExecutor
+import os
+import queue
+import threading
+import time
+import warnings
+import numpy as np
+from checkpoint import optimizer_state, set_optimizer_state
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+
+def _collect(procs, results):
+    """Wait for the next result, failing fast when any of procs dies"""
+    while True:
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            for p in procs:
+                if p.exitcode not in (None, 0):
+                    raise RuntimeError('worker {} exited with code {}'.format(p.name, p.exitcode))
+
+
+class DataParallel():
+
+    def __init__(self, model, num_workers=2, seed=5242):
+        """Synchronous data-parallel trainer
+
+        Every worker process owns a replica of the compiled model and computes
+        gradients on its shard of each batch. The flat gradient vectors are summed
+        through a shared-memory buffer, rank 0 runs a single optimizer.update and
+        publishes the new parameters, and all replicas (rank 0 included) load them
+        back, so the parameters stay bit-identical across workers. At the end the
+        parameters and the optimizer state of rank 0 are loaded into model, so that
+        training can go on from there.
+
+        # Arguments
+            model: compiled Model
+            num_workers: int, the number of worker processes
+            seed: int, numpy seed shared by all workers so that they draw the same batches
+        """
+        self.model = model
+        self.num_workers = num_workers
+        self.seed = seed
+        self.samples_per_sec = None
+
+    def train(self, dataset, train_batch=32, val_batch=1000, test_batch=1000, epochs=5, val_intervals=100, test_intervals=500, print_intervals=100):
+        """Same arguments and returns with Model.train"""
+        assert train_batch >= self.num_workers, 'train_batch must be no smaller than num_workers'
+        size = self.model.flat_params.size
+
+        # one row per worker: [gradients * shard size, loss * shard size, number of correct predictions]
+        grads_shm = shared_memory.SharedMemory(create=True, size=self.num_workers*(size+2)*8)
+        params_shm = shared_memory.SharedMemory(create=True, size=size*8)
+        try:
+            params_buf = np.ndarray((size,), dtype=np.float64, buffer=params_shm.buf)
+            params_buf[...] = self.model.flat_params
+
+            ctx = mp.get_context('fork')
+            barrier = ctx.Barrier(self.num_workers)
+            results = ctx.Queue()
+            config = (train_batch, val_batch, test_batch, epochs, val_intervals, test_intervals, print_intervals)
+            procs = [ctx.Process(target=self._worker, name='worker-%d'%rank,
+                                 args=(rank, dataset, size, grads_shm, params_shm, barrier, results, config))
+                     for rank in range(self.num_workers)]
+            for p in procs:
+                p.start()
+            train_results, val_results, test_results, self.samples_per_sec, optimizer = _collect(procs, results)
+            for p in procs:
+                p.join()
+
+            self.model.flat_params[...] = params_buf
+            set_optimizer_state(self.model.optimizer, *optimizer)
+            del params_buf
+        finally:
+            grads_shm.close()
+            grads_shm.unlink()
+            params_shm.close()
+            params_shm.unlink()
+        return np.array(train_results), np.array(val_results), np.array(test_results)
+
+    def _worker(self, rank, dataset, size, grads_shm, params_shm, barrier, results, config):
+        train_batch, val_batch, test_batch, epochs, val_intervals, test_intervals, print_intervals = config
+        model = self.model
+        grads_buf = np.ndarray((self.num_workers, size+2), dtype=np.float64, buffer=grads_shm.buf)
+        params_buf = np.ndarray((size,), dtype=np.float64, buffer=params_shm.buf)
+        np.random.seed(self.seed)
+        train_loader = dataset.train_loader(train_batch, shard=(rank, self.num_workers))
+        num_train = dataset.num_train
+
+        train_results = []
+        test_results = []
+        val_results = []
+        train_time = 0
+
+        try:
+            model.flat_params[...] = params_buf
+            for epoch in range(epochs):
+                if rank == 0:
+                    print('Epoch %d: '%epoch, end='\n')
+                for iteration in range(num_train//train_batch):
+                    total_iteration = epoch*(num_train//train_batch)+iteration
+                    if rank == 0 and iteration % test_intervals == 0:
+                        test_loss, test_acc = model.test(dataset, test_batch)
+                        test_results.append([total_iteration, test_loss, test_acc])
+                    if rank == 0 and iteration % val_intervals == 0:
+                        val_loss, val_acc = model.val(dataset, val_batch)
+                        val_results.append([total_iteration, val_loss, val_acc])
+
+                    start = time.time()
+                    x, y = next(train_loader)
+                    loss, probs = model.forward(x, y)
+                    model.backward(y)
+
+                    # weight by the shard size so that uneven shards average correctly
+                    row = grads_buf[rank]
+                    np.multiply(model.flat_grads, len(y), out=row[:size])
+                    row[size] = loss * len(y)
+                    row[size+1] = np.sum(np.argmax(probs, axis=-1)==y)
+                    barrier.wait()
+
+                    if rank == 0:
+                        total = np.sum(grads_buf, axis=0)
+                        model.update(model.optimizer, total_iteration, flat_grads=total[:size] / train_batch)
+                        params_buf[...] = model.flat_params
+                        loss, acc = total[size] / train_batch, total[size+1] / train_batch
+                        train_results.append([total_iteration, loss, acc])
+                        if iteration % print_intervals == 0:
+                            print('Iteration %d:\t'%iteration, end='')
+                            print('accuracy=%.5f, loss=%.5f'%(acc, loss))
+                    barrier.wait()
+
+                    model.flat_params[...] = params_buf
+                    train_time += time.time() - start
+        except threading.BrokenBarrierError:
+            return
+        except BaseException:
+            barrier.abort()
+            raise
+
+        if rank == 0:
+            num_samples = epochs * (num_train//train_batch) * train_batch
+            results.put((train_results, val_results, test_results, num_samples / max(train_time, 1e-12),
+                         optimizer_state(model.optimizer)))
+
+
+class Hogwild():
+
+    def __init__(self, model, num_workers=2, seed=5242):
+        """Lock-free asynchronous trainer (Hogwild!)
+
+        The flat parameter vector of the model is moved into shared memory.
+        Worker processes run forward/backward/optimizer.update on their own batches
+        and write the new values into the shared arrays without any lock, so a
+        worker may read parameters that another worker is half way through
+        updating. This works well when each step only touches a few rows, e.g. the
+        embedding of SentimentNet(sparse_embedding=True), whose lazy row-sparse
+        updates write only the rows of the words of the batch. The other (dense)
+        layers are still overwritten in full by every step of every worker, without
+        locks. Every worker keeps its own optimizer state.
+
+        # Arguments
+            model: compiled Model, best with a sparse_grad embedding
+            num_workers: int, the number of worker processes
+            seed: int, worker rank is seeded with seed+rank
+        """
+        self.model = model
+        self.num_workers = num_workers
+        self.seed = seed
+
+    def train(self, dataset, train_batch=32, val_batch=1000, epochs=5, eval_interval=5.0):
+        """Train asynchronously while an evaluator process reports validation accuracy
+
+        # Arguments
+            dataset: dataset with train_loader and val_loader
+            train_batch: int, batch size of every worker
+            val_batch: int, batch size of the evaluator
+            epochs: int, the total work is epochs*num_train//train_batch iterations, split among the workers
+            eval_interval: float, seconds between two evaluations
+
+        # Returns
+            val_results: numpy array of [seconds since start, finished iterations, loss, accuracy]
+        """
+        size = self.model.flat_params.size
+        params_shm = shared_memory.SharedMemory(create=True, size=size*8)
+        try:
+            params_buf = np.ndarray((size,), dtype=np.float64, buffer=params_shm.buf)
+            # from now on the layers compute with views into shared memory
+            self.model.flatten_params(params_buf)
+
+            ctx = mp.get_context('fork')
+            progress = ctx.RawArray('q', self.num_workers)
+            done = ctx.Event()
+            results = ctx.Queue()
+            num_iterations = epochs*(dataset.num_train//train_batch)
+            start = time.time()
+            workers = [ctx.Process(target=self._worker, name='worker-%d'%rank,
+                                   args=(rank, dataset, train_batch, num_iterations, progress))
+                       for rank in range(self.num_workers)]
+            evaluator = ctx.Process(target=self._evaluator, name='evaluator',
+                                    args=(dataset, val_batch, params_buf, progress, done, results, start, eval_interval))
+            evaluator.start()
+            for p in workers:
+                p.start()
+            for p in workers:
+                p.join()
+            done.set()
+
+            val_results = []
+            while True:
+                result = _collect([evaluator], results)
+                if result is None:
+                    break
+                val_results.append(result)
+            evaluator.join()
+            for p in workers:
+                if p.exitcode != 0:
+                    raise RuntimeError('worker {} exited with code {}'.format(p.name, p.exitcode))
+
+            # move the parameters back into private memory before the block is released
+            self.model.flatten_params()
+            del params_buf
+        finally:
+            params_shm.close()
+            params_shm.unlink()
+        return np.array(val_results)
+
+    def _worker(self, rank, dataset, train_batch, num_iterations, progress):
+        model = self.model
+        np.random.seed(self.seed + rank)
+        train_loader = dataset.train_loader(train_batch)
+        for iteration in range(rank, num_iterations, self.num_workers):
+            x, y = next(train_loader)
+            model.forward(x, y)
+            model.backward(y)
+            # the parameters are in shared memory: written in place, without locking
+            model.update(model.optimizer, iteration)
+            progress[rank] += 1
+
+    def _evaluator(self, dataset, val_batch, params_buf, progress, done, results, start, eval_interval):
+        model = self.model
+        model.flatten_params()
+        while True:
+            finished = done.wait(eval_interval)
+            # evaluate on a private snapshot so that the workers are never blocked
+            model.flat_params[...] = params_buf
+            val_loss, val_acc = model.val(dataset, val_batch)
+            results.put([time.time()-start, sum(progress), val_loss, val_acc])
+            if finished:
+                break
+        results.put(None)
+
+
+def time_to_accuracy(val_results, target):
+    """Seconds until the validation accuracy first reaches target, None if never reached
+
+    # Arguments
+        val_results: numpy array returned by Hogwild.train
+        target: float, the target validation accuracy
+    """
+    for seconds, _, _, acc in val_results:
+        if acc >= target:
+            return seconds
+    return None
+
+
+_blas_limits = None
+
+
+def limit_blas_threads(num_threads):
+    """Limit the threads of the BLAS library used by numpy, through threadpoolctl if it is installed
+
+    # Returns
+        applied: boolean, False if threadpoolctl is missing (set OPENBLAS_NUM_THREADS/OMP_NUM_THREADS
+            before starting python instead)
+    """
+    global _blas_limits
+    if threadpool_limits is None:
+        warnings.warn('threadpoolctl is not installed, the number of BLAS threads is left unchanged')
+        return False
+    _blas_limits = threadpool_limits(limits=num_threads, user_api='blas')
+    return True
+
+
+class ThreadPool():
+
+    def __init__(self, num_threads):
+        """Thread pool that survives fork: a forked process (e.g. a DataParallel worker) starts its own threads
+
+        # Arguments
+            num_threads: int, the number of threads
+        """
+        self.num_threads = num_threads
+        self.pid = None
+        self.executor = None
+
+    def map(self, fn, *iterables):
+        if self.pid != os.getpid():
+            self.executor = ThreadPoolExecutor(self.num_threads)
+            self.pid = os.getpid()
+        return list(self.executor.map(fn, *iterables))
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class BatchSplit():
+
+    def __init__(self, layer, pool, min_slice=4):
+        """Run the forward and backward of a layer on slices of the batch in parallel threads
+
+        Every thread works on its own replica of the layer, which shares the
+        parameters of the layer but has its own gradients and RNN cells; the
+        replica gradients are summed into the gradients of the layer. numpy
+        releases the GIL inside BLAS calls and large ufuncs, which is where the
+        threads overlap. Used by Model.set_num_threads.
+
+        # Arguments
+            layer: Layer without state between forward and backward, e.g. FCLayer, RNN, BidirectionalRNN
+            pool: ThreadPool
+            min_slice: int, the smallest number of samples given to a thread
+        """
+        self.layer = layer
+        self.pool = pool
+        self.min_slice = min_slice
+        self.replicas = []
+
+    def _split(self, batch):
+        num_slices = min(self.pool.num_threads, batch // self.min_slice)
+        if num_slices <= 1:
+            return None, None
+        bounds = np.linspace(0, batch, num_slices+1).astype(int)
+        slices = [slice(bounds[i], bounds[i+1]) for i in range(num_slices)]
+        while len(self.replicas) < num_slices:
+            self.replicas.append(copy.deepcopy(self.layer))
+        # the parameters may have been rebound since the last call (e.g. flatten_params)
+        params, _ = self.layer.get_params('')
+        replicas = self.replicas[:num_slices]
+        for replica in replicas:
+            replica.update(params)
+            replica.set_mode(self.layer.training)
+        return slices, replicas
+
+    def forward(self, inputs):
+        slices, replicas = self._split(inputs.shape[0])
+        if slices is None:
+            return self.layer.forward(inputs)
+        outputs = self.pool.map(lambda replica, s: replica.forward(inputs[s]), replicas, slices)
+        return np.concatenate(outputs)
+
+    def backward(self, in_grads, inputs):
+        slices, replicas = self._split(inputs.shape[0])
+        if slices is None:
+            return self.layer.backward(in_grads, inputs)
+        out_grads = self.pool.map(lambda replica, s: replica.backward(in_grads[s], inputs[s]), replicas, slices)
+        # the loss gradients are already divided by the whole batch, the slices just add up
+        _, grads = self.layer.get_params('')
+        replica_grads = [replica.get_params('')[1] for replica in replicas]
+        for k, v in grads.items():
+            np.copyto(v, replica_grads[0][k])
+            for g in replica_grads[1:]:
+                v += g[k]
+        return np.concatenate(out_grads)
+
+
+class Prefetcher():
+
+    def __init__(self, loader, depth=1):
+        """Draw batches from a loader in a background thread, up to depth batches ahead of the consumer
+
+        The one-hot encoding of the next batches then overlaps the training step,
+        mostly in numpy calls that release the GIL. Batches come out in the order
+        of the loader; its exceptions are raised by next.
+
+        # Arguments
+            loader: iterator of batches, e.g. dataset.train_loader(batch)
+            depth: int, the number of batches encoded ahead
+        """
+        self.loader = loader
+        self.queue = queue.Queue(depth)
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self._fill, daemon=True)
+        self.thread.start()
+
+    def _put(self, item):
+        while not self.closed.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _fill(self):
+        try:
+            for batch in self.loader:
+                if not self._put((batch, None)):
+                    return
+            self._put((None, StopIteration()))
+        except Exception as e:
+            self._put((None, e))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        batch, error = self.queue.get()
+        if error is not None:
+            self.queue.put((None, error))
+            raise error
+        return batch
+
+    def close(self):
+        """Stop the background thread, dropping the batches encoded ahead"""
+        self.closed.set()
+        self.thread.join()
@@ -0,0 +1,347 @@
+"""
+This file defines parameter-server training of a `Model` over TCP, for workers on several machines
+(or several local processes over loopback).
+
+The server owns the parameters and the optimizer. Every worker pulls the parameters, computes
+the gradients of its shard of a batch with Model.forward/backward and pushes them back,
+compressed. Messages go through multiprocessing.connection and are unpickled, so the authkey
+handshake, which has to succeed first, is the only protection: the key must stay secret and the
+port should only be reachable from the workers (it is sent in clear text, without encryption).
+
+    export PARAMSERVER_AUTHKEY=<secret shared by the server and the workers>
+    python paramserver.py server --host 0.0.0.0 --workers 2 --port 5242 --synthetic
+    python paramserver.py worker --host <server> --port 5242 --synthetic     (on every worker machine)
+"""
+import argparse
+import multiprocessing as mp
+from multiprocessing.connection import Listener, Client, wait
+import os
+import sys
+import time
+import numpy as np
+
+
+def param_layout(model):
+    """Offset and shape of every parameter of get_params in the flat vector, list of (key, offset, shape)"""
+    base = model.flat_params.__array_interface__['data'][0]
+    layout = []
+    for k, v in model.param_views.items():
+        offset = (v.__array_interface__['data'][0] - base) // model.flat_params.itemsize
+        layout.append((k, offset, v.shape))
+    return sorted(layout, key=lambda item: item[1])
+
+
+def compress(flat_grads, layout, dtype=np.float16, row_sparse=True):
+    """Encode a flat gradient vector for the wire
+
+    # Arguments
+        flat_grads: numpy array with shape (num_params,)
+        layout: list returned by param_layout
+        dtype: numpy dtype of the values sent
+        row_sparse: boolean, send only the non-zero rows of a 2-D parameter when at most half of
+            them are non-zero, e.g. the embedding rows of the words of the batch
+
+    # Returns
+        parts: list with one entry per parameter, the values or a (rows, values) pair
+    """
+    # float16 overflows at 65504: clip rather than send inf
+    limit = np.finfo(dtype).max
+    parts = []
+    for k, offset, shape in layout:
+        grad = flat_grads[offset:offset+int(np.prod(shape))].reshape(shape)
+        if row_sparse and len(shape) == 2:
+            rows = np.flatnonzero(np.any(grad != 0, axis=1))
+            if len(rows) * 2 <= shape[0]:
+                parts.append((rows.astype(np.int32), np.clip(grad[rows], -limit, limit).astype(dtype)))
+                continue
+        parts.append(np.clip(grad, -limit, limit).astype(dtype))
+    return parts
+
+
+def decompress(parts, layout, out):
+    """Decode the parts of compress into the flat vector out (numpy array with shape (num_params,)), return out"""
+    for part, (k, offset, shape) in zip(parts, layout):
+        grad = out[offset:offset+int(np.prod(shape))].reshape(shape)
+        if isinstance(part, tuple):
+            grad[...] = 0
+            grad[part[0]] = part[1]
+        else:
+            grad[...] = part
+    return out
+
+
+def payload_nbytes(parts):
+    return sum(p[0].nbytes + p[1].nbytes if isinstance(p, tuple) else p.nbytes for p in parts)
+
+
+def run_worker(model, dataset, address, authkey):
+    """Train as a worker of the ParameterServer at address until it has run all its steps
+
+    The rank, the batch size, the number of steps and the compression come from the server.
+    The part of the dense gradients lost by a lossy compression is carried over to the next
+    push (error feedback), so that small float16 gradients are delayed rather than dropped.
+    The rounding error of row-sparse parts is dropped: carried over, it would keep every row
+    ever sent non-zero, and the encoding would grow back to dense.
+
+    # Arguments
+        model: compiled Model of the same architecture as the server model
+        dataset: dataset with train_loader(batch, shard=(rank, num_shards))
+        address: (host, port) of the server
+        authkey: bytes, shared secret of the server
+    """
+    conn = Client(tuple(address), authkey=authkey)
+    try:
+        config = conn.recv()
+        rank, num_workers = config['rank'], config['num_workers']
+        np.random.seed(config['seed'])
+        train_loader = dataset.train_loader(config['train_batch'], shard=(rank, num_workers))
+        layout = param_layout(model)
+        lossy = np.dtype(config['dtype']) != model.flat_grads.dtype
+        residual = np.zeros_like(model.flat_grads)
+        decoded = np.empty_like(model.flat_grads)
+
+        conn.send(('pull',))
+        for step in range(config['steps']):
+            version, params = conn.recv()
+            model.flat_params[...] = params
+            x, y = next(train_loader)
+            loss, probs = model.forward(x, y)
+            model.backward(y)
+            if lossy:
+                residual += model.flat_grads
+                parts = compress(residual, layout, config['dtype'], config['row_sparse'])
+                residual -= decompress(parts, layout, decoded)
+                for part, (k, offset, shape) in zip(parts, layout):
+                    if isinstance(part, tuple):
+                        residual[offset:offset+int(np.prod(shape))] = 0
+            else:
+                parts = compress(model.flat_grads, layout, config['dtype'], config['row_sparse'])
+            conn.send(('push', version, parts, float(loss), int(np.sum(np.argmax(probs, axis=-1)==y)), len(y)))
+        conn.recv()
+    finally:
+        conn.close()
+
+
+class ParameterServer():
+
+    def __init__(self, model, num_workers=2, staleness=None, dtype=np.float16, row_sparse=True,
+                 address=('127.0.0.1', 0), authkey=None, seed=5242):
+        """Parameter server for synchronous or bounded-staleness training
+
+        Synchronous (staleness=None): the server waits for the gradients of all the
+        workers on the same parameters, averages them weighted by shard size and runs
+        one optimizer update, as DataParallel. Bounded staleness: every push is one
+        optimizer update on its own, applied as it arrives, and a worker waits for its
+        next parameters while it is more than staleness pushes ahead of the slowest
+        worker (stale synchronous parallel).
+
+        # Arguments
+            model: compiled Model, its parameters and optimizer are those of the server
+            num_workers: int, the number of workers to wait for
+            staleness: int, the bound of bounded-staleness mode, None for synchronous training
+            dtype: numpy dtype of the pushed gradients
+            row_sparse: boolean, push only the non-zero rows of sparse 2-D gradients, see compress
+            address: (host, port) to listen on, port 0 for any free port; ('0.0.0.0', port) for remote workers
+            authkey: bytes, shared secret of the server and the workers, None for a random one
+                (enough for the local workers of train)
+            seed: int, numpy seed shared by all workers so that they draw the same batches
+        """
+        self.model = model
+        self.num_workers = num_workers
+        self.staleness = staleness
+        self.dtype = dtype
+        self.row_sparse = row_sparse
+        self.address = address
+        self.authkey = authkey if authkey is not None else os.urandom(32)
+        self.seed = seed
+        self.samples_per_sec = None
+        self.stats = None
+
+    def train(self, dataset, train_batch=32, val_batch=1000, test_batch=1000, epochs=5, val_intervals=100, test_intervals=500, print_intervals=100):
+        """Serve num_workers local worker processes over loopback, same arguments and returns with Model.train"""
+        listener = Listener(self.address, authkey=self.authkey)
+        ctx = mp.get_context('fork')
+        procs = [ctx.Process(target=run_worker, name='worker-%d'%rank, args=(self.model, dataset, listener.address, self.authkey))
+                 for rank in range(self.num_workers)]
+        for p in procs:
+            p.start()
+        try:
+            results = self._serve(listener, procs, dataset, train_batch, val_batch, test_batch, epochs,
+                                  val_intervals, test_intervals, print_intervals)
+        finally:
+            listener.close()
+            for p in procs:
+                p.join()
+        return results
+
+    def serve(self, dataset, train_batch=32, val_batch=1000, test_batch=1000, epochs=5, val_intervals=100, test_intervals=500, print_intervals=100):
+        """Serve num_workers workers started elsewhere with run_worker, same arguments and returns with Model.train
+
+        The dataset of the server only needs num_train and the val_loader/test_loader for the evaluations.
+        """
+        listener = Listener(self.address, authkey=self.authkey)
+        print('Listening on {}:{}'.format(*listener.address))
+        try:
+            return self._serve(listener, [], dataset, train_batch, val_batch, test_batch, epochs,
+                               val_intervals, test_intervals, print_intervals)
+        finally:
+            listener.close()
+
+    def _serve(self, listener, procs, dataset, train_batch, val_batch, test_batch, epochs, val_intervals, test_intervals, print_intervals):
+        assert train_batch >= self.num_workers, 'train_batch must be no smaller than num_workers'
+        conns = []
+        try:
+            return self._run(conns, listener, procs, dataset, train_batch, val_batch, test_batch, epochs,
+                             val_intervals, test_intervals, print_intervals)
+        finally:
+            # the workers still waiting for parameters then fail instead of hanging
+            for conn in conns:
+                conn.close()
+
+    def _run(self, conns, listener, procs, dataset, train_batch, val_batch, test_batch, epochs, val_intervals, test_intervals, print_intervals):
+        model = self.model
+        steps = epochs * (dataset.num_train // train_batch)
+        # a bounded-staleness update is the step of one worker on its shard
+        updates_per_epoch = (dataset.num_train // train_batch) * (1 if self.staleness is None else self.num_workers)
+        for rank in range(self.num_workers):
+            conn = listener.accept()
+            conn.send({'rank': rank, 'num_workers': self.num_workers, 'seed': self.seed, 'train_batch': train_batch,
+                       'steps': steps, 'dtype': np.dtype(self.dtype).str, 'row_sparse': self.row_sparse})
+            conns.append(conn)
+
+        layout = param_layout(model)
+        grads = np.zeros_like(model.flat_grads)
+        total = np.zeros_like(model.flat_grads)
+        clocks = [0] * self.num_workers
+        waiting = set()
+        pending = []
+        version = 0
+        train_results = []
+        test_results = []
+        val_results = []
+        staleness = []
+        push_bytes = []
+
+        def evaluate(iteration):
+            if iteration % updates_per_epoch == 0:
+                print('Epoch %d: '%(iteration // updates_per_epoch), end='\n')
+            if iteration % test_intervals == 0:
+                test_loss, test_acc = model.test(dataset, test_batch)
+                test_results.append([iteration, test_loss, test_acc])
+            if iteration % val_intervals == 0:
+                val_loss, val_acc = model.val(dataset, val_batch)
+                val_results.append([iteration, val_loss, val_acc])
+
+        def step(flat_grads, loss, acc):
+            # one update of the server optimizer, counted in train_results as in Model.train
+            iteration = len(train_results)
+            evaluate(iteration)
+            model.update(model.optimizer, iteration, flat_grads=flat_grads)
+            train_results.append([iteration, loss, acc])
+            if iteration % print_intervals == 0:
+                print('Iteration %d:\t'%iteration, end='')
+                print('accuracy=%.5f, loss=%.5f'%(acc, loss))
+
+        def release():
+            # bounded staleness: the waiting workers within staleness of the slowest one get parameters
+            slowest = min(clocks)
+            for rank in sorted(waiting):
+                if clocks[rank] - slowest <= self.staleness or clocks[rank] == steps:
+                    conns[rank].send((version, model.flat_params))
+                    waiting.discard(rank)
+
+        start = time.time()
+        finished = 0
+        while finished < self.num_workers:
+            # a finished worker sends nothing more, and closes its connection after the last reply
+            ready = wait([conn for rank, conn in enumerate(conns) if clocks[rank] < steps], timeout=1)
+            if not ready:
+                for p in procs:
+                    if p.exitcode not in (None, 0):
+                        raise RuntimeError('worker {} exited with code {}'.format(p.name, p.exitcode))
+                continue
+            for conn in ready:
+                rank = conns.index(conn)
+                message = conn.recv()
+                if message[0] == 'pull':
+                    conn.send((version, model.flat_params))
+                    continue
+                _, pulled, parts, loss, num_accurate, num = message
+                push_bytes.append(payload_nbytes(parts))
+                staleness.append(version - pulled)
+                clocks[rank] += 1
+                finished += clocks[rank] == steps
+                decompress(parts, layout, grads)
+                if self.staleness is None:
+                    # weight by the shard size so that uneven shards average correctly
+                    total += grads * num
+                    pending.append((loss * num, num_accurate, num))
+                    waiting.add(rank)
+                    if len(pending) == self.num_workers:
+                        num = sum(p[2] for p in pending)
+                        total /= num
+                        step(total, sum(p[0] for p in pending) / num, sum(p[1] for p in pending) / num)
+                        total[...] = 0
+                        pending = []
+                        version += 1
+                        for r in sorted(waiting):
+                            conns[r].send((version, model.flat_params))
+                        waiting.clear()
+                else:
+                    step(grads, loss, num_accurate / num)
+                    version += 1
+                    waiting.add(rank)
+                    release()
+        elapsed = time.time() - start
+
+        num_samples = steps * train_batch
+        self.samples_per_sec = num_samples / max(elapsed, 1e-12)
+        self.stats = {'seconds': elapsed, 'updates': version, 'samples_per_sec': self.samples_per_sec,
+                      'bytes_per_push': float(np.mean(push_bytes)) if push_bytes else 0.0,
+                      # a compression that degrades over time shows in the last pushes
+                      'first_bytes_per_push': float(np.mean(push_bytes[:self.num_workers])) if push_bytes else 0.0,
+                      'last_bytes_per_push': float(np.mean(push_bytes[-self.num_workers:])) if push_bytes else 0.0,
+                      'raw_bytes_per_push': model.flat_grads.nbytes,
+                      'mean_staleness': float(np.mean(staleness)) if staleness else 0.0,
+                      'max_staleness': int(np.max(staleness)) if staleness else 0}
+        return np.array(train_results), np.array(val_results), np.array(test_results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('role', choices=['server', 'worker'])
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (server, 0.0.0.0 for remote workers) or of the server (worker)')
+    parser.add_argument('--port', type=int, default=5242)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--staleness', type=int, default=None, help='bounded staleness, synchronous if not given')
+    parser.add_argument('--dtype', default='float16', help='dtype of the pushed gradients')
+    parser.add_argument('--dense', action='store_true', help='push dense gradients, without the row-sparse encoding')
+    parser.add_argument('--batch', type=int, default=32)
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--synthetic', action='store_true', help='train on random sentences instead of data/corpus.csv')
+    parser.add_argument('--vocab', type=int, default=800, help='vocabulary size of --synthetic')
+    args = parser.parse_args()
+    if not os.environ.get('PARAMSERVER_AUTHKEY'):
+        sys.exit('Set PARAMSERVER_AUTHKEY to a secret shared by the server and the workers, '
+                 'e.g. export PARAMSERVER_AUTHKEY=$(python -c "import secrets; print(secrets.token_hex(16))")')
+    authkey = os.environ['PARAMSERVER_AUTHKEY'].encode()
+
+    from applications import SentimentNet
+    from loss import SoftmaxCrossEntropy, L2
+    from optimizers import Adam
+    np.random.seed(5242)
+    if args.synthetic:
+        from benchmarks.common import SyntheticSentiment
+        dataset = SyntheticSentiment(num_train=2000, num_val=500, num_test=500, vocab_size=args.vocab)
+    else:
+        from utils import datasets
+        dataset = datasets.Sentiment()
+    model = SentimentNet(dataset.dictionary)
+    model.compile(optimizer=Adam(lr=0.001), loss=SoftmaxCrossEntropy(num_class=2), regularization=L2(w=0.001))
+    if args.role == 'worker':
+        run_worker(model, dataset, (args.host, args.port), authkey)
+    else:
+        server = ParameterServer(model, args.workers, args.staleness, np.dtype(args.dtype), not args.dense,
+                                 (args.host, args.port), authkey)
+        server.serve(dataset, train_batch=args.batch, val_batch=500, test_batch=500, epochs=args.epochs)
+        print(server.stats)
@@ -0,0 +1,174 @@
+"""
+This file defines the profiler used by `Model.profile()`.
+"""
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class Profiler():
+
+    def __init__(self, max_events=100000):
+        """Record wall time, call counts and output bytes of named sections
+
+        Statistics are kept for every call; individual events (for the Chrome
+        trace) only for the first max_events calls, so long runs do not grow
+        without bound.
+
+        # Arguments
+            max_events: int, the number of events kept for the trace
+        """
+        self.max_events = max_events
+        self.reset()
+
+    def reset(self):
+        """Forget everything recorded so far"""
+        self.stats = {}
+        self.events = []
+        self.origin = time.perf_counter()
+
+    def begin(self):
+        """Mark the start of a call, return the start to pass to record"""
+        return time.perf_counter()
+
+    def record(self, name, start, end, output=None):
+        """Add one call of name that ran from start to end (time.perf_counter seconds)
+
+        # Arguments
+            name: string, e.g. 'forward/0:embedding'
+            start: value returned by begin
+            end: float
+            output: numpy array (or anything with nbytes) returned by the call, None if no output
+        """
+        nbytes = getattr(output, 'nbytes', 0)
+        stat = self.stats.get(name)
+        if stat is None:
+            stat = self.stats[name] = [0, 0.0, 0]
+        stat[0] += 1
+        stat[1] += end - start
+        stat[2] += nbytes
+        if len(self.events) < self.max_events:
+            self.events.append((name, start, end, nbytes))
+
+    @contextmanager
+    def section(self, name):
+        """Time the body of a with statement as one call of name"""
+        start = self.begin()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter())
+
+    def summary(self, sort_by='time'):
+        """Return one dictionary per section, sorted by decreasing sort_by
+
+        # Arguments
+            sort_by: 'time', 'calls' or 'bytes'
+
+        # Returns
+            rows: list of {'name', 'calls', 'time', 'mean_time', 'bytes', 'fraction'}, times in seconds,
+                fraction is the share of the total time of all sections
+        """
+        total = sum(stat[1] for stat in self.stats.values()) or 1.0
+        rows = [{'name': name, 'calls': calls, 'time': seconds, 'mean_time': seconds / calls,
+                 'bytes': nbytes, 'fraction': seconds / total}
+                for name, (calls, seconds, nbytes) in self.stats.items()]
+        rows.sort(key=lambda row: row[sort_by], reverse=True)
+        return rows
+
+    def report(self, sort_by='time'):
+        """Format the summary as a table"""
+        lines = ['%-36s %8s %12s %12s %7s %12s'%('name', 'calls', 'total ms', 'mean ms', '%', 'output MB')]
+        for row in self.summary(sort_by):
+            lines.append('%-36s %8d %12.3f %12.4f %7.2f %12.3f'%(
+                row['name'], row['calls'], row['time']*1e3, row['mean_time']*1e3,
+                row['fraction']*100, row['bytes']/2**20))
+        return '\n'.join(lines)
+
+    def dump_json(self, path, sort_by='time'):
+        """Write the summary to path as JSON"""
+        with open(path, 'w') as f:
+            json.dump(self.summary(sort_by), f, indent=2)
+
+    def dump_chrome_trace(self, path):
+        """Write the recorded events to path in Chrome trace-event format (chrome://tracing, Perfetto)"""
+        events = [{'name': name, 'cat': name.split('/')[0], 'ph': 'X', 'pid': 0, 'tid': 0,
+                   'ts': (start - self.origin) * 1e6, 'dur': (end - start) * 1e6, 'args': {'bytes': nbytes}}
+                  for name, start, end, nbytes in self.events]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+class MemoryProfiler(Profiler):
+
+    def __init__(self, max_events=100000):
+        """Profiler that also records the memory allocated by every call through tracemalloc
+
+        numpy reports its array buffers to tracemalloc, so the numbers cover the
+        arrays as well as the Python objects. Calls must not nest, since every
+        call resets the tracemalloc peak. Only memory allocated after tracing
+        started is counted: start tracemalloc before building the model to include
+        its parameters, the profiler then leaves it running on close. Tracing slows everything down, timings
+        are only indicative in this mode.
+
+        Every summary row gets three more fields:
+            peak_bytes: the highest traced memory of the whole process during any call
+            alloc_bytes: the largest increase above the memory at the start of a call (temporaries included)
+            retained_bytes: the largest memory still held at the end of a call (e.g. outputs kept for backward)
+        """
+        self.started = not tracemalloc.is_tracing()
+        if self.started:
+            tracemalloc.start()
+        self.memory = {}
+        super(MemoryProfiler, self).__init__(max_events)
+
+    def reset(self):
+        super(MemoryProfiler, self).reset()
+        self.memory = {}
+        tracemalloc.reset_peak()
+
+    def begin(self):
+        tracemalloc.reset_peak()
+        return time.perf_counter(), tracemalloc.get_traced_memory()[0]
+
+    def record(self, name, start, end, output=None):
+        start, start_memory = start
+        current, peak = tracemalloc.get_traced_memory()
+        memory = self.memory.get(name)
+        if memory is None:
+            memory = self.memory[name] = [0, 0, 0]
+        memory[0] = max(memory[0], peak)
+        memory[1] = max(memory[1], peak - start_memory)
+        memory[2] = max(memory[2], current - start_memory)
+        super(MemoryProfiler, self).record(name, start, end, output)
+
+    def summary(self, sort_by='peak_bytes'):
+        rows = super(MemoryProfiler, self).summary('time')
+        for row in rows:
+            row['peak_bytes'], row['alloc_bytes'], row['retained_bytes'] = self.memory[row['name']]
+        rows.sort(key=lambda row: row[sort_by], reverse=True)
+        return rows
+
+    def phases(self):
+        """Peak traced memory of every phase, i.e. the names before '/': forward, backward, update, ..."""
+        peaks = {}
+        for name, (peak, _, _) in self.memory.items():
+            phase = name.split('/')[0]
+            peaks[phase] = max(peaks.get(phase, 0), peak)
+        return peaks
+
+    def report(self, sort_by='peak_bytes'):
+        lines = ['%-36s %8s %10s %12s %12s %12s'%('name', 'calls', 'total ms', 'peak MB', 'alloc MB', 'retained MB')]
+        for row in self.summary(sort_by):
+            lines.append('%-36s %8d %10.3f %12.3f %12.3f %12.3f'%(
+                row['name'], row['calls'], row['time']*1e3, row['peak_bytes']/2**20,
+                row['alloc_bytes']/2**20, row['retained_bytes']/2**20))
+        lines.append('phase peaks (MB): ' + ', '.join('%s=%.3f'%(k, v/2**20) for k, v in sorted(self.phases().items())))
+        return '\n'.join(lines)
+
+    def close(self):
+        """Stop tracemalloc if this profiler started it"""
+        if self.started and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.started = False
@@ -0,0 +1,187 @@
+"""
+This file defines magnitude pruning of the FCLayer weights of a trained `Model`, and the compact
+sparse layer that runs a pruned FCLayer at inference.
+
+Unstructured pruning zeroes the individual weights of smallest magnitude; row pruning zeroes
+whole input rows of smallest L2 norm, e.g. the embedding rows of rare words, whose weights
+barely moved from their small initialization.
+"""
+import copy
+import numpy as np
+from layers import Layer, FCLayer
+from models import Model
+
+
+def _weights_key(l, layer):
+    return 'layer-%dth:%s/weights'%(l, layer.name)
+
+
+def magnitude_masks(model, sparsity, rows=False, layers=None):
+    """Masks that keep the largest weights of FCLayers
+
+    # Arguments
+        model: compiled Model
+        sparsity: float in [0, 1), the fraction of weights (or rows) of every layer to prune
+        rows: boolean, prune whole input rows by L2 norm instead of single weights
+        layers: list of int, indices of the FCLayers in model.layers, None for all of them
+
+    # Returns
+        masks: dictionary, key of Model.get_params mapping to a boolean numpy array, with
+            shape (in_features, 1) for rows, True for the weights kept
+    """
+    if layers is None:
+        layers = [l for l, layer in enumerate(model.layers) if isinstance(layer, FCLayer)]
+    masks = {}
+    for l in layers:
+        layer = model.layers[l]
+        if not isinstance(layer, FCLayer):
+            raise ValueError('layer {} is a {}, only FCLayer can be pruned'.format(l, type(layer).__name__))
+        scores = np.linalg.norm(layer.weights, axis=1, keepdims=True) if rows else np.abs(layer.weights)
+        mask = np.ones(scores.shape, dtype=bool)
+        num_pruned = int(sparsity * scores.size)
+        if num_pruned:
+            mask.ravel()[np.argpartition(scores.ravel(), num_pruned-1)[:num_pruned]] = False
+        masks[_weights_key(l, layer)] = mask
+    return masks
+
+
+def prune(model, sparsity, rows=False, layers=None, dataset=None, **train_kwargs):
+    """Zero the smallest weights of a trained model and keep them at zero while it trains
+
+    The masks are installed with Model.set_masks, so later Model.train calls
+    (fine-tuning) never bring the pruned weights back.
+
+    # Arguments
+        model: compiled Model
+        sparsity, rows, layers: see magnitude_masks
+        dataset: dataset to fine-tune on with Model.train(dataset, **train_kwargs), None to skip
+
+    # Returns
+        masks: dictionary, see magnitude_masks
+        results: the results of Model.train, None without fine-tuning
+    """
+    masks = magnitude_masks(model, sparsity, rows, layers)
+    params, _ = model.get_params(with_grads=False)
+    for k, mask in masks.items():
+        np.multiply(params[k], mask, out=params[k])
+    model.set_masks(dict(model.masks, **masks))
+    results = model.train(dataset, **train_kwargs) if dataset is not None else None
+    return masks, results
+
+
+class SparseFCLayer(Layer):
+
+    def __init__(self, layer, dtype=None, dense_rows=0.5, sparse_inputs=0.01):
+        """Inference-only compact version of a pruned FCLayer
+
+        Only the non-zero rows are kept. Within them the weights are stored densely
+        if at least dense_rows of them are non-zero, and otherwise row by row (CSR)
+        as (column, value) pairs. The CSR forward is a gather and scatter-add over
+        the non-zero inputs only, which beats the dense matmul for the one-hot inputs
+        of an embedding but is far slower than BLAS for dense inputs: when more than
+        sparse_inputs of the inputs are non-zero, the dense weights are rebuilt for
+        that call and multiplied densely instead, so the layer saves memory at rest
+        but not time.
+
+        # Arguments
+            layer: FCLayer
+            dtype: numpy dtype of the stored weights, None to keep that of the layer
+            dense_rows: float, the density of the kept rows above which they are stored densely
+            sparse_inputs: float, the density of the inputs above which the forward is dense
+        """
+        super(SparseFCLayer, self).__init__(name=layer.name)
+        weights = layer.weights.astype(dtype or layer.weights.dtype)
+        self.in_features, self.out_features = weights.shape
+        self.rows = np.flatnonzero(np.any(weights != 0, axis=1)).astype(np.int32)
+        kept = weights[self.rows]
+        self.bias = layer.bias.astype(weights.dtype)
+        self.sparse_inputs = sparse_inputs
+        self.dense = kept.size == 0 or np.count_nonzero(kept) >= dense_rows * kept.size
+        if self.dense:
+            self.weights = kept
+        else:
+            # input row r holds the pairs indices[indptr[r]:indptr[r+1]], values[indptr[r]:indptr[r+1]]
+            row_positions, self.indices = np.nonzero(weights)
+            self.indices = self.indices.astype(np.int32)
+            self.values = weights[row_positions, self.indices]
+            self.indptr = np.concatenate([[0], np.cumsum(np.bincount(row_positions, minlength=self.in_features))]).astype(np.int64)
+            self.rows = None
+
+    def _csr_dot(self, flat):
+        # the density of the inputs is estimated on about 64 of them, scanning them all costs as much as the dense matmul
+        sample = flat[::max(1, flat.shape[0] // 64)]
+        if np.count_nonzero((sample > 0) | (sample < 0)) > self.sparse_inputs * sample.size:
+            weights = np.zeros((self.in_features, self.out_features), dtype=self.values.dtype)
+            weights[np.repeat(np.arange(self.in_features), np.diff(self.indptr)), self.indices] = self.values
+            return np.dot(flat, weights)
+        # NaN (padding) compares false both ways and is left out like a zero
+        n, r = np.nonzero((flat > 0) | (flat < 0))
+        starts = self.indptr[r]
+        counts = self.indptr[r+1] - starts
+        owners = np.repeat(np.arange(len(r)), counts)
+        entries = np.arange(owners.size) - np.repeat(np.cumsum(counts) - counts, counts) + starts[owners]
+        outputs = np.bincount(n[owners]*self.out_features + self.indices[entries], weights=flat[n, r][owners]*self.values[entries],
+                              minlength=flat.shape[0]*self.out_features)
+        return outputs.reshape(flat.shape[0], self.out_features).astype(np.result_type(flat, self.values))
+
+    def forward(self, inputs):
+        """Same inputs and outputs with FCLayer.forward"""
+        flat = inputs.reshape(-1, self.in_features)
+        if self.dense:
+            outputs = np.dot(flat[:, self.rows], self.weights)
+        else:
+            outputs = self._csr_dot(flat)
+        outputs += self.bias
+        # a NaN padding step has to give NaN even when none of its features is kept
+        outputs[np.isnan(flat[:, 0])] = np.nan
+        return outputs.reshape(inputs.shape[:-1] + (self.out_features,))
+
+    def get_compact_params(self):
+        if self.dense:
+            return {'rows': self.rows, 'weights': self.weights, 'bias': self.bias}
+        return {'indices': self.indices, 'values': self.values, 'indptr': self.indptr, 'bias': self.bias}
+
+
+def sparsify_model(model, min_sparsity=0.25, dtype=None):
+    """Convert a pruned Model into a Model for inference whose sparse FCLayers are SparseFCLayer
+
+    # Arguments
+        model: compiled Model, left unchanged
+        min_sparsity: float, FCLayers with a smaller fraction of zero weights stay dense
+        dtype: numpy dtype of the sparse weights, None to keep that of the model
+
+    # Returns
+        sparse: Model with the same forward/evaluate/test/val interface, without optimizer
+    """
+    sparse = Model()
+    for layer in model.layers:
+        if isinstance(layer, FCLayer) and np.mean(layer.weights == 0) >= min_sparsity:
+            sparse.layers.append(SparseFCLayer(layer, dtype))
+        else:
+            sparse.layers.append(copy.deepcopy(layer))
+    return sparse
+
+
+def params_nbytes(model):
+    """Bytes taken by the weights of a dense or a sparsified Model"""
+    nbytes = 0
+    for layer in model.layers:
+        if hasattr(layer, 'get_compact_params'):
+            params = layer.get_compact_params()
+        elif layer.trainable:
+            params, _ = layer.get_params('')
+        else:
+            continue
+        nbytes += sum(v.nbytes for v in params.values())
+    return nbytes
+
+
+def sparsity_report(model):
+    """Fraction of zero weights and of all-zero rows of every FCLayer, list of dictionaries"""
+    report = []
+    for l, layer in enumerate(model.layers):
+        if isinstance(layer, FCLayer):
+            report.append({'layer': l, 'name': layer.name, 'shape': layer.weights.shape,
+                           'zero_weights': float(np.mean(layer.weights == 0)),
+                           'zero_rows': float(np.mean(~np.any(layer.weights != 0, axis=1)))})
+    return report
@@ -0,0 +1,253 @@
+"""
+This file defines post-training int8 quantization of a trained `Model` for inference.
+
+Weights of FCLayer, RNN and BidirectionalRNN are quantized to int8 levels with one
+float32 scale per output channel and stay in memory as int8, an eighth of the float64
+model. Layer inputs are quantized to int8 levels with a per-tensor scale calibrated on
+validation batches. numpy has no BLAS int8 matmul, so every layer dequantizes its
+weights to float32 levels for the duration of its call and multiplies them with the
+float32 BLAS matmul; with integer inputs (one-hot words) only the weight rows of the
+words of the batch are dequantized. The sums are exact as long as
+in_features*127*127 < 2**24 (about 1000 features, or any one-hot input) and NaN
+padding flows like in the float layers.
+"""
+import copy
+import time
+import numpy as np
+from layers import Layer, FCLayer
+from rnn_layers import RNN, BidirectionalRNN
+from models import Model
+
+INT8_MAX = 127
+
+
+def quantize_per_channel(weights):
+    """Symmetric int8 quantization with one scale per output channel (last axis)
+
+    # Arguments
+        weights: numpy array with shape (in_features, out_features)
+
+    # Returns
+        q: int8 numpy array with the same shape
+        scales: float32 numpy array with shape (out_features,), weights ~= q*scales
+    """
+    scales = np.max(np.abs(weights), axis=0) / INT8_MAX
+    scales[scales == 0] = 1
+    q = np.clip(np.round(weights / scales), -INT8_MAX, INT8_MAX).astype(np.int8)
+    return q, scales.astype(np.float32)
+
+
+def quantize_inputs(inputs, scale):
+    """Round inputs to int8 levels of scale, returned as float32 so that NaN padding survives
+
+    A scale of 1 means the inputs are already integers in the int8 range (e.g. one-hot words)
+    and only need a cast.
+    """
+    if scale == 1:
+        return inputs.astype(np.float32, copy=False)
+    q = np.round(inputs / scale).astype(np.float32)
+    np.clip(q, -INT8_MAX, INT8_MAX, out=q)
+    return q
+
+
+def _int8_dot(q_inputs, q_weights, input_scale, weight_scales):
+    # np.dot only calls BLAS on 2-D float operands, fold (batch, T) into one axis
+    flat = q_inputs.reshape(-1, q_inputs.shape[-1])
+    rows = None
+    if input_scale == 1:
+        # integer inputs, e.g. one-hot words: only the rows of the non-zero inputs take part
+        padding = np.isnan(flat[:, 0])
+        rows = np.flatnonzero(np.any(flat[~padding] != 0, axis=0))
+    if rows is not None and len(rows) * 2 < flat.shape[1]:
+        outputs = np.dot(flat[:, rows], q_weights[rows].astype(np.float32))
+        outputs[padding] = np.nan
+    else:
+        outputs = np.dot(flat, q_weights.astype(np.float32))
+    outputs *= input_scale * weight_scales
+    return outputs.reshape(q_inputs.shape[:-1] + (q_weights.shape[-1],))
+
+
+class QuantizedFCLayer(Layer):
+
+    def __init__(self, layer, input_scale):
+        """Inference-only int8 version of a trained FCLayer
+
+        # Arguments
+            layer: FCLayer
+            input_scale: float, calibrated scale of the layer inputs
+        """
+        super(QuantizedFCLayer, self).__init__(name=layer.name)
+        self.weights, self.weight_scales = quantize_per_channel(layer.weights)
+        self.bias = layer.bias.astype(np.float32)
+        self.input_scale = np.float32(input_scale)
+
+    def forward(self, inputs):
+        q_inputs = quantize_inputs(inputs, self.input_scale)
+        return _int8_dot(q_inputs, self.weights, self.input_scale, self.weight_scales) + self.bias
+
+    def get_quantized_params(self):
+        return {'weights': self.weights, 'weight_scales': self.weight_scales, 'bias': self.bias}
+
+
+class QuantizedRNN(Layer):
+
+    def __init__(self, layer, input_scale):
+        """Inference-only int8 version of a trained RNN
+
+        The input projection of all time steps is one matmul; only the recurrent
+        projection runs step by step. The hidden state is in [-1, 1] (tanh), so its
+        scale is fixed to 1/127.
+
+        # Arguments
+            layer: RNN
+            input_scale: float, calibrated scale of the layer inputs
+        """
+        super(QuantizedRNN, self).__init__(name=layer.name)
+        self.kernel, self.kernel_scales = quantize_per_channel(layer.kernel)
+        self.recurrent_kernel, self.recurrent_scales = quantize_per_channel(layer.recurrent_kernel)
+        self.bias = layer.bias.astype(np.float32)
+        self.h0 = np.array(layer.h0, dtype=np.float32).reshape(-1, self.bias.size)[0]
+        self.input_scale = np.float32(input_scale)
+        self.hidden_scale = np.float32(1 / INT8_MAX)
+
+    def forward(self, inputs):
+        """Same inputs and outputs with RNN.forward"""
+        batch, time_steps, _ = inputs.shape
+        mask = ~np.all(np.isnan(inputs), axis=2)
+        q_inputs = quantize_inputs(inputs, self.input_scale)
+        projections = _int8_dot(q_inputs, self.kernel, self.input_scale, self.kernel_scales) + self.bias
+        recurrent_kernel = self.recurrent_kernel.astype(np.float32)
+        recurrent_scales = self.hidden_scale * self.recurrent_scales
+
+        outputs = np.empty((batch, time_steps, self.bias.size), dtype=np.float32)
+        hidden = np.tile(self.h0, (batch, 1))
+        for t in range(time_steps):
+            q_hidden = quantize_inputs(np.nan_to_num(hidden), self.hidden_scale)
+            hidden = np.tanh(projections[:, t] + np.dot(q_hidden, recurrent_kernel) * recurrent_scales)
+            outputs[:, t] = hidden
+        outputs[~mask] = np.nan
+        return outputs
+
+    def get_quantized_params(self):
+        return {'kernel': self.kernel, 'kernel_scales': self.kernel_scales,
+                'recurrent_kernel': self.recurrent_kernel, 'recurrent_scales': self.recurrent_scales, 'bias': self.bias}
+
+
+class QuantizedBidirectionalRNN(BidirectionalRNN):
+
+    def __init__(self, layer, input_scale):
+        """Inference-only int8 version of a trained BidirectionalRNN, reusing its forward
+
+        # Arguments
+            layer: BidirectionalRNN
+            input_scale: float, calibrated scale of the layer inputs
+        """
+        Layer.__init__(self, name=layer.name)
+        self.forward_rnn = QuantizedRNN(layer.forward_rnn, input_scale)
+        self.backward_rnn = QuantizedRNN(layer.backward_rnn, input_scale)
+
+    def get_quantized_params(self):
+        params = {'forward_' + k: v for k, v in self.forward_rnn.get_quantized_params().items()}
+        params.update({'backward_' + k: v for k, v in self.backward_rnn.get_quantized_params().items()})
+        return params
+
+
+QUANTIZED_LAYERS = {
+    FCLayer: QuantizedFCLayer,
+    RNN: QuantizedRNN,
+    BidirectionalRNN: QuantizedBidirectionalRNN,
+}
+
+
+def calibrate(model, batches):
+    """Input scale of every layer from the maximum absolute value of its inputs, ignoring NaN padding
+
+    # Arguments
+        model: compiled Model
+        batches: iterable of (x, y), e.g. a few batches of dataset.val_loader
+
+    # Returns
+        scales: list of float, one per layer of model.layers, 1 for layers whose inputs
+            are already integers in the int8 range
+    """
+    ranges = [0.0] * len(model.layers)
+    integers = [True] * len(model.layers)
+    for layer in model.layers:
+        layer.set_mode(training=False)
+    for x, y in batches:
+        model.forward(x, y)
+        for l, inputs in enumerate(model.inputs):
+            if isinstance(inputs, np.ndarray) and np.issubdtype(inputs.dtype, np.floating):
+                ranges[l] = max(ranges[l], float(np.nanmax(np.abs(inputs), initial=0)))
+                integers[l] = integers[l] and bool(np.all(np.isnan(inputs) | (inputs == np.round(inputs))))
+    for layer in model.layers:
+        layer.set_mode(training=True)
+    return [1.0 if integer and r <= INT8_MAX else max(r, 1e-12) / INT8_MAX for r, integer in zip(ranges, integers)]
+
+
+def quantize_model(model, dataset, batch=100, num_batches=4):
+    """Convert a trained Model into an int8 Model for inference
+
+    # Arguments
+        model: compiled Model, left unchanged
+        dataset: dataset with val_loader, used for calibration
+        batch: int, calibration batch size
+        num_batches: int, the number of validation batches used for calibration
+
+    # Returns
+        quantized: Model with the same forward/evaluate/test/val interface, without optimizer
+    """
+    loader = dataset.val_loader(batch)
+    batches = [b for _, b in zip(range(num_batches), loader)]
+    scales = calibrate(model, batches)
+
+    quantized = Model()
+    for l, layer in enumerate(model.layers):
+        quantized_layer = QUANTIZED_LAYERS.get(type(layer))
+        if quantized_layer is not None:
+            quantized.layers.append(quantized_layer(layer, scales[l]))
+        else:
+            quantized.layers.append(copy.deepcopy(layer))
+    return quantized
+
+
+def params_nbytes(model):
+    """Bytes taken in memory by the weights of a float or a quantized Model"""
+    nbytes = 0
+    for layer in model.layers:
+        if layer.trainable:
+            params, _ = layer.get_params('')
+        elif hasattr(layer, 'get_quantized_params'):
+            params = layer.get_quantized_params()
+        else:
+            continue
+        nbytes += sum(v.nbytes for v in params.values())
+    return nbytes
+
+
+def quantization_report(model, quantized, dataset, batch=100, repeat=3):
+    """Compare accuracy, loss, latency and weight memory of a float and a quantized Model
+
+    # Arguments
+        model: the float Model
+        quantized: Model returned by quantize_model
+        dataset: dataset with test_loader
+        batch: int, evaluation batch size
+        repeat: int, the best of repeat timings is reported
+
+    # Returns
+        report: dictionary {'float': {...}, 'int8': {...}, 'speedup', 'compression'}, each with
+            'accuracy', 'loss', 'seconds' (one pass over the test set) and 'nbytes' (weights in memory)
+    """
+    batches = list(dataset.test_loader(batch))
+    report = {}
+    for name, m in (('float', model), ('int8', quantized)):
+        seconds = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            loss, acc = m.evaluate(batches, batch, dataset.num_test)
+            seconds = min(seconds, time.perf_counter() - start)
+        report[name] = {'accuracy': float(acc), 'loss': float(loss), 'seconds': seconds, 'nbytes': params_nbytes(m)}
+    report['speedup'] = report['float']['seconds'] / report['int8']['seconds']
+    report['compression'] = report['float']['nbytes'] / report['int8']['nbytes']
+    return report
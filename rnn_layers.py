@@ -153,6 +153,14 @@ class RNN(Layer):
         self.r_kernel_grad = np.zeros(self.recurrent_kernel.shape)
         self.b_grad = np.zeros(self.bias.shape)
 
+    def build(self, input_shape):
+        if len(input_shape) != 3 or input_shape[2] != self.kernel.shape[0]:
+            raise ValueError('{} expects inputs with shape (batch, time_steps, {}), got {}'.format(self.name, self.kernel.shape[0], input_shape))
+        units = self.bias.shape[0]
+        # forward only re-tiles the initial state when the batch size changes
+        self.h0 = np.tile(np.reshape(self.h0, (-1, units))[0], (input_shape[0], 1))
+        return (input_shape[0], input_shape[1], units)
+
     def forward(self, inputs):
         """
         Run self.cell over the entire sequence of data. We assume an input
@@ -210,6 +218,9 @@ class RNN(Layer):
         batch_size = inputs.shape[0]
         time_steps = inputs.shape[1]
         out_grads = np.zeros((batch_size, time_steps, inputs.shape[2]))
+        self.kernel_grad[...] = 0
+        self.r_kernel_grad[...] = 0
+        self.b_grad[...] = 0
 
         for t in reversed(range(time_steps)):
             if t is 0:
@@ -235,6 +246,21 @@ class RNN(Layer):
                 self.recurrent_kernel = v
             elif '/bias' in k:
                 self.bias = v
+        # the cell does the computation, so it must see the same arrays
+        self.cell.kernel = self.kernel
+        self.cell.recurrent_kernel = self.recurrent_kernel
+        self.cell.bias = self.bias
+
+    def set_grads(self, grads):
+        """Rebind gradients, backward writes into them in place
+        """
+        for k, v in grads.items():
+            if '/kernel' in k:
+                self.kernel_grad = v
+            elif '/recurrent_kernel' in k:
+                self.r_kernel_grad = v
+            elif '/bias' in k:
+                self.b_grad = v
 
     def get_params(self, prefix):
         """Return parameters and gradients
@@ -281,6 +307,11 @@ class BidirectionalRNN(Layer):
         self.forward_rnn = RNN(cell, h0, 'forward_rnn')
         self.backward_rnn = RNN(copy.deepcopy(cell), hr, 'backward_rnn')
 
+    def build(self, input_shape):
+        forward_shape = self.forward_rnn.build(input_shape)
+        backward_shape = self.backward_rnn.build(input_shape)
+        return forward_shape[:2] + (forward_shape[2]+backward_shape[2],)
+
     def _reverse_temporal_data(self, x, mask):
         """ Reverse a batch of sequence data
 
@@ -346,19 +377,44 @@ class BidirectionalRNN(Layer):
     def update(self, params):
         """Update parameters with new params
         """
+        forward_params = {}
+        backward_params = {}
         for k, v in params.items():
             if '/forward_kernel' in k:
-                self.forward_rnn.kernel = v
+                forward_params['/kernel'] = v
+            elif '/forward_recurrent_kernel' in k:
+                forward_params['/recurrent_kernel'] = v
+            elif '/forward_bias' in k:
+                forward_params['/bias'] = v
+            elif '/backward_kernel' in k:
+                backward_params['/kernel'] = v
+            elif '/backward_recurrent_kernel' in k:
+                backward_params['/recurrent_kernel'] = v
+            elif '/backward_bias' in k:
+                backward_params['/bias'] = v
+        self.forward_rnn.update(forward_params)
+        self.backward_rnn.update(backward_params)
+
+    def set_grads(self, grads):
+        """Rebind gradients of the two inner RNNs
+        """
+        forward_grads = {}
+        backward_grads = {}
+        for k, v in grads.items():
+            if '/forward_kernel' in k:
+                forward_grads['/kernel'] = v
             elif '/forward_recurrent_kernel' in k:
-                self.forward_rnn.recurrent_kernel = v
+                forward_grads['/recurrent_kernel'] = v
             elif '/forward_bias' in k:
-                self.forward_rnn.bias = v
+                forward_grads['/bias'] = v
             elif '/backward_kernel' in k:
-                self.backward_rnn.kernel = v
+                backward_grads['/kernel'] = v
             elif '/backward_recurrent_kernel' in k:
-                self.backward_rnn.recurrent_kernel = v
+                backward_grads['/recurrent_kernel'] = v
             elif '/backward_bias' in k:
-                self.backward_rnn.bias = v
+                backward_grads['/bias'] = v
+        self.forward_rnn.set_grads(forward_grads)
+        self.backward_rnn.set_grads(backward_grads)
 
     def get_params(self, prefix):
         """Return parameters and gradients
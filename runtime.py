@@ -0,0 +1,339 @@
+"""
+This file is the standalone inference runtime of a SentimentNet exported by export.py.
+
+It only imports numpy: no pandas, nltk, keras, training modules or corpus, so that
+scoring workers and command line tools start in a few tens of milliseconds.
+
+    python runtime.py model.npz "what a great movie" "what a waste of time"
+"""
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+FORMAT_VERSION = 1
+
+# nltk.word_tokenize is punkt sentence splitting followed by NLTKWordTokenizer. The
+# regular expressions below are those of NLTKWordTokenizer (Apache License 2.0), with the
+# quote and ellipsis rules of the older release that built data/dictionary.csv; sentences
+# are split at ., ! or ? followed by whitespace, punkt's common case. 99.9% of the corpus
+# words come out the same.
+_SENTENCE_END = re.compile(r'(?<=[^.][.!?])\s+')
+_STARTING_QUOTES = [
+    (re.compile(r'([«“‘„]|[`]+)'), r' \1 '),
+    (re.compile(r'^\"'), r'``'),
+    (re.compile(r'(``)'), r' \1 '),
+    (re.compile(r'([ \(\[{<])(\"|\'{2})'), r'\1 `` '),
+]
+_PUNCTUATION = [
+    (re.compile(r'([^\.])(\.)([\]\)}>"\'»”’ ]*)\s*$'), r'\1 \2 \3 '),
+    (re.compile(r'([:,])([^\d])'), r' \1 \2'),
+    (re.compile(r'([:,])$'), r' \1 '),
+    (re.compile(r'\.\.\.'), r' ... '),
+    (re.compile(r'[;@#$%&]'), r' \g<0> '),
+    (re.compile(r'[\u2012-\u2015]'), r' \g<0> '),
+    (re.compile(r'([^\.])(\.)([\]\)}>"\']*)\s*$'), r'\1 \2\3 '),
+    (re.compile(r'[?!]'), r' \g<0> '),
+    (re.compile(r"([^'])' "), r"\1 ' "),
+    (re.compile(r'[*]'), r' \g<0> '),
+    (re.compile(r'[\]\[\(\)\{\}\<\>]'), r' \g<0> '),
+    (re.compile(r'--'), r' -- '),
+]
+_ENDING_QUOTES = [
+    (re.compile(r'([»”’])'), r' \1 '),
+    (re.compile(r"''"), " '' "),
+    (re.compile(r'"'), " '' "),
+    (re.compile(r'\s+'), ' '),
+    (re.compile(r"([^' ])('[sS]|'[mM]|'[dD]|') "), r'\1 \2 '),
+    (re.compile(r"([^' ])('ll|'LL|'re|'RE|'ve|'VE|n't|N'T) "), r'\1 \2 '),
+]
+_CONTRACTIONS = [re.compile(p) for p in (
+    r"(?i)\b(can)(?#X)(not)\b", r"(?i)\b(d)(?#X)('ye)\b", r"(?i)\b(gim)(?#X)(me)\b", r"(?i)\b(gon)(?#X)(na)\b",
+    r"(?i)\b(got)(?#X)(ta)\b", r"(?i)\b(lem)(?#X)(me)\b", r"(?i)\b(more)(?#X)('n)\b", r"(?i)\b(wan)(?#X)(na)(?=\s)",
+    r"(?i) ('t)(?#X)(is)\b", r"(?i) ('t)(?#X)(was)\b")]
+
+
+def tokenize(text):
+    """Lower-case words of text, following nltk.word_tokenize(text.lower())"""
+    words = []
+    for sentence in _SENTENCE_END.split(text.lower()):
+        for regexp, substitution in _STARTING_QUOTES + _PUNCTUATION:
+            sentence = regexp.sub(substitution, sentence)
+        sentence = ' ' + sentence + ' '
+        for regexp, substitution in _ENDING_QUOTES:
+            sentence = regexp.sub(substitution, sentence)
+        for regexp in _CONTRACTIONS:
+            sentence = regexp.sub(r' \1 \2 ', sentence)
+        words.extend(sentence.split())
+    return words
+
+
+def hashed_index(word, num_buckets, signed):
+    """Index of word in a hashing vocabulary, negated if its sign is -1, as utils.tools.HashingVocabulary.signed_index"""
+    h = int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'little')
+    index = h % num_buckets + 1
+    return -index if signed and h >> 63 else index
+
+
+def _reverse_valid(x, lengths):
+    """Reverse the first lengths[n] time steps of every sequence, leaving the padding in place"""
+    steps = np.arange(x.shape[1])
+    index = np.where(steps < lengths[:, None], lengths[:, None] - 1 - steps, steps)
+    return np.take_along_axis(x, index[:, :, None], axis=1)
+
+
+def _rnn(x, kernel, recurrent_kernel, bias, h0):
+    batch, time_steps, in_features = x.shape
+    projections = np.dot(x.reshape(-1, in_features), kernel).reshape(batch, time_steps, -1) + bias
+    outputs = np.empty(projections.shape, dtype=projections.dtype)
+    hidden = np.broadcast_to(h0, (batch, bias.size))
+    for t in range(time_steps):
+        hidden = np.tanh(projections[:, t] + np.dot(hidden, recurrent_kernel))
+        outputs[:, t] = hidden
+    return outputs
+
+
+def _csr_rows(indptr, indices, values, rows, num_columns):
+    """Dense rows of a CSR matrix, numpy array with shape rows.shape + (num_columns,)"""
+    flat_rows = rows.ravel()
+    starts = indptr[flat_rows]
+    counts = indptr[flat_rows+1] - starts
+    owners = np.repeat(np.arange(flat_rows.size), counts)
+    entries = np.arange(owners.size) - np.repeat(np.cumsum(counts) - counts, counts) + starts[owners]
+    dense = np.zeros((flat_rows.size, num_columns), dtype=values.dtype)
+    dense[owners, indices[entries]] = values[entries]
+    return dense.reshape(rows.shape + (num_columns,))
+
+
+def _dense(x, weights, bias):
+    return (np.dot(x.reshape(-1, x.shape[-1]), weights) + bias).reshape(x.shape[:-1] + (bias.size,))
+
+
+class PredictionCache():
+
+    def __init__(self, max_size=10000, ttl=None):
+        """Least recently used cache of the predictions of Scorer, keyed on the word indices of a text
+
+        Texts that tokenize to the same indices (case, spacing, unknown words) share
+        an entry. Every entry belongs to the weights fingerprint it was computed with;
+        the cache empties itself when it is used with other weights.
+
+        # Arguments
+            max_size: int, the number of entries kept, the least recently used is evicted first
+            ttl: float, seconds an entry stays valid, None for no expiry
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.fingerprint = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def validate(self, fingerprint):
+        """Drop all the entries if they were computed with weights other than fingerprint"""
+        with self.lock:
+            if fingerprint != self.fingerprint:
+                self.entries.clear()
+                self.fingerprint = fingerprint
+
+    def get(self, key):
+        """The value of key, None on a miss"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and entry[1] < time.monotonic():
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        with self.lock:
+            expiry = time.monotonic() + self.ttl if self.ttl is not None else None
+            self.entries[key] = (value, expiry)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """Counters since the cache was created: hits, misses, evictions, expirations, size and hit_rate"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'expirations': self.expirations,
+                    'size': len(self.entries), 'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+class Scorer():
+
+    def __init__(self, path, cache=None):
+        """Load a model exported by export.export_model
+
+        # Arguments
+            path: string, the .npz file
+            cache: PredictionCache, reuse the probabilities of texts already scored, None to disable
+        """
+        self.path = path
+        self.cache = cache
+        self._load()
+
+    def _load(self):
+        stat = os.stat(self.path)
+        self.file_version = (stat.st_mtime_ns, stat.st_size)
+        with np.load(self.path) as f:
+            arrays = {k: f[k] for k in f.files}
+        spec = json.loads(str(arrays.pop('spec')))
+        if spec['version'] != FORMAT_VERSION:
+            raise ValueError('unsupported model format version {}'.format(spec['version']))
+        self.layers = spec['layers']
+        self.max_length = spec['max_length']
+        self.labels = spec.get('labels')
+        self.hashing = spec.get('hashing')
+        words = arrays.pop('vocabulary').tobytes().decode('utf-8').split('\n')
+        # index 0 is both padding and unknown words
+        self.dictionary = dict(zip(words, range(1, len(words)+1)))
+        for l, layer in enumerate(self.layers):
+            name = 'layer-%d/'%l
+            if layer['type'] == 'dense' and name+'indptr' in arrays:
+                # the dense layers after the embedding are small: unpack them once
+                indptr = arrays.pop(name+'indptr')
+                arrays[name+'weights'] = _csr_rows(indptr, arrays.pop(name+'indices'), arrays.pop(name+'values'),
+                                                   np.arange(len(indptr)-1), arrays[name+'bias'].size)
+        self.params = arrays
+        fingerprint = hashlib.blake2b(digest_size=16)
+        for k in sorted(arrays):
+            fingerprint.update(k.encode('utf-8'))
+            fingerprint.update(np.ascontiguousarray(arrays[k]).tobytes())
+        self.fingerprint = fingerprint.hexdigest()
+
+    def reload(self):
+        """Load the file again if it was rewritten since it was loaded, return True if it was
+
+        The cached predictions of the previous weights are then dropped.
+        """
+        stat = os.stat(self.path)
+        if (stat.st_mtime_ns, stat.st_size) == self.file_version:
+            return False
+        self._load()
+        return True
+
+    def encode(self, texts):
+        """Word indices of texts
+
+        # Returns
+            ids: numpy array of int with shape (N, T), 0 for unknown words and padding, negative
+                for the words of sign -1 of a signed hashing vocabulary
+            lengths: numpy array of int with shape (N,), the number of words kept in every text
+        """
+        ids = np.zeros((len(texts), self.max_length), dtype=np.int64)
+        lengths = np.zeros(len(texts), dtype=np.int64)
+        for n, text in enumerate(texts):
+            words = tokenize(text)[:self.max_length]
+            if self.hashing:
+                ids[n, :len(words)] = [hashed_index(w, self.hashing['num_buckets'], self.hashing['signed']) for w in words]
+            else:
+                ids[n, :len(words)] = [self.dictionary.get(w, 0) for w in words]
+            lengths[n] = len(words)
+        return ids, lengths
+
+    def forward(self, ids, lengths):
+        """Class probabilities of encoded texts, numpy array with shape (N, num_class)"""
+        p = self.params
+        # padding steps past the longest text never influence the result
+        x = ids[:, :max(int(np.max(lengths, initial=0)), 1)]
+        for l, layer in enumerate(self.layers):
+            name = 'layer-%d/'%l
+            kind = layer['type']
+            if kind == 'embedding':
+                # one-hot rows times weights, i.e. a row gather; row 0 (unknown) only gets the bias
+                rows = np.abs(x) if self.hashing and self.hashing['signed'] else x
+                if name+'row_index' in p:
+                    # pruned words all share the zero row 0
+                    rows = p[name+'row_index'][rows]
+                if name+'indptr' in p:
+                    embedded = _csr_rows(p[name+'indptr'], p[name+'indices'], p[name+'values'], rows, p[name+'bias'].size)
+                else:
+                    embedded = p[name+'weights'][rows]
+                if self.hashing and self.hashing['signed']:
+                    x = embedded * np.sign(x)[:, :, None] + p[name+'bias']
+                else:
+                    x = embedded + p[name+'bias']
+            elif kind == 'dense':
+                x = _dense(x, p[name+'weights'], p[name+'bias'])
+            elif kind == 'rnn':
+                x = _rnn(x, p[name+'kernel'], p[name+'recurrent_kernel'], p[name+'bias'], p[name+'h0'])
+            elif kind == 'brnn':
+                forward_outputs = _rnn(x, p[name+'forward_kernel'], p[name+'forward_recurrent_kernel'],
+                                       p[name+'forward_bias'], p[name+'forward_h0'])
+                backward_outputs = _rnn(_reverse_valid(x, lengths), p[name+'backward_kernel'], p[name+'backward_recurrent_kernel'],
+                                        p[name+'backward_bias'], p[name+'backward_h0'])
+                x = np.concatenate([forward_outputs, _reverse_valid(backward_outputs, lengths)], axis=2)
+            elif kind == 'temporal_pooling':
+                mask = np.arange(x.shape[1]) < lengths[:, None]
+                x = np.sum(x * mask[:, :, None], axis=1) / np.maximum(lengths, 1)[:, None]
+            elif kind == 'softmax':
+                x = np.exp(x - np.max(x, axis=-1, keepdims=True))
+                x /= np.sum(x, axis=-1, keepdims=True)
+            else:
+                raise ValueError('unknown layer type {}'.format(kind))
+        return x
+
+    def predict_proba(self, texts):
+        """Class probabilities of a list of strings, numpy array with shape (N, num_class)"""
+        ids, lengths = self.encode(texts)
+        if self.cache is None:
+            return self.forward(ids, lengths)
+        self.cache.validate(self.fingerprint)
+        keys = [ids[n, :lengths[n]].tobytes() for n in range(len(texts))]
+        probs = [self.cache.get(key) for key in keys]
+        # score every distinct missing text once, in one batch
+        missing = {}
+        for n, p in enumerate(probs):
+            if p is None:
+                missing.setdefault(keys[n], n)
+        if missing:
+            rows = list(missing.values())
+            for n, p in zip(rows, self.forward(ids[rows], lengths[rows])):
+                self.cache.put(keys[n], p)
+                missing[keys[n]] = p
+            probs = [missing[key] if p is None else p for key, p in zip(keys, probs)]
+        return np.array(probs)
+
+    def predict(self, texts):
+        """Most likely class of a list of strings, numpy array of int with shape (N,)"""
+        return np.argmax(self.predict_proba(texts), axis=-1)
+
+
+def load(path, cache_size=0, ttl=None):
+    """Load an exported model, see Scorer
+
+    # Arguments
+        cache_size: int, the number of predictions cached (PredictionCache), 0 to disable
+        ttl: float, seconds a cached prediction stays valid, None for no expiry
+    """
+    return Scorer(path, PredictionCache(cache_size, ttl) if cache_size else None)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print('usage: python runtime.py model.npz text [text ...]')
+        sys.exit(1)
+    scorer = load(sys.argv[1])
+    for text, probs in zip(sys.argv[2:], scorer.predict_proba(sys.argv[2:])):
+        print('\t'.join(['%.5f'%p for p in probs] + [text]))
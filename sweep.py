@@ -0,0 +1,305 @@
+"""
+This file defines the hyperparameter sweep of SentimentNet: trials of a grid or random search
+space run in a pool of forked processes that share one encoded copy of the dataset.
+
+    python sweep.py --search grid --processes 4 --output sweep.csv
+    python sweep.py --search random --num-trials 16 --synthetic --epochs 1 --output sweep.csv
+"""
+import argparse
+import contextlib
+import csv
+import io
+import itertools
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import os
+import time
+import warnings
+import numpy as np
+from applications import SentimentNet
+from loss import SoftmaxCrossEntropy, L2
+from optimizers import SGD, Adam, Adagrad, RMSprop
+from parallel import limit_blas_threads
+from utils.tools import one_hot
+
+DEFAULTS = {
+    'embedding_size': 200,
+    'units': 50,
+    'hidden_size': 32,
+    'optimizer': 'adam',
+    'lr': 0.001,
+    'l2': 0.001,
+    'train_batch': 20,
+}
+
+OPTIMIZERS = {
+    'adam': lambda lr: Adam(lr=lr),
+    'sgd': lambda lr: SGD(lr=lr, momentum=0.9),
+    'adagrad': lambda lr: Adagrad(lr=lr),
+    'rmsprop': lambda lr: RMSprop(lr=lr),
+}
+
+
+class SharedDataset():
+
+    def __init__(self, dataset, max_length=30):
+        """Word indices of all the samples of dataset, tokenized once into shared memory
+
+        Processes forked afterwards read the same blocks, so a sweep tokenizes the
+        corpus once however many trials run. The loaders have the interface of
+        utils.datasets.Sentiment and only build the one-hot batches.
+
+        # Arguments
+            dataset: dataset with x_train/x_val/x_test, y_train/y_val/y_test, dictionary and encode_ids
+            max_length: int, time steps of every encoded sentence
+        """
+        self.dictionary = dataset.dictionary
+        self.vocab_size = len(dataset.dictionary)
+        self.max_length = max_length
+        self.blocks = []
+        for split in ('train', 'val', 'test'):
+            setattr(self, 'x_'+split, self._share(dataset.encode_ids(getattr(dataset, 'x_'+split), max_length)))
+            setattr(self, 'y_'+split, self._share(np.asarray(getattr(dataset, 'y_'+split))))
+        self.num_train = len(self.y_train)
+        self.num_val = len(self.y_val)
+        self.num_test = len(self.y_test)
+
+    def _share(self, array):
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+        shared[...] = array
+        shared.flags.writeable = False
+        self.blocks.append(block)
+        return shared
+
+    def train_loader(self, batch, shuffle=True, shard=None):
+        pointer = 0
+        while True:
+            if shuffle:
+                idx = np.random.choice(self.num_train, batch, replace=False)
+            else:
+                if pointer+batch > self.num_train:
+                    pointer = 0
+                idx = np.arange(pointer, pointer+batch)
+                pointer = pointer + batch
+            if shard is not None:
+                rank, num_shards = shard
+                idx = idx[rank::num_shards]
+            yield one_hot(self.x_train[idx], self.vocab_size), self.y_train[idx]
+
+    def _eval_loader(self, x, y, batch):
+        for pointer in range(0, len(x), batch):
+            yield one_hot(x[pointer:pointer+batch], self.vocab_size), y[pointer:pointer+batch]
+
+    def val_loader(self, batch):
+        return self._eval_loader(self.x_val, self.y_val, batch)
+
+    def test_loader(self, batch):
+        return self._eval_loader(self.x_test, self.y_test, batch)
+
+    def close(self):
+        """Release the shared memory, only in the process that created the dataset"""
+        for split in ('train', 'val', 'test'):
+            setattr(self, 'x_'+split, None)
+            setattr(self, 'y_'+split, None)
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+def grid_search(space):
+    """Every combination of the candidate values of space, a dictionary {name: list of values}"""
+    names = sorted(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[k] for k in names))]
+
+
+def random_search(space, num_trials, seed=0):
+    """num_trials random points of space, whose values are lists to choose from or callables rng -> value"""
+    rng = np.random.RandomState(seed)
+    trials = []
+    for _ in range(num_trials):
+        trial = {}
+        for k in sorted(space):
+            v = space[k]
+            trial[k] = v(rng) if callable(v) else v[rng.randint(len(v))]
+            if isinstance(trial[k], np.generic):
+                trial[k] = trial[k].item()
+        trials.append(trial)
+    return trials
+
+
+def build_trial_model(params, dictionary, max_length=30):
+    """A compiled SentimentNet for the hyperparameters params (missing ones from DEFAULTS)"""
+    params = dict(DEFAULTS, **params)
+    model = SentimentNet(dictionary, embedding_size=params['embedding_size'], units=params['units'],
+                         hidden_size=params['hidden_size'])
+    model.compile(optimizer=OPTIMIZERS[params['optimizer']](params['lr']), loss=SoftmaxCrossEntropy(num_class=2),
+                  regularization=L2(w=params['l2']) if params['l2'] else None,
+                  input_shape=(params['train_batch'], max_length, len(dictionary)))
+    return model
+
+
+# set before the pool forks, so that the workers inherit the dataset and the shared reports
+_sweep = None
+
+
+def _median_stop(index, val_results):
+    """Stop a trial whose best validation accuracy is below the median of the other trials at the same validation"""
+    config, reports = _sweep['config'], _sweep['reports']
+    k = len(val_results) - 1
+    if k >= reports.shape[1]:
+        return False
+    best = max(r[2] for r in val_results)
+    reports[index, k] = best
+    if k < config['grace']:
+        return False
+    others = np.delete(reports[:, k], index)
+    others = others[~np.isnan(others)]
+    return len(others) >= config['min_trials'] and best < np.median(others) - config['margin']
+
+
+def _init_worker():
+    # the processes already use all the cores, one BLAS thread each avoids oversubscription
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        limit_blas_threads(1)
+
+
+def _run_trial(task):
+    index, params = task
+    dataset, config = _sweep['dataset'], _sweep['config']
+    params = dict(DEFAULTS, **params)
+    seed = config['seed'] + index
+    row = dict(trial=index, seed=seed, **params)
+    start = time.time()
+    output = contextlib.nullcontext() if config['verbose'] else contextlib.redirect_stdout(io.StringIO())
+    try:
+        with output:
+            np.random.seed(seed)
+            model = build_trial_model(params, dataset.dictionary, dataset.max_length)
+            train_results, val_results, _ = model.train(
+                dataset, train_batch=params['train_batch'], val_batch=config['eval_batch'], test_batch=config['eval_batch'],
+                epochs=config['epochs'], val_intervals=config['val_intervals'], test_intervals=10**9, print_intervals=10**9,
+                early_stop=lambda results: _median_stop(index, results))
+            test_loss, test_acc = model.test(dataset, config['eval_batch'])
+        iterations_per_epoch = dataset.num_train // params['train_batch']
+        row.update(best_val_acc=float(np.max(val_results[:, 2])), val_acc=float(val_results[-1, 2]),
+                   val_loss=float(val_results[-1, 1]), test_acc=float(test_acc), test_loss=float(test_loss),
+                   iterations=len(train_results), stopped=len(train_results) < config['epochs'] * iterations_per_epoch)
+    except Exception as e:
+        row.update(error=repr(e))
+    row['seconds'] = time.time() - start
+    return row
+
+
+def sweep(dataset, trials, processes=None, epochs=5, val_intervals=100, eval_batch=100, seed=5242,
+          min_trials=3, grace=2, margin=0.0, path=None, verbose=False):
+    """Train SentimentNet on every point of trials, in parallel processes, and collect a results table
+
+    A trial is stopped early (median stopping rule) when, at one of its validations,
+    its best validation accuracy so far is more than margin below the median of the
+    best accuracies of at least min_trials other trials at the same validation. The
+    first grace validations never stop a trial. Trials are compared validation by
+    validation, so keep val_intervals*train_batch comparable across the search space.
+
+    # Arguments
+        dataset: SharedDataset
+        trials: list of dictionaries of hyperparameters (keys of DEFAULTS), e.g. from grid_search or random_search
+        processes: int, the number of worker processes, None for os.cpu_count(), 1 to run in this process
+        epochs, val_intervals: int, as in Model.train
+        eval_batch: int, validation and test batch size
+        seed: int, trial i is seeded with seed+i
+        min_trials, grace: int, margin: float, see the stopping rule above
+        path: string, write the table there as CSV, None to skip
+        verbose: boolean, keep the output of Model.train
+
+    # Returns
+        rows: list of dictionaries, one per trial sorted by decreasing best validation accuracy,
+            with the hyperparameters, 'seed', 'best_val_acc', 'val_acc', 'val_loss', 'test_acc',
+            'test_loss', 'iterations', 'stopped' and 'seconds', or 'error' if the trial failed
+    """
+    global _sweep
+    processes = processes or os.cpu_count() or 1
+    ctx = mp.get_context('fork')
+    min_batch = min(dict(DEFAULTS, **t)['train_batch'] for t in trials)
+    max_reports = epochs * (dataset.num_train // min_batch) // val_intervals + 1
+    reports = np.frombuffer(ctx.RawArray('d', len(trials) * max_reports), dtype=np.float64).reshape(len(trials), max_reports)
+    reports[...] = np.nan
+    config = dict(epochs=epochs, val_intervals=val_intervals, eval_batch=eval_batch, seed=seed,
+                  min_trials=min_trials, grace=grace, margin=margin, verbose=verbose)
+    _sweep = {'dataset': dataset, 'config': config, 'reports': reports}
+    rows = []
+    try:
+        if processes <= 1:
+            results = map(_run_trial, enumerate(trials))
+            pool = None
+        else:
+            pool = ctx.Pool(processes, initializer=_init_worker)
+            results = pool.imap_unordered(_run_trial, list(enumerate(trials)))
+        for row in results:
+            rows.append(row)
+            if 'error' in row:
+                print('trial %d failed: %s'%(row['trial'], row['error']))
+            else:
+                print('trial %d: best val acc=%.5f, test acc=%.5f, %d iterations%s, %.1fs'%(
+                    row['trial'], row['best_val_acc'], row['test_acc'], row['iterations'],
+                    ' (stopped)' if row['stopped'] else '', row['seconds']))
+        if pool is not None:
+            pool.close()
+            pool.join()
+    finally:
+        _sweep = None
+    rows.sort(key=lambda row: row.get('best_val_acc', -1), reverse=True)
+    if path:
+        write_table(rows, path)
+    return rows
+
+
+def write_table(rows, path):
+    """Write sweep results as CSV, one row per trial"""
+    columns = []
+    for row in rows:
+        columns.extend(k for k in row if k not in columns)
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--search', choices=('grid', 'random'), default='grid')
+    parser.add_argument('--num-trials', type=int, default=16, help='trials of the random search')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--val-intervals', type=int, default=100)
+    parser.add_argument('--synthetic', action='store_true', help='sweep on random sentences instead of data/corpus.csv')
+    parser.add_argument('--seed', type=int, default=5242)
+    parser.add_argument('--output', default='sweep.csv')
+    args = parser.parse_args()
+
+    np.random.seed(args.seed)
+    if args.synthetic:
+        from benchmarks.common import SyntheticSentiment
+        source = SyntheticSentiment(num_train=2000, num_val=200, num_test=200)
+    else:
+        from utils import datasets
+        source = datasets.Sentiment()
+    dataset = SharedDataset(source)
+    if args.search == 'grid':
+        trials = grid_search({'units': [25, 50], 'optimizer': ['adam', 'rmsprop'], 'lr': [0.001, 0.003], 'l2': [0.0, 0.001]})
+    else:
+        trials = random_search({
+            'embedding_size': [50, 100, 200],
+            'units': [25, 50, 100],
+            'hidden_size': [16, 32, 64],
+            'optimizer': ['adam', 'rmsprop', 'sgd', 'adagrad'],
+            'lr': lambda rng: 10 ** rng.uniform(-4, -2),
+            'l2': lambda rng: 10 ** rng.uniform(-5, -2),
+        }, args.num_trials, args.seed)
+    try:
+        rows = sweep(dataset, trials, args.processes, args.epochs, args.val_intervals, seed=args.seed, path=args.output)
+    finally:
+        dataset.close()
+    print('best: {}'.format({k: rows[0].get(k) for k in sorted(DEFAULTS)}))
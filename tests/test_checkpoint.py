@@ -0,0 +1,53 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.common import SyntheticSentiment, build_model
+from checkpoint import save_checkpoint, load_checkpoint
+from pruning import prune
+
+TRAIN = dict(train_batch=8, val_batch=32, test_batch=32, epochs=1, val_intervals=10**9, test_intervals=10**9, print_intervals=10**9)
+
+
+def _model(dataset):
+    np.random.seed(5242)
+    return build_model(dataset, lr=0.01)
+
+
+def test_pruning_masks_survive_a_checkpoint(tmp_path):
+    dataset = SyntheticSentiment(num_train=64, num_val=32, num_test=32, vocab_size=50)
+    model = _model(dataset)
+    masks, _ = prune(model, 0.5)
+    save_checkpoint(str(tmp_path / 'checkpoint'), model)
+
+    resumed = _model(dataset)
+    load_checkpoint(str(tmp_path / 'checkpoint'), resumed)
+    assert sorted(resumed.masks) == sorted(masks)
+    resumed.train(dataset, **TRAIN)
+    params, _ = resumed.get_params(with_grads=False)
+    for k, mask in masks.items():
+        assert np.all(params[k][~mask] == 0)
+
+
+def test_resume_mid_epoch_follows_the_uninterrupted_run(tmp_path):
+    dataset = SyntheticSentiment(num_train=64, num_val=32, num_test=32, vocab_size=50)
+    run = dict(TRAIN, epochs=3, val_intervals=1, checkpoint_intervals=5)
+    reference = _model(dataset)
+    train_results, val_results, _ = reference.train(dataset, **run)
+
+    # stopped at iteration 13 of 24, the last checkpoint is the one of iteration 10, in the second epoch
+    path = str(tmp_path / 'checkpoint')
+    interrupted = _model(dataset)
+    interrupted.train(dataset, checkpoint_path=path, early_stop=lambda results: results[-1][0] == 13, **run)
+    resumed = _model(dataset)
+    resumed_train, resumed_val, _ = resumed.train(dataset, checkpoint_path=path, resume=True, **run)
+
+    assert np.array_equal(resumed_train[:, 0], np.arange(24))
+    assert np.allclose(resumed_train, train_results)
+    assert np.allclose(resumed_val, val_results)
+    assert np.array_equal(resumed.flat_params, reference.flat_params)
+    assert resumed.optimizer.num_updates == reference.optimizer.num_updates
+    for k in reference.optimizer.moments:
+        assert np.array_equal(resumed.optimizer.moments[k], reference.optimizer.moments[k])
+        assert np.array_equal(resumed.optimizer.accumulators[k], reference.optimizer.accumulators[k])
@@ -0,0 +1,51 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from applications import PooledEmbeddingNet
+from benchmarks.common import SyntheticSentiment, build_model
+from distillation import soft_targets, distill
+from loss import SoftmaxCrossEntropy, SoftTargetCrossEntropy
+from optimizers import Adam
+from utils.check_grads import eval_numerical_gradient_loss, check_grads
+
+
+def test_soft_target_loss_gradients_at_a_temperature():
+    np.random.seed(5242)
+    inputs = np.random.normal(size=(6, 3))
+    targets = np.random.dirichlet(np.ones(3), size=6)
+    loss = SoftTargetCrossEntropy(num_class=3, temperature=4.0)
+    numerical = eval_numerical_gradient_loss(loss, inputs, targets)
+    assert check_grads(loss.backward(inputs, targets), numerical) < 1e-7
+
+
+def test_soft_target_loss_on_labels_is_the_plain_cross_entropy():
+    np.random.seed(5242)
+    inputs = np.random.normal(size=(6, 3))
+    labels = np.random.randint(3, size=6)
+    plain = SoftmaxCrossEntropy(num_class=3)
+    soft = SoftTargetCrossEntropy(num_class=3, temperature=4.0)
+    assert np.isclose(soft.forward(inputs, labels)[0], plain.forward(inputs, labels)[0])
+    assert np.allclose(soft.backward(inputs, labels), plain.backward(inputs, labels))
+
+
+def test_distilled_student_follows_the_teacher():
+    dataset = SyntheticSentiment(num_train=640, num_val=100, num_test=100, vocab_size=100, max_length=10)
+    np.random.seed(5242)
+    teacher = build_model(dataset, lr=0.01)
+    teacher.train(dataset, train_batch=32, val_batch=100, test_batch=100, epochs=3, val_intervals=10**9,
+                  test_intervals=10**9, print_intervals=10**9)
+    x, y = next(dataset.val_loader(100))
+    probs = soft_targets(teacher, x, y)
+    assert np.allclose(np.sum(probs, axis=1), 1)
+    softened = soft_targets(teacher, x, y, temperature=4.0)
+    assert np.all(np.max(softened, axis=1) <= np.max(probs, axis=1) + 1e-12)
+
+    student = PooledEmbeddingNet(dataset.dictionary, embedding_size=16)
+    student.compile(optimizer=Adam(lr=0.01), loss=SoftTargetCrossEntropy(num_class=2, temperature=2.0))
+    train_results, val_results = distill(teacher, student, dataset, train_batch=32, epochs=3, val_intervals=10**9,
+                                         print_intervals=10**9)
+    assert np.all(np.isfinite(train_results))
+    # agreement with the teacher over the last epoch
+    assert np.mean(train_results[-20:, 3]) > 0.8
@@ -0,0 +1,49 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import runtime
+from applications import SentimentNet
+from export import export_model
+from loss import SoftmaxCrossEntropy
+from optimizers import Adam
+from utils.tools import HashingVocabulary, one_hot
+
+WORDS = ['good', 'bad', 'movie', 'plot', 'acting', 'boring', 'fun', 'never', 'again', 'superb', 'an', 'unseen', 'word']
+
+
+@pytest.mark.parametrize('signed', [False, True])
+def test_hashing_vocabulary_indices(signed):
+    vocabulary = HashingVocabulary(num_buckets=8, signed=signed)
+    assert len(vocabulary) == 8 and 'never seen before' in vocabulary
+    indices = [vocabulary.signed_index(w) for w in WORDS]
+    assert all(1 <= abs(i) <= 8 for i in indices)
+    assert [abs(i) for i in indices] == [vocabulary[w] for w in WORDS]
+    assert any(i < 0 for i in indices) == signed
+    # the runtime hashes without utils.tools
+    assert indices == [runtime.hashed_index(w, 8, signed) for w in WORDS]
+
+    encoded = one_hot(np.array([indices[:4] + [0]]), 8)
+    assert np.isnan(encoded[0, 4]).all()
+    assert np.array_equal(np.sum(encoded[0, :4], axis=1), np.sign(indices[:4]))
+
+
+@pytest.mark.parametrize('signed', [False, True])
+def test_exported_hashing_model_matches_model_forward(tmp_path, signed):
+    vocabulary = HashingVocabulary(num_buckets=16, signed=signed)
+    np.random.seed(5242)
+    model = SentimentNet(vocabulary, embedding_size=8, units=6, hidden_size=4)
+    model.compile(optimizer=Adam(), loss=SoftmaxCrossEntropy(num_class=2))
+    model.flat_params[...] = np.random.normal(scale=0.5, size=model.flat_params.shape)
+    path = str(tmp_path / 'hashing.npz')
+    export_model(model, vocabulary, path, max_length=8)
+
+    texts = [' '.join(WORDS[i:i+5]) for i in range(0, len(WORDS), 3)]
+    ids = np.zeros((len(texts), 8), dtype=np.int64)
+    for n, text in enumerate(texts):
+        words = runtime.tokenize(text)
+        ids[n, :len(words)] = [vocabulary.signed_index(w) for w in words]
+    _, expected = model.forward(one_hot(ids, len(vocabulary)), np.zeros(len(texts), dtype=np.int64))
+    assert np.allclose(runtime.load(path).predict_proba(texts), expected, atol=1e-5)
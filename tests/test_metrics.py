@@ -0,0 +1,51 @@
+import csv
+import json
+import os
+import sys
+import threading
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.common import SyntheticSentiment, build_model
+from metrics import MetricsSink, FIELDS
+
+TRAIN = dict(train_batch=8, val_batch=32, test_batch=32, epochs=2, val_intervals=10**9, test_intervals=10**9, print_intervals=10**9)
+
+
+@pytest.mark.parametrize('format', ['jsonl', 'csv'])
+def test_records_of_a_training_run_are_all_written(tmp_path, format):
+    dataset = SyntheticSentiment(num_train=64, num_val=32, num_test=32, vocab_size=50)
+    np.random.seed(5242)
+    model = build_model(dataset)
+    path = str(tmp_path / ('metrics.' + format))
+    # 16 iterations: 5 records of 3 and a last one of 1
+    model.train(dataset, metrics=MetricsSink(path, format=format, interval=3, flush_records=2), **TRAIN)
+    with open(path) as f:
+        records = [json.loads(line) for line in f] if format == 'jsonl' else list(csv.DictReader(f))
+    assert [int(r['iteration']) for r in records] == [2, 5, 8, 11, 14, 15]
+    assert sum(int(r['samples']) for r in records) == 16 * 8
+    assert set(records[0]) == set(FIELDS)
+
+
+def test_flush_hands_the_records_to_a_background_writer(tmp_path):
+    sink = MetricsSink(str(tmp_path / 'metrics.jsonl'), interval=1, flush_records=1)
+    release = threading.Event()
+    write = sink._write
+    sink._write = lambda records: (release.wait(10), write(records))
+    sink.begin()
+    sink.end(0, 0, 0.5, 1.0)
+    # the write is blocked, the training thread is not
+    assert sink.thread.is_alive() and sink.buffer == []
+    release.set()
+    sink.close()
+    with open(str(tmp_path / 'metrics.jsonl')) as f:
+        assert len(f.readlines()) == 1
+
+
+def test_write_errors_are_raised_in_the_training_thread(tmp_path):
+    sink = MetricsSink(str(tmp_path / 'missing' / 'metrics.jsonl'), interval=1, flush_records=1)
+    sink.begin()
+    sink.end(0, 0, 0.5, 1.0)
+    with pytest.raises(OSError):
+        sink.close()
@@ -0,0 +1,64 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.common import SyntheticSentiment
+from applications import SentimentNet
+from loss import SoftmaxCrossEntropy, L2
+from optimizers import Adam
+
+
+def _sparse_model(dataset):
+    np.random.seed(5242)
+    model = SentimentNet(dataset.dictionary, sparse_embedding=True, embedding_size=16, units=8, hidden_size=8)
+    model.compile(optimizer=Adam(lr=0.01), loss=SoftmaxCrossEntropy(num_class=2), regularization=L2(w=0.001))
+    return model
+
+
+def _train(model, dataset, accumulation_steps):
+    model.train(dataset, train_batch=8, val_batch=100, test_batch=100, epochs=1, val_intervals=10**9,
+                test_intervals=10**9, print_intervals=10**9, accumulation_steps=accumulation_steps)
+
+
+def test_sparse_embedding_mixes_plain_and_accumulated_updates():
+    dataset = SyntheticSentiment(num_train=64, num_val=16, num_test=16, vocab_size=50)
+    for order in ((1, 2), (2, 1)):
+        model = _sparse_model(dataset)
+        for accumulation_steps in order:
+            _train(model, dataset, accumulation_steps)
+        assert model.optimizer.moments['flat'].shape == (model.dense_size,)
+        assert np.all(np.isfinite(model.flat_params))
+
+
+def test_flat_grads_update_matches_plain_update():
+    dataset = SyntheticSentiment(num_train=64, num_val=16, num_test=16, vocab_size=50)
+    plain, given = _sparse_model(dataset), _sparse_model(dataset)
+    x, y = next(dataset.train_loader(8, shuffle=False))
+    for model in (plain, given):
+        model.forward(x, y)
+        model.backward(y)
+    plain.update(plain.optimizer, 0)
+    given.update(given.optimizer, 0, flat_grads=given.flat_grads.copy())
+    assert np.allclose(plain.flat_params, given.flat_params)
+    for k in plain.sparse_layers:
+        assert np.array_equal(plain.optimizer.last_steps[k], given.optimizer.last_steps[k])
+
+
+def test_profiled_steps_run_the_execution_plan():
+    dataset = SyntheticSentiment(num_train=64, num_val=16, num_test=16, vocab_size=50)
+    plain, profiled = _sparse_model(dataset), _sparse_model(dataset)
+    x, y = next(dataset.train_loader(8, shuffle=False))
+    for model in (plain, profiled):
+        model.build_plan(x.shape)
+    profiler = profiled.profile()
+    for model in (plain, profiled):
+        model.forward(x, y)
+        model.backward(y)
+    assert np.array_equal(plain.flat_grads, profiled.flat_grads)
+    # the FCLayer outputs are the preallocated arrays of the plan
+    assert profiled.inputs[1] is profiled.plan['sized_forward'][0].keywords['out']
+    names = set(row['name'] for row in profiler.summary())
+    for l in range(len(profiled.layers)):
+        assert 'forward/'+profiled._layer_name(l) in names
+        assert 'backward/'+profiled._layer_name(l) in names
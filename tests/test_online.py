@@ -0,0 +1,66 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from applications import SentimentNet
+from loss import SoftmaxCrossEntropy, L2
+from online import OnlineLearner
+from optimizers import Adam
+from utils.tools import one_hot
+
+
+def _learner(max_words=None):
+    np.random.seed(5242)
+    dictionary = {'good': 1, 'bad': 2, 'movie': 3}
+    model = SentimentNet(dictionary, embedding_size=8, units=4, hidden_size=4)
+    model.compile(optimizer=Adam(lr=0.01), loss=SoftmaxCrossEntropy(num_class=2), regularization=L2(w=0.001))
+    return OnlineLearner(model, dictionary, tokenizer=str.split, max_length=7, batch=2, max_words=max_words)
+
+
+def test_words_past_max_words_are_dropped_not_padded():
+    learner = _learner(max_words=4)
+    sentences = ['good plot bad acting movie', 'bad movie unknown words here']
+    learner.add_words(sentences)
+    assert len(learner.dictionary) == 4
+    ids = learner.encode_ids(sentences)
+    assert ids.tolist() == [[1, 4, 2, 3, 0, 0, 0], [2, 3, 0, 0, 0, 0, 0]]
+
+    labels = np.array([1, 0])
+    loss, probs = learner.model.forward(one_hot(ids, len(learner.dictionary)), labels)
+    assert np.isfinite(loss) and np.all(np.isfinite(probs))
+    loss, acc = learner.partial_fit(sentences, labels, shuffle=False)
+    assert np.isfinite(loss)
+    assert np.all(np.isfinite(learner.model.flat_params))
+
+
+def test_new_words_keep_trained_ids():
+    learner = _learner()
+    embedding_size = learner.model.layers[0].weights.shape[1]
+    learner.partial_fit(['good fun', 'bad boring movie'], np.array([1, 0]), shuffle=False)
+    assert learner.dictionary == {'good': 1, 'bad': 2, 'movie': 3, 'fun': 4, 'boring': 5}
+    assert learner.model.layers[0].weights.shape == (5, embedding_size)
+
+
+def test_grow_embedding_keeps_trained_rows_and_optimizer_state():
+    learner = _learner()
+    model = learner.model
+    learner.partial_fit(['good movie', 'bad movie'], np.array([1, 0]), shuffle=False)
+    key = 'layer-0th:%s/weights'%model.layers[0].name
+    weights = model.layers[0].weights.copy()
+    start, size = model._flat_offset(key), weights.size
+    moments = model.optimizer.moments['flat'][start:start+size].copy()
+    other = model.flat_params[start+size:].copy()
+
+    model.grow_embedding(2)
+    assert np.array_equal(model.layers[0].weights[:3], weights)
+    assert np.array_equal(model.layers[0].weights[3:], np.zeros((2, weights.shape[1])))
+    assert np.array_equal(model.optimizer.moments['flat'][start:start+size], moments)
+    assert np.array_equal(model.optimizer.moments['flat'][start+size:start+size+2*weights.shape[1]], np.zeros(2*weights.shape[1]))
+    assert np.array_equal(model.flat_params[start+size+2*weights.shape[1]:], other)
+    # the new ids train like the old ones
+    x, y = one_hot(np.array([[4, 5, 1, 0]]), 5), np.array([1])
+    model.forward(x, y)
+    model.backward(y)
+    model.update(model.optimizer, learner.iteration)
+    assert np.count_nonzero(model.layers[0].weights[3:]) > 0
@@ -0,0 +1,29 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.common import SyntheticSentiment, build_model
+from parallel import DataParallel
+
+TRAIN = dict(train_batch=8, val_batch=32, test_batch=32, epochs=1, val_intervals=10**9, test_intervals=10**9, print_intervals=10**9)
+
+
+def _model(dataset):
+    np.random.seed(5242)
+    return build_model(dataset, lr=0.01)
+
+
+def test_data_parallel_hands_back_the_optimizer_state():
+    dataset = SyntheticSentiment(num_train=64, num_val=32, num_test=32, vocab_size=50)
+    serial, parallel = _model(dataset), _model(dataset)
+    np.random.seed(5242)
+    serial.train(dataset, **TRAIN)
+    DataParallel(parallel, num_workers=2).train(dataset, **TRAIN)
+
+    assert parallel.optimizer.num_updates == serial.optimizer.num_updates == 8
+    # the shards are summed in another order, Adam amplifies the rounding of the smallest gradients
+    assert np.allclose(parallel.flat_params, serial.flat_params, atol=1e-5)
+    for k in serial.optimizer.moments:
+        assert np.allclose(parallel.optimizer.moments[k], serial.optimizer.moments[k], atol=1e-5)
+        assert np.allclose(parallel.optimizer.accumulators[k], serial.optimizer.accumulators[k], atol=1e-7)
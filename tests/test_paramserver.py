@@ -0,0 +1,77 @@
+import os
+import sys
+import threading
+import numpy as np
+import pytest
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.common import SyntheticSentiment, build_model
+from paramserver import ParameterServer, param_layout, compress, decompress, payload_nbytes, run_worker
+
+TRAIN = dict(train_batch=8, val_batch=32, test_batch=32, epochs=1, val_intervals=10**9, test_intervals=10**9, print_intervals=10**9)
+
+
+def _model(dataset):
+    np.random.seed(5242)
+    return build_model(dataset, lr=0.01)
+
+
+def test_row_sparse_compression_round_trips():
+    dataset = SyntheticSentiment(num_train=64, num_val=32, num_test=32, vocab_size=200)
+    model = _model(dataset)
+    x, y = next(dataset.train_loader(8))
+    model.forward(x, y)
+    model.backward(y)
+    layout = param_layout(model)
+    parts = compress(model.flat_grads, layout, dtype=np.float64)
+    # the embedding gradient only has the rows of the words of the batch
+    assert isinstance(parts[0], tuple)
+    assert payload_nbytes(parts) < model.flat_grads.nbytes
+    assert np.array_equal(decompress(parts, layout, np.empty_like(model.flat_grads)), model.flat_grads)
+    decoded = decompress(compress(model.flat_grads, layout), layout, np.empty_like(model.flat_grads))
+    assert np.allclose(decoded, model.flat_grads, rtol=1e-3, atol=1e-7)
+
+
+def test_synchronous_server_trains_like_one_process():
+    dataset = SyntheticSentiment(num_train=64, num_val=32, num_test=32, vocab_size=200)
+    serial, served = _model(dataset), _model(dataset)
+    np.random.seed(5242)
+    train_results, _, _ = serial.train(dataset, **TRAIN)
+    server = ParameterServer(served, num_workers=1, dtype=np.float64)
+    served_results, _, _ = server.train(dataset, **TRAIN)
+    assert np.allclose(served_results, train_results)
+    assert np.allclose(served.flat_params, serial.flat_params)
+
+
+def test_bounded_staleness_with_float16_pushes():
+    dataset = SyntheticSentiment(num_train=64, num_val=32, num_test=32, vocab_size=200)
+    model = _model(dataset)
+    server = ParameterServer(model, num_workers=2, staleness=1)
+    train_results, _, _ = server.train(dataset, **TRAIN)
+    assert server.stats['updates'] == len(train_results) == 2 * 8
+    assert server.stats['last_bytes_per_push'] < server.stats['raw_bytes_per_push'] / 2
+    assert np.all(np.isfinite(model.flat_params))
+
+
+def test_worker_with_a_wrong_authkey_is_refused():
+    dataset = SyntheticSentiment(num_train=64, num_val=32, num_test=32, vocab_size=200)
+    listener = Listener(('127.0.0.1', 0), authkey=ParameterServer(_model(dataset)).authkey)
+    refused = []
+
+    def accept():
+        try:
+            listener.accept()
+        except AuthenticationError:
+            refused.append(True)
+
+    thread = threading.Thread(target=accept)
+    thread.start()
+    try:
+        with pytest.raises(AuthenticationError):
+            run_worker(_model(dataset), dataset, listener.address, b'not the key')
+        thread.join(10)
+        assert refused
+    finally:
+        listener.close()
@@ -0,0 +1,81 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import runtime
+from benchmarks.common import SyntheticSentiment, build_model
+from export import export_model
+from layers import FCLayer
+from pruning import prune, sparsify_model, params_nbytes, SparseFCLayer
+
+TRAIN = dict(train_batch=8, val_batch=32, test_batch=32, epochs=1, val_intervals=10**9, test_intervals=10**9, print_intervals=10**9)
+
+
+def _pruned(rows, vocab_size=200):
+    dataset = SyntheticSentiment(num_train=64, num_val=64, num_test=64, vocab_size=vocab_size, max_length=10)
+    np.random.seed(5242)
+    model = build_model(dataset, lr=0.01)
+    model.flat_params[...] = np.random.normal(scale=0.3, size=model.flat_params.shape)
+    masks, _ = prune(model, 0.8, rows=rows, dataset=dataset, **TRAIN)
+    return dataset, model, masks
+
+
+@pytest.mark.parametrize('rows', [False, True])
+def test_fine_tuning_keeps_pruned_weights_at_zero(rows):
+    _, model, masks = _pruned(rows)
+    params, _ = model.get_params(with_grads=False)
+    for k, mask in masks.items():
+        assert np.all(params[k][~np.broadcast_to(mask, params[k].shape)] == 0)
+        assert np.count_nonzero(params[k]) > 0
+
+
+@pytest.mark.parametrize('rows', [False, True])
+def test_sparsified_model_predicts_like_the_masked_model(rows):
+    dataset, model, _ = _pruned(rows)
+    sparse = sparsify_model(model)
+    dense = [layer.dense for layer in sparse.layers if isinstance(layer, SparseFCLayer)]
+    # row pruning keeps dense rows, unstructured pruning stores (at least the embedding) as CSR
+    assert dense and (all(dense) if rows else not dense[0])
+    assert params_nbytes(sparse) < params_nbytes(model)
+
+    x, y = next(dataset.test_loader(64))
+    for layer in model.layers:
+        layer.set_mode(training=False)
+    expected_loss, expected = model.forward(x, y)
+    loss, probs = sparse.forward(x, y)
+    assert np.allclose(probs, expected)
+    assert np.isclose(loss, expected_loss)
+
+
+def test_csr_forward_matches_dense_for_sparse_and_dense_inputs():
+    np.random.seed(5242)
+    weights = np.random.normal(size=(300, 20)) * (np.random.uniform(size=(300, 20)) < 0.1)
+    fc = FCLayer(300, 20)
+    fc.weights, fc.bias = weights, np.arange(20.0)
+    layer = SparseFCLayer(fc)
+    assert not layer.dense
+    one_hot = np.zeros((4, 5, 300))
+    one_hot[np.arange(4)[:, None], np.arange(5), np.random.randint(300, size=(4, 5))] = 1
+    one_hot[0, 3:] = np.nan
+    dense = np.random.normal(size=(4, 5, 300))
+    for inputs in (one_hot, dense):
+        expected = np.dot(inputs, weights) + np.arange(20.0)
+        assert np.allclose(layer.forward(inputs), expected, equal_nan=True)
+
+
+def test_exported_pruned_model_matches_the_masked_model(tmp_path):
+    dataset, model, _ = _pruned(rows=False)
+    dictionary = {'w%d'%i: i+1 for i in range(dataset.vocab_size)}
+    path = str(tmp_path / 'pruned.npz')
+    export_model(model, dictionary, path, max_length=dataset.max_length, dtype=np.float64)
+    with np.load(path) as f:
+        assert 'layer-0/indptr' in f.files
+
+    ids = dataset.x_test[:16]
+    texts = [' '.join('w%d'%(i-1) for i in row if i) for row in ids]
+    for layer in model.layers:
+        layer.set_mode(training=False)
+    _, expected = model.forward(dataset._one_hot_encoding(ids), dataset.y_test[:16])
+    assert np.allclose(runtime.load(path).predict_proba(texts), expected)
@@ -0,0 +1,34 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.common import SyntheticSentiment, build_model
+from quantization import quantize_model, params_nbytes
+
+
+@pytest.mark.parametrize('vocab_size', [50, 2000])
+def test_int8_weights_stay_resident_and_predict_like_the_float_model(vocab_size):
+    # with 2000 words a batch touches under half of the embedding rows, the gathered path
+    dataset = SyntheticSentiment(num_train=64, num_val=64, num_test=64, vocab_size=vocab_size, max_length=10)
+    np.random.seed(5242)
+    model = build_model(dataset)
+    model.flat_params[...] = np.random.normal(scale=0.3, size=model.flat_params.shape)
+    quantized = quantize_model(model, dataset, batch=32, num_batches=2)
+
+    for layer in quantized.layers:
+        if hasattr(layer, 'get_quantized_params'):
+            params = layer.get_quantized_params()
+            assert all(params[k].dtype == np.int8 for k in params if k in ('weights', 'kernel', 'recurrent_kernel',
+                       'forward_kernel', 'forward_recurrent_kernel', 'backward_kernel', 'backward_recurrent_kernel'))
+    assert params_nbytes(model) / params_nbytes(quantized) > 7
+
+    x, y = next(dataset.test_loader(64))
+    for layer in model.layers:
+        layer.set_mode(training=False)
+    _, expected = model.forward(x, y)
+    _, probs = quantized.forward(x, y)
+    assert np.all(np.isfinite(probs))
+    assert np.max(np.abs(probs - expected)) < 0.1
+    assert np.mean(np.argmax(probs, axis=-1) == np.argmax(expected, axis=-1)) >= 0.9
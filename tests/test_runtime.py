@@ -0,0 +1,73 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import runtime
+from applications import SentimentNet
+from export import export_model
+from loss import SoftmaxCrossEntropy
+from optimizers import Adam
+from utils.tools import one_hot
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+SENTENCES = [
+    'This movie was great!',
+    "I didn't like it, but the acting wasn't bad.",
+    "It's the best film i've seen (really) -- 10/10",
+    '"Wow" she said; $5 isn\'t much',
+    "can't stop, won't stop... gonna watch it again",
+    'the plot: thin; the cast: superb',
+    "you'll love it, they're great & fun",
+]
+
+
+def test_tokenize_matches_nltk_word_tokenizer():
+    nltk = pytest.importorskip('nltk')
+    for sentence in SENTENCES:
+        # preserve_line: one sentence, without the punkt model
+        assert runtime.tokenize(sentence) == nltk.word_tokenize(sentence.lower(), preserve_line=True)
+
+
+def test_tokenize_reproduces_the_corpus_dictionary():
+    pd = pytest.importorskip('pandas')
+    # data/dictionary.csv holds the nltk.word_tokenize words of data/corpus.csv
+    dictionary = set(pd.read_csv(os.path.join(DATA, 'dictionary.csv'), sep='\t', header=None, keep_default_na=False)[0].astype(str))
+    corpus = pd.read_csv(os.path.join(DATA, 'corpus.csv'), sep='\t', header=None)
+    words = [w for sentence in corpus[1] for w in runtime.tokenize(sentence)]
+    assert np.mean([w in dictionary for w in words]) >= 0.998
+
+
+def _model(dictionary):
+    np.random.seed(5242)
+    model = SentimentNet(dictionary, embedding_size=8, units=6, hidden_size=4)
+    model.compile(optimizer=Adam(), loss=SoftmaxCrossEntropy(num_class=2))
+    # far from the near-uniform initialization, so that every layer matters
+    model.flat_params[...] = np.random.normal(scale=0.5, size=model.flat_params.shape)
+    return model
+
+
+@pytest.mark.parametrize('dtype, tolerance', [(np.float64, 1e-12), (np.float32, 1e-5)])
+def test_exported_model_matches_model_forward(tmp_path, dtype, tolerance):
+    # the runtime gives unknown words a step of their own, the model has no input for them
+    texts = SENTENCES + [SENTENCES[0].upper(), SENTENCES[1], 'great great great']
+    words = sorted(set(w for text in SENTENCES for w in runtime.tokenize(text)))
+    dictionary = {w: i+1 for i, w in enumerate(words)}
+    model = _model(dictionary)
+    path = str(tmp_path / 'model.npz')
+    export_model(model, dictionary, path, max_length=12, dtype=dtype)
+
+    ids = np.zeros((len(texts), 12), dtype=np.int64)
+    for n, text in enumerate(texts):
+        words = runtime.tokenize(text)[:12]
+        ids[n, :len(words)] = [dictionary[w] for w in words]
+    _, expected = model.forward(one_hot(ids, len(dictionary)), np.zeros(len(texts), dtype=np.int64))
+
+    assert np.allclose(runtime.load(path).predict_proba(texts[:-3]), expected[:-3], atol=tolerance)
+    cached = runtime.load(path, cache_size=100)
+    first = cached.predict_proba(texts)
+    second = cached.predict_proba(texts)
+    assert cached.cache.hits >= len(texts)
+    assert np.allclose(first, expected, atol=tolerance)
+    assert np.array_equal(first, second)
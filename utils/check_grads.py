@@ -134,4 +134,169 @@ def check_grads_loss(layer, inputs, targets):
             print('inputs {}: {}'.format(i, inputs_result))
     else:
         inputs_result = check_grads(cacul_grads, numer_grads)
-        print('inputs:', inputs_result)
\ No newline at end of file
+        print('inputs:', inputs_result)
+
+# The checks below scale to realistic layer sizes: they sample coordinates instead of
+# sweeping all of them, perturb one coordinate of every sample in the same forward pass
+# (samples of a batch are independent), check directional derivatives along random
+# directions, and can spread the forward passes over a process pool.
+
+_job = None
+
+
+def _forward(layer, inputs, single_input):
+    return layer.forward(inputs[0] if single_input else inputs)
+
+
+def _sample_objectives(layer, inputs, in_grads, single_input):
+    """sum(outputs * in_grads) of every sample, NaN outputs (padding) count as 0"""
+    outputs = _forward(layer, inputs, single_input)
+    return np.sum((np.nan_to_num(outputs) * in_grads).reshape(len(in_grads), -1), axis=1)
+
+
+def _perturbed(inputs, i, delta):
+    perturbed = list(inputs)
+    perturbed[i] = inputs[i] + delta
+    return perturbed
+
+
+def _numerical(unit):
+    """Central difference of one unit of work, run in the current process or in a pool worker"""
+    layer, inputs, in_grads, single_input, params, h = _job
+    kind, name, arg = unit
+    if kind == 'inputs':
+        # arg: multi-indices with at most one coordinate per sample
+        delta = np.zeros_like(inputs[name])
+        delta[arg] = h
+        pos = _sample_objectives(layer, _perturbed(inputs, name, delta), in_grads, single_input)
+        neg = _sample_objectives(layer, _perturbed(inputs, name, -delta), in_grads, single_input)
+        return (pos - neg)[arg[0]] / (2 * h)
+    if kind == 'inputs_direction':
+        pos = np.sum(_sample_objectives(layer, _perturbed(inputs, name, h*arg), in_grads, single_input))
+        neg = np.sum(_sample_objectives(layer, _perturbed(inputs, name, -h*arg), in_grads, single_input))
+        return (pos - neg) / (2 * h)
+
+    v = params[name]
+    old = v.copy()
+    delta = np.zeros_like(v)
+    if kind == 'param':
+        delta[arg] = h
+    else:
+        delta[...] = h * arg
+    v += delta
+    pos = np.sum(_sample_objectives(layer, inputs, in_grads, single_input))
+    v[...] = old - delta
+    neg = np.sum(_sample_objectives(layer, inputs, in_grads, single_input))
+    v[...] = old
+    return (pos - neg) / (2 * h)
+
+
+def _run(units, processes):
+    if processes <= 1:
+        return [_numerical(unit) for unit in units]
+    import multiprocessing as mp
+    # forked workers inherit _job, only the units and the results are pickled
+    with mp.get_context('fork').Pool(processes) as pool:
+        return pool.map(_numerical, units, chunksize=max(1, len(units) // (4 * processes)))
+
+
+def _input_rounds(x, num_samples, rng):
+    """Random finite coordinates of x, grouped into rounds with at most one coordinate per sample"""
+    finite = np.flatnonzero(~np.isnan(x))
+    chosen = rng.choice(finite, min(num_samples, finite.size), replace=False)
+    multi = np.unravel_index(chosen, x.shape)
+    order = np.argsort(multi[0], kind='stable')
+    multi = tuple(m[order] for m in multi)
+    # rank of every coordinate among the coordinates of the same sample
+    starts = np.searchsorted(multi[0], multi[0])
+    ranks = np.arange(len(multi[0])) - starts
+    return [tuple(m[ranks == r] for m in multi) for r in range(ranks.max()+1 if ranks.size else 0)]
+
+
+def _random_direction(x, rng):
+    u = rng.standard_normal(x.shape)
+    u[np.isnan(x)] = 0
+    return u / max(np.linalg.norm(u), 1e-12)
+
+
+def eval_numerical_gradient_sampled(layer, inputs, in_grads, num_samples=100, num_directions=10, h=1e-5, processes=1, seed=0):
+    """Numerical gradients on random coordinates and along random directions
+
+    # Arguments
+        layer: Layer, whose outputs depend on every sample of the batch independently
+        inputs: numpy array or list of numpy arrays with the batch as first axis
+        in_grads: numpy array, gradients to the outputs
+        num_samples: int, the number of random coordinates of every input and parameter
+        num_directions: int, the number of random directions of every input and parameter
+        h: float, the finite difference step
+        processes: int, the number of processes to spread the forward passes over
+        seed: int, seed of the sampling
+
+    # Returns
+        checks: dictionary, 'inputs-i' or parameter key mapping to
+            (coordinates, numerical gradients at coordinates, directions, numerical directional derivatives)
+    """
+    global _job
+    rng = np.random.RandomState(seed)
+    single_input = not isinstance(inputs, list)
+    inputs = [inputs] if single_input else list(inputs)
+    params = layer.get_params('-')[0] if layer.trainable else {}
+
+    units = []
+    layout = {}
+    for i, x in enumerate(inputs):
+        rounds = _input_rounds(x, num_samples, rng)
+        directions = [_random_direction(x, rng) for _ in range(num_directions)]
+        layout['inputs-%d'%i] = (rounds, directions, len(units))
+        units += [('inputs', i, r) for r in rounds] + [('inputs_direction', i, u) for u in directions]
+    for k, v in params.items():
+        coordinates = [np.unravel_index(c, v.shape) for c in rng.choice(v.size, min(num_samples, v.size), replace=False)]
+        directions = [_random_direction(v, rng) for _ in range(num_directions)]
+        layout[k] = (coordinates, directions, len(units))
+        units += [('param', k, c) for c in coordinates] + [('param_direction', k, u) for u in directions]
+
+    _job = (layer, inputs, in_grads, single_input, params, h)
+    try:
+        values = _run(units, processes)
+    finally:
+        _job = None
+
+    checks = {}
+    for name, (coordinates, directions, start) in layout.items():
+        numer = values[start:start+len(coordinates)]
+        directional = np.array(values[start+len(coordinates):start+len(coordinates)+len(directions)])
+        if name.startswith('inputs-'):
+            # every round gives one value per coordinate, concatenate the rounds
+            coordinates = tuple(np.concatenate(c) for c in zip(*coordinates)) if coordinates else ()
+            numer = np.concatenate(numer) if numer else np.zeros(0)
+        else:
+            coordinates = tuple(np.array(c) for c in zip(*coordinates))
+            numer = np.array(numer)
+        checks[name] = (coordinates, numer, directions, directional)
+    return checks
+
+
+def check_grads_layer_sampled(layer, inputs, in_grads, num_samples=100, num_directions=10, h=1e-5, processes=1, seed=0):
+    """check_grads_layer for realistic sizes, on random coordinates and random directions
+
+    # Returns
+        results: dictionary, 'inputs-i' or parameter key mapping to
+            (relative error on the coordinates, relative error of the directional derivatives)
+    """
+    checks = eval_numerical_gradient_sampled(layer, inputs, in_grads, num_samples, num_directions, h, processes, seed)
+    cacul_grads = layer.backward(in_grads, inputs)
+    if not isinstance(cacul_grads, list):
+        cacul_grads = [cacul_grads]
+    analytic = {'inputs-%d'%i: g for i, g in enumerate(cacul_grads)}
+    if layer.trainable:
+        analytic.update(layer.get_params('-')[1])
+
+    print('<1e-6 will be fine')
+    results = {}
+    for name, (coordinates, numer, directions, directional) in checks.items():
+        grad = np.nan_to_num(analytic[name])
+        sampled_result = check_grads(grad[coordinates], numer) if len(numer) else 0.0
+        directional_result = check_grads(np.array([np.sum(grad*u) for u in directions]), directional) if directions else 0.0
+        results[name] = (sampled_result, directional_result)
+        print('Gradients to {}: sampled {}, directional {}'.format(name, sampled_result, directional_result))
+    return results
@@ -2,19 +2,33 @@ import os
 import numpy as np
 import pandas as pd
 import nltk
+from utils.tools import HashingVocabulary
 
 
 class Sentiment():
 
-    def __init__(self, data_rpath='data/'):
+    def __init__(self, data_rpath='data/', num_buckets=None, signed_hashing=False, rebuild_dictionary=True):
+        """Sentiment corpus
+
+        # Arguments
+            data_rpath: string, directory of corpus.csv
+            num_buckets: int, hash the words into this many ids (utils.tools.HashingVocabulary) instead
+                of building a dictionary of the corpus, None to build the dictionary
+            signed_hashing: boolean, encode the hashed words as +1 or -1 (see HashingVocabulary)
+            rebuild_dictionary: boolean, False to keep the ids of an existing dictionary.csv, e.g. one
+                extended by online.OnlineLearner, instead of rebuilding it (which can renumber the words)
+        """
         # download nltk tokenizer
         nltk.download('punkt')
         # load data
         self._load_data(os.path.join(data_rpath, 'corpus.csv'))
+        if num_buckets:
+            self.dictionary = HashingVocabulary(num_buckets, signed_hashing)
+            return
         # build dictionary from data
         dictionary_path = os.path.join(data_rpath, 'dictionary.csv')
-        # if not os.path.exists(dictionary_path):
-        self._build_dictionary(np.concatenate([self.x_train, self.x_test, self.x_val]), dictionary_path)
+        if rebuild_dictionary or not os.path.exists(dictionary_path):
+            self._build_dictionary(np.concatenate([self.x_train, self.x_test, self.x_val]), dictionary_path)
         self.dictionary = self._load_dictionary(dictionary_path)
 
     def _load_data(self, path, val_size=100, test_size=100):
@@ -61,7 +75,16 @@ class Sentiment():
             dic[data.values[i][0]] = i+1
         return dic
 
-    def train_loader(self, batch, shuffle=True):
+    def train_loader(self, batch, shuffle=True, shard=None):
+        """Yield training batches forever
+
+        # Arguments
+            batch: int, the number of samples in the full batch
+            shuffle: boolean, sample random batches or sweep the data in order
+            shard: tuple (rank, num_shards) or None, only yield the rank-th slice of
+                every batch. Loaders created with the same numpy seed draw identical
+                batches, so the shards of different workers never overlap.
+        """
         pointer = 0
         while True:
             if shuffle:
@@ -74,6 +97,9 @@ class Sentiment():
                     pointer = 0
                     idx = np.arange(pointer, pointer+batch)
                     pointer = pointer + batch
+            if shard is not None:
+                rank, num_shards = shard
+                idx = idx[rank::num_shards]
             yield self._one_hot_encoding(self.x_train[idx]), self.y_train[idx]
 
     def test_loader(self, batch):
@@ -102,6 +128,22 @@ class Sentiment():
         else:
             return None
 
+    def _word_index(self, word):
+        if isinstance(self.dictionary, HashingVocabulary):
+            return self.dictionary.signed_index(word)
+        return self.dictionary[word]
+
+    def encode_ids(self, sentences, max_length=30):
+        """Word indices of sentences, numpy array of int32 with shape (N, max_length), 0 for padding
+
+        With signed hashing, the index of a word whose sign is -1 is negated.
+        """
+        ids = np.zeros((len(sentences), max_length), dtype=np.int32)
+        for n, s in enumerate(sentences):
+            words = nltk.word_tokenize(s.lower())[:max_length]
+            ids[n, :len(words)] = [self._word_index(w) for w in words]
+        return ids
+
     def _one_hot_encoding(self, sentences, max_length=30):
         vocab_size = len(self.dictionary)
         wordvecs = [] # of shape (N, T, V)
@@ -113,12 +155,12 @@ class Sentiment():
             for idx, w in enumerate(words):
                 if idx >= max_length:
                     break
-                tmpw[idx] = self.dictionary[w]
+                tmpw[idx] = self._word_index(w)
                 tmpm[idx] = 1
             one_hot = [[0 for i in range(vocab_size)] for j in range(max_length)] # (T, V)
             for i in range(len(tmpw)):
                 if tmpw[i]:
-                    one_hot[i][tmpw[i]-1] = 1
+                    one_hot[i][abs(tmpw[i])-1] = 1 if tmpw[i] > 0 else -1
             one_hot = np.asarray(one_hot, dtype=np.float32)
             tmpm = np.asarray(tmpm, dtype=np.bool)
             one_hot[~tmpm, :] = np.nan
@@ -1,6 +1,8 @@
 import numpy as np
+import hashlib
 import math 
 import sys
+from functools import lru_cache
 
 class Initializer():
     
@@ -45,6 +47,74 @@ class MSRA(Initializer):
     def initialize(self, size):
         return np.random.normal(0, math.sqrt(2/self.fan_in), size=size)
 
+class RowSparse():
+
+    def __init__(self, rows, values):
+        """Gradient that is zero except for a few rows
+
+        # Arguments
+            rows: numpy array of int with shape (R,), sorted unique row indices
+            values: numpy array with shape (R, ...), gradients of those rows
+        """
+        self.rows = rows
+        self.values = values
+
+    def to_dense(self, shape):
+        dense = np.zeros(shape)
+        dense[self.rows] = self.values
+        return dense
+
+@lru_cache(maxsize=2**16)
+def word_hash(word):
+    """64-bit hash of a word, the same in every process and python version (unlike hash)"""
+    return int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'little')
+
+class HashingVocabulary():
+
+    def __init__(self, num_buckets=2**15, signed=False):
+        """Vocabulary of the hashing trick, usable wherever a word to index dictionary is
+
+        Every word, seen in the corpus or not, maps to one of num_buckets indices in
+        [1, num_buckets] (0 stays the padding), so the embedding and the one-hot
+        width are fixed whatever the corpus and no dictionary has to be built.
+
+        # Arguments
+            num_buckets: int, the vocabulary size V
+            signed: boolean, give every word a sign +-1 from another bit of its hash, which
+                multiplies its one-hot value, so that colliding words cancel out on average
+        """
+        self.num_buckets = num_buckets
+        self.signed = signed
+
+    def __len__(self):
+        return self.num_buckets
+
+    def __contains__(self, word):
+        return True
+
+    def __getitem__(self, word):
+        return word_hash(word) % self.num_buckets + 1
+
+    def get(self, word, default=None):
+        return self[word]
+
+    def signed_index(self, word):
+        """Index of word, negated when the sign of word is -1"""
+        h = word_hash(word)
+        index = h % self.num_buckets + 1
+        return -index if self.signed and h >> 63 else index
+
+def one_hot(ids, vocab_size):
+    """One-hot encoding of word indices, NaN at the padding (index 0), as utils.datasets.Sentiment encodes
+
+    Negative indices (signed hashing) are encoded as -1.
+    """
+    encoded = np.zeros(ids.shape + (vocab_size,), dtype=np.float32)
+    n, t = np.nonzero(ids)
+    encoded[n, t, np.abs(ids[n, t])-1] = np.sign(ids[n, t])
+    encoded[ids == 0, :] = np.nan
+    return encoded
+
 def clip_gradients(in_grads, clip=1):
     return np.clip(in_grads, -clip, clip)
 